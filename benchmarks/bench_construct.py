@@ -0,0 +1,56 @@
+"""
+Compare validated construction of a Study with the unvalidated
+model_construct path, for trusted AMBIT JSON.
+
+    python benchmarks/bench_construct.py [--copies 10] [--repeat 5]
+"""
+
+import argparse
+import json
+import timeit
+from pathlib import Path
+
+import pyambit.datamodel as mb
+
+STUDY_JSON = (
+    Path(__file__).parent.parent / "tests" / "pyambit" / "resources" / "study.json"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--copies", type=int, default=10, help="repeat the studies in the payload"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(STUDY_JSON, "r", encoding="utf-8") as file:
+        json_study = json.load(file)
+    json_study = {"study": json_study["study"] * args.copies}
+    effects = sum(len(papp["effects"]) for papp in json_study["study"])
+
+    validated = min(
+        timeit.repeat(lambda: mb.Study(**json_study), number=1, repeat=args.repeat)
+    )
+    trusted = min(
+        timeit.repeat(
+            lambda: mb.Study.model_construct(**json_study),
+            number=1,
+            repeat=args.repeat,
+        )
+    )
+    print(
+        "{} studies, {} effects: Study(**json) {:.4f}s, "
+        "Study.model_construct(**json) {:.4f}s, speedup {:.1f}x".format(
+            len(json_study["study"]),
+            effects,
+            validated,
+            trusted,
+            validated / trusted,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Payloads for the benchmark suite: the bundled study.json and synthetic
+studies shaped like it, scaled by effect count, axis cardinalities and
+array size.
+"""
+
+import json
+from pathlib import Path
+
+from pyambit import synthetic
+
+RESOURCES = Path(__file__).parent.parent / "tests" / "pyambit" / "resources"
+
+
+def load_json(name):
+    with open(RESOURCES / name, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def dose_response_json(n_papp=4, n_conc=8, n_time=3, n_replicate=3, n_material=2):
+    """
+    study.json like payload: every papp has one EffectRecord per
+    CONCENTRATION x E.EXPOSURE_TIME x REPLICATE x MATERIAL combination.
+    """
+    return synthetic.study_json(
+        n_studies=n_papp,
+        n_conc=n_conc,
+        n_time=n_time,
+        n_replicate=n_replicate,
+        n_materials=n_material,
+        seed=42,
+    )
+
+
+def spectra_study(n_papp=2, n_spectra=10, n_points=1024):
+    """
+    Raman like spectra, one 2D EffectArray per papp.
+    """
+    return synthetic.synthetic_study(
+        n_studies=n_papp,
+        effects_per_study=0,
+        spectra_per_study=n_spectra,
+        spectrum_length=n_points,
+        seed=42,
+    )
+
+
+def substances_json(study_json, n_substances=1):
+    """
+    substance.json with n copies of its substance, the studies attached.
+    """
+    template = load_json("substance.json")["substance"][0]
+    return {
+        "substance": [
+            dict(template, i5uuid="SYNT-{}".format(i), study=study_json["study"])
+            for i in range(n_substances)
+        ]
+    }
@@ -0,0 +1,146 @@
+"""
+Compare the bulk and the row by row fill of
+ProtocolApplication.create_multidimensional_matrix.
+
+    python benchmarks/bench_matrix.py [--repeat 5]
+"""
+
+import argparse
+import functools
+import json
+import timeit
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import pyambit.datamodel as mb
+
+STUDY_JSON = (
+    Path(__file__).parent.parent / "tests" / "pyambit" / "resources" / "study.json"
+)
+
+
+def collect_matrix_inputs(study: mb.Study):
+    """
+    Record the DataFrames convert_effectrecords2array passes to
+    create_multidimensional_matrix.
+    """
+    inputs = []
+    original = mb.ProtocolApplication.create_multidimensional_matrix
+
+    def record(self, df, signal_col, axes, alt_axes=None, errors_col=None, aux=None):
+        inputs.append((df.copy(), signal_col, alt_axes, errors_col, aux))
+        return original(self, df, signal_col, axes, alt_axes, errors_col, aux)
+
+    mb.ProtocolApplication.create_multidimensional_matrix = record
+    try:
+        for papp in study.study:
+            papp.convert_effectrecords2array()
+    finally:
+        mb.ProtocolApplication.create_multidimensional_matrix = original
+    return inputs
+
+
+def dose_response_input(n_conc=50, n_time=8, n_replicate=30, n_material=4):
+    rng = np.random.default_rng(42)
+    grid = pd.MultiIndex.from_product(
+        [
+            np.geomspace(0.1, 100, n_conc),
+            np.arange(n_time) * 6.0,
+            np.arange(1, n_replicate + 1),
+            np.arange(n_material),
+        ],
+        names=["CONCENTRATION", "E.EXPOSURE_TIME", "REPLICATE", "MATERIAL"],
+    ).to_frame(index=False)
+    grid["loValue"] = rng.random(grid.shape[0])
+    grid["errorValue"] = rng.random(grid.shape[0]) / 10
+    grid["upValue"] = grid["loValue"] + 1
+    return [(grid, "loValue", None, "errorValue", ["upValue"])]
+
+
+def fill(inputs, scatter):
+    for df, signal_col, alt_axes, errors_col, aux in inputs:
+        alt_cols = set() if alt_axes is None else set(sum(alt_axes.values(), []))
+        axis_cols = [
+            c
+            for c in df.columns
+            if c not in alt_cols and c not in (signal_col, errors_col) + tuple(aux)
+        ]
+        axis_values = [sorted(df[c].unique()) for c in axis_cols]
+        shape = tuple(len(v) for v in axis_values)
+        matrix = np.full(shape, np.nan)
+        errors = None if errors_col is None else np.full(shape, np.nan)
+        auxsignals = {
+            a: (
+                np.full(shape, "", dtype=object)
+                if a == "textValue"
+                else np.full(shape, np.nan)
+            )
+            for a in aux
+        }
+        if scatter is mb.scatter_matrix:
+            scatter(
+                df,
+                axis_cols,
+                axis_values,
+                shape,
+                signal_col,
+                matrix,
+                errors_col,
+                errors,
+                auxsignals,
+            )
+        else:
+            scatter(
+                df,
+                axis_cols,
+                axis_values,
+                signal_col,
+                matrix,
+                errors_col,
+                errors,
+                auxsignals,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(STUDY_JSON, "r", encoding="utf-8") as file:
+        study = mb.Study(**json.load(file))
+
+    for name, inputs in [
+        ("study.json", collect_matrix_inputs(study)),
+        ("dose-response 48k rows", dose_response_input()),
+    ]:
+        rows = sum(i[0].shape[0] for i in inputs)
+        timings = {}
+        for label, scatter in [
+            ("rowwise", mb.scatter_matrix_rowwise),
+            ("vectorized", mb.scatter_matrix),
+        ]:
+            timings[label] = min(
+                timeit.repeat(
+                    functools.partial(fill, inputs, scatter),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+        print(
+            "{}: {} matrices, {} rows; rowwise {:.4f}s, vectorized {:.4f}s, "
+            "speedup {:.1f}x".format(
+                name,
+                len(inputs),
+                rows,
+                timings["rowwise"],
+                timings["vectorized"],
+                timings["rowwise"] / timings["vectorized"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
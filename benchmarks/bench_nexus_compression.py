@@ -0,0 +1,138 @@
+"""
+File size, write and read time of NeXus files written with the
+dataset_options presets of to_nexus.
+
+    python benchmarks/bench_nexus_compression.py [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+import nexusformat.nexus.tree as nx
+import numpy as np
+
+import pyambit.datamodel as mb
+from pyambit import nexus_writer  # noqa: F401
+
+STUDY_JSON = (
+    Path(__file__).parent.parent / "tests" / "pyambit" / "resources" / "study.json"
+)
+
+
+def spectra_study(n_papp=10, n_spectra=100, n_points=2048):
+    """
+    Raman like spectra (one 2D signal per papp) and dose-response matrices.
+    """
+    rng = np.random.default_rng(42)
+    x = np.linspace(100, 3200, n_points)
+    papps = []
+    for i in range(n_papp):
+        peaks = rng.random((n_spectra, 1)) * np.exp(-(((x - 1000 - 50 * i) / 30) ** 2))
+        spectra = np.round(peaks * 1000 + rng.normal(0, 1, (n_spectra, n_points)), 2)
+        dose = rng.random((50, 8, 30, 4))
+        papps.append(
+            mb.ProtocolApplication(
+                uuid="SYNT-{}".format(i),
+                protocol=mb.Protocol(
+                    topcategory="P-CHEM",
+                    category=mb.EndpointCategory(code="ANALYTICAL_METHODS_SECTION"),
+                ),
+                citation=mb.Citation(owner="SYNT", title="synthetic", year=2024),
+                parameters={},
+                effects=[
+                    mb.EffectArray(
+                        endpoint="Raman spectrum",
+                        endpointtype="RAW_DATA",
+                        signal=mb.ValueArray(values=spectra, unit="count"),
+                        axes={
+                            "sample": mb.ValueArray(values=np.arange(n_spectra)),
+                            "x": mb.ValueArray(values=x, unit="cm-1"),
+                        },
+                    ),
+                    mb.EffectArray(
+                        endpoint="viability",
+                        endpointtype="RAW_DATA",
+                        signal=mb.ValueArray(
+                            values=dose, unit="%", errorValue=dose / 10
+                        ),
+                        axes={
+                            "CONCENTRATION": mb.ValueArray(
+                                values=np.geomspace(0.1, 100, 50)
+                            ),
+                            "E.EXPOSURE_TIME": mb.ValueArray(values=np.arange(8.0)),
+                            "REPLICATE": mb.ValueArray(values=np.arange(30)),
+                            "MATERIAL": mb.ValueArray(values=np.arange(4)),
+                        },
+                    ),
+                ],
+            )
+        )
+    return mb.Study(study=papps)
+
+
+def read_all(file):
+    with h5py.File(file, "r") as h5file:
+        h5file.visititems(
+            lambda name, obj: (obj[()] if isinstance(obj, h5py.Dataset) else None)
+        )
+
+
+def measure(study, dataset_options, repeat):
+    writes, reads = [], []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file = os.path.join(tmpdir, "bench.nxs")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            nxroot = study.to_nexus(nx.NXroot(), dataset_options=dataset_options)
+            nxroot.save(file, mode="w")
+            writes.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            read_all(file)
+            reads.append(time.perf_counter() - start)
+        return os.path.getsize(file), min(writes), min(reads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(STUDY_JSON, "r", encoding="utf-8") as file:
+        study = mb.Study(**json.load(file))
+
+    variants = [
+        ("nexusformat defaults", None),
+        ("lzf", "lzf"),
+        ("gzip 4", "gzip"),
+        (
+            "gzip 1",
+            {
+                role: {"compression": "gzip", "compression_opts": 1}
+                for role in nexus_writer.DATASET_ROLES
+            },
+        ),
+        (
+            "gzip 4, min_size 0",
+            {
+                role: dict(nexus_writer.DATASET_OPTIONS["gzip"], min_size=0)
+                for role in nexus_writer.DATASET_ROLES
+            },
+        ),
+    ]
+    for name, data in [("study.json", study), ("spectra", spectra_study())]:
+        for label, dataset_options in variants:
+            size, write, read = measure(data, dataset_options, args.repeat)
+            print(
+                "{}, {}: {:.2f} MB, write {:.3f}s, read {:.3f}s".format(
+                    name, label, size / 1e6, write, read
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
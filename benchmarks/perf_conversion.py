@@ -0,0 +1,104 @@
+"""
+Benchmark suite for the conversion hot paths (needs pytest-benchmark):
+
+    pip install pytest-benchmark
+    pytest benchmarks
+    pytest benchmarks -k convert --benchmark-compare
+    pytest-benchmark compare --group-by=name
+
+Each run is saved as JSON (with the commit id) under .benchmarks/, so the
+runs of different commits can be compared; --benchmark-json=<file> writes
+a single result file instead.
+"""
+
+import json
+
+import nexusformat.nexus.tree as nx
+
+import pyambit.datamodel as mb
+import pytest
+from bench_data import dose_response_json, load_json, spectra_study, substances_json
+from pyambit import nexus_writer  # noqa: F401
+from pyambit.solr_writer import Ambit2Solr
+
+# name: (n_papp, n_conc, n_time, n_replicate, n_material)
+DOSE_RESPONSE = {
+    "dose-response-s": (4, 8, 3, 3, 2),
+    "dose-response-l": (4, 16, 6, 10, 4),
+    "dose-response-wide": (2, 200, 2, 2, 1),
+}
+# name: (n_papp, n_spectra, n_points)
+SPECTRA = {
+    "spectra-s": (2, 10, 1024),
+    "spectra-l": (4, 100, 4096),
+}
+
+
+@pytest.fixture(scope="module", params=["study.json", *DOSE_RESPONSE])
+def study_json(request):
+    if request.param == "study.json":
+        return load_json("study.json")
+    return dose_response_json(*DOSE_RESPONSE[request.param])
+
+
+@pytest.fixture(scope="module")
+def study(study_json):
+    return mb.Study(**study_json)
+
+
+@pytest.fixture(scope="module", params=list(SPECTRA))
+def spectra(request):
+    return spectra_study(*SPECTRA[request.param])
+
+
+def test_study_parse(benchmark, study_json):
+    benchmark(mb.Study, **study_json)
+
+
+@pytest.mark.parametrize("n_substances", [1, 10])
+def test_substances_parse(benchmark, n_substances):
+    data = substances_json(load_json("study.json"), n_substances)
+    benchmark(mb.Substances, **data)
+
+
+def test_convert_effectrecords2array(benchmark, study):
+    def convert():
+        for papp in study.study:
+            papp.convert_effectrecords2array()
+
+    benchmark(convert)
+
+
+def test_to_nexus(benchmark, study):
+    benchmark(study.to_nexus, nx.NXroot())
+
+
+def test_to_nexus_spectra(benchmark, spectra):
+    benchmark(spectra.to_nexus, nx.NXroot())
+
+
+def test_solr_to_json(benchmark, study_json):
+    substances = mb.Substances(**substances_json(study_json, 2))
+    benchmark(Ambit2Solr(prefix="SYNT").to_json, substances)
+
+
+def test_model_dump_json_roundtrip(benchmark, study):
+    def roundtrip():
+        return mb.Study(**json.loads(study.model_dump_json()))
+
+    benchmark(roundtrip)
+
+
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_effectarray_roundtrip(benchmark, spectra, array_encoding):
+    effects = [effect for papp in spectra.study for effect in papp.effects]
+
+    def roundtrip():
+        return [
+            mb.EffectArray.model_construct(
+                **json.loads(effect.model_dump_json(array_encoding=array_encoding))
+            )
+            for effect in effects
+        ]
+
+    benchmark(roundtrip)
@@ -11,8 +11,9 @@ import requests
 import seaborn as sns
 from IPython.display import display, HTML  # noqa: F401
 
-# to_nexus is not added without this import
-from pyambit import nexus_writer  # noqa: F401
+# to_nexus and to_parquet are not added without these imports
+from pyambit import nexus_writer, parquet_writer  # noqa: F401
+from pyambit.array_cache import ArrayCache
 from pyambit.datamodel import EffectRecord, Study, Substances
 
 # + tags=["parameters"]
@@ -57,18 +58,13 @@ def write_studies_nexus(substances, single_file=single_nexus, hierarchy=False):
         file = os.path.join(product["nexus"], "remote.nxs")
         nxroot.save(file, mode="w")
     else:
-        for substance in substances.substance:
-            for study in substance.study:
-                file = os.path.join(product["nexus"], "study_{}.nxs".format(study.uuid))
-                print(file)
-                nxroot = nx.NXroot()
-                try:
-                    study.to_nexus(nxroot)
-                    nxroot.save(file, mode="w")
-                except Exception as err:  # noqa: F841
-                    # print("error",file,str(err))
-                    traceback.print_exc()
-                # break
+        errors = nexus_writer.export_nexus(
+            substances, product["nexus"], workers=os.cpu_count()
+        )
+        for file, error in errors.items():
+            print(file)
+            if error is not None:
+                print(error)
 
 
 def plot_dose_response(
@@ -379,6 +375,9 @@ def plot_chemical_concentrations(
     plt.show()
 
 
+# the single file NeXus export converts the papps again; export_nexus converts
+# them in worker processes, which don't use the cache of this one
+cache = ArrayCache().activate() if single_nexus else None
 try:
     substances = query(
         url=url, params={"max": 1 if max_substances is None else max_substances}
@@ -409,13 +408,11 @@ try:
                         ea.conditions["TREATMENT"] = "control"
 
             effectarrays_only, df = pa.convert_effectrecords2array()
-            _file = os.path.join(product["nexus"], "study_{}.xlsx".format(pa.uuid))
 
             df["papp_uuid"] = pa.uuid
             df["investigation_uuid"] = pa.investigation_uuid
             df["assay_uuid"] = pa.assay_uuid
             df["substance_uuid"] = s.i5uuid
-            df.to_excel(_file, index=False)
 
             _input_file = pa.parameters.get("__input_file", "")
             if "CONCENTRATION" in df.columns:
@@ -484,9 +481,14 @@ try:
             #    for c in ea.conditions:
             #        print(c, ea.conditions[c])
             # break
+    # the effect records of all studies, instead of an Excel file per study
+    substances.to_parquet(product["parquet"])
     write_studies_nexus(substances, single_file=single_nexus, hierarchy=hierarchy)
     df_papps.to_excel(
         os.path.join(product["nexus"], "protocol_applications.xlsx"), index=False
     )
 except Exception:
     traceback.print_exc()
+finally:
+    if cache is not None:
+        cache.deactivate()
@@ -0,0 +1,243 @@
+"""
+Opt-in cache of the convert_effectrecords2array results, keyed on a content
+hash of the papp effects (see datamodel.effects_digest) and the library version.
+
+    with ArrayCache(max_bytes=1 << 30, directory="cache/arrays") as cache:
+        write_study_nexus(study, "study.nxs")
+        study.to_excel(...)  # converts the same papps again, now cached
+    print(cache.hits, cache.misses)
+
+Entries are kept in memory (least recently used first out, bounded by count and
+bytes) and, with a directory, pickled to disk (bounded by max_disk_bytes).
+Changed effects simply get a new key; invalidate and clear drop entries
+explicitly. Only load disk caches of trusted directories, they are pickles.
+Without an active ArrayCache converting only checks a module global. Worker
+processes (workers > 1) do not use the cache of the parent.
+"""
+
+import collections
+import importlib.metadata
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any, Optional
+
+FORMAT = 1
+
+
+def library_version() -> str:
+    try:
+        return importlib.metadata.version("pyambit")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# part of every key: results of other library versions are not reused
+CACHE_VERSION = "pyambit-{}/{}".format(library_version(), FORMAT)
+SUFFIX = ".pkl"
+
+_active: Optional["ArrayCache"] = None
+
+
+def active() -> Optional["ArrayCache"]:
+    return _active
+
+
+class ArrayCache:
+    """
+    Content addressed cache of converted arrays, active within the with
+    block (or between activate and deactivate).
+
+    Args:
+        max_entries (int): Entries kept in memory.
+        max_bytes (int): Approximate bytes of the entries kept in memory.
+        directory (str): Optional on-disk tier, one file per entry.
+        max_disk_bytes (int): Bytes of the files kept in directory; the least
+            recently used are removed first. None for no limit.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 1 << 30,
+        directory: Optional[str] = None,
+        max_disk_bytes: Optional[int] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._previous = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def activate(self) -> "ArrayCache":
+        """
+        Makes this the active cache until deactivate, as the with block does.
+        """
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def deactivate(self):
+        global _active
+        _active = self._previous
+        self._previous = None
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deactivate()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key: str, default=None) -> Any:
+        """
+        The value stored under key, from memory or else from disk.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = self.load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        self.remember(key, value, sizeof(value))
+        return value
+
+    def put(self, key: str, value: Any, nbytes: Optional[int] = None):
+        """
+        Args:
+            nbytes (int): Size of the value, by default estimated with sizeof.
+        """
+        if nbytes is None:
+            nbytes = sizeof(value)
+        self.remember(key, value, nbytes)
+        if self.directory is not None:
+            self.store(key, value)
+
+    def remember(self, key: str, value: Any, nbytes: int):
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            if nbytes > self.max_bytes or self.max_entries < 1:
+                return
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def load(self, key: str) -> Any:
+        if self.directory is None:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # truncated, or written by code that no longer exists
+            self.remove_file(path)
+            return None
+        try:
+            os.utime(path)  # most recently used, see evict_files
+        except OSError:
+            pass
+        return value
+
+    def store(self, key: str, value: Any):
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            self.remove_file(tmp_path)
+            raise
+        if self.max_disk_bytes is not None:
+            self.evict_files()
+
+    def evict_files(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(SUFFIX):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            self.remove_file(path)
+            total -= size
+
+    @staticmethod
+    def remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, key: str):
+        """
+        Drops the entry of key from memory and disk.
+        """
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[1]
+        if self.directory is not None:
+            self.remove_file(self.path(key))
+
+    def clear(self):
+        """
+        Drops all entries, including the files in directory.
+        """
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+        if self.directory is not None:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(SUFFIX):
+                        self.remove_file(entry.path)
+
+
+def sizeof(value: Any) -> int:
+    """
+    Approximate size of a cached value: the bytes of its NumPy arrays and
+    pandas frames, as found in lists, tuples, dicts and pydantic models.
+    """
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    memory_usage = getattr(value, "memory_usage", None)
+    if memory_usage is not None:
+        return int(memory_usage(index=True).sum())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sum(sizeof(item) for item in value.values())
+    if hasattr(value, "__dict__"):
+        return sum(sizeof(item) for item in value.__dict__.values())
+    return 0
@@ -1,12 +1,31 @@
+import base64
+import copy
+import hashlib
+import itertools
 import json
+import operator
+import os
 import re
+import tempfile
 import traceback
 
 import uuid
 
 from enum import Enum
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
 
+import h5py
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
@@ -16,15 +35,82 @@ from pydantic import (
     ConfigDict,
     create_model,
     Field,
+    field_serializer,
     field_validator,
     model_validator,
 )
+from pydantic_core import PydanticSerializationError, PydanticUndefined, to_json
 
+from pyambit import array_cache
 from pyambit.ambit_deco import add_ambitmodel_method  # noqa: F401
+from pyambit.instrument import instrumented
 
 
 class AmbitModel(BaseModel):
-    pass
+
+    @classmethod
+    def model_construct(cls, _fields_set: Optional[set] = None, **data: Any):
+        """
+        BaseModel.model_construct (no validation), without resolving aliases and
+        defaults on every call, which dominates building large trees of trusted data.
+        """
+        fields = construct_fields(cls)
+        if fields is None:
+            return super().model_construct(_fields_set, **data)
+        values = {}
+        fields_set = set()
+        for name, default, factory in fields:
+            if name in data:
+                values[name] = data[name]
+                fields_set.add(name)
+            elif factory is not None:
+                values[name] = factory()
+            elif default is not PydanticUndefined:
+                values[name] = (
+                    default
+                    if isinstance(default, (str, int, float, bool, type(None)))
+                    else copy.deepcopy(default)
+                )
+        m = cls.__new__(cls)
+        object.__setattr__(m, "__dict__", values)
+        object.__setattr__(
+            m,
+            "__pydantic_fields_set__",
+            fields_set if _fields_set is None else _fields_set,
+        )
+        object.__setattr__(m, "__pydantic_extra__", None)
+        object.__setattr__(m, "__pydantic_private__", None)
+        return m
+
+
+_construct_fields: Dict[type, Optional[List[Tuple[str, Any, Any]]]] = {}
+
+
+def construct_fields(cls) -> Optional[List[Tuple[str, Any, Any]]]:
+    """
+    (name, default, default_factory) of the model fields, or None if the model
+    needs the full BaseModel.model_construct (aliases, extra fields, post init).
+    """
+    if cls not in _construct_fields:
+        fields = []
+        for name, field in cls.model_fields.items():
+            if (
+                field.alias is not None
+                or field.validation_alias is not None
+                or getattr(field, "default_factory_takes_validated_data", False)
+            ):
+                fields = None
+                break
+            fields.append((name, field.default, field.default_factory))
+        if (
+            cls.model_config.get("extra") == "allow"
+            or cls.__pydantic_post_init__
+            or cls.__pydantic_root_model__
+            or cls.__private_attributes__
+        ):
+            fields = None
+        _construct_fields[cls] = fields
+    return _construct_fields[cls]
 
 
 class Value(AmbitModel):
@@ -79,7 +165,7 @@ class Protocol(AmbitModel):
     @classmethod
     def model_construct(cls, **data: Any) -> "Protocol":
         if "category" in data and isinstance(data["category"], dict):
-            data["category"] = EndpointCategory(**data["category"])
+            data["category"] = EndpointCategory.model_construct(**data["category"])
         return super().model_construct(**data)
 
     def __repr__(self):
@@ -146,12 +232,151 @@ class EffectResult(AmbitModel):
 EffectResult = create_model("EffectResult", __base__=EffectResult)
 
 
+ARRAY_ENCODINGS = ("list", "base64")
+
+
+def serialize_array(obj: np.ndarray, array_encoding: str = "list"):
+    """
+    JSON form of a NumPy array: a (nested) list, or for array_encoding="base64"
+    a dict with the base64 encoded buffer, its dtype and shape. Arrays of
+    Python objects are always dumped as lists.
+    """
+    obj = np.asarray(obj)  # reads an h5py.Dataset
+    if array_encoding == "list" or obj.dtype.hasobject:
+        return obj.tolist()
+    if array_encoding == "base64":
+        return {
+            "__ndarray__": base64.b64encode(np.ascontiguousarray(obj)).decode("ascii"),
+            "dtype": obj.dtype.str,
+            "shape": list(obj.shape),
+        }
+    raise ValueError(
+        f"Unknown array_encoding {array_encoding!r}, expected one of {ARRAY_ENCODINGS}"
+    )
+
+
+def is_encoded_array(value) -> bool:
+    return isinstance(value, dict) and "__ndarray__" in value
+
+
+def deserialize_array(value):
+    """
+    Inverse of serialize_array. Base64 encoded arrays become read-only
+    np.frombuffer views of the decoded bytes, without copying.
+    """
+    if isinstance(value, list):
+        return np.array(value)  # Convert lists back to numpy arrays
+    if is_encoded_array(value):
+        return np.frombuffer(
+            base64.b64decode(value["__ndarray__"]), dtype=np.dtype(value["dtype"])
+        ).reshape(value["shape"])
+    return value
+
+
+# array payloads of the ValueArrays: NumPy arrays (np.memmap included) and
+# datasets of open HDF5 files, which are read only when transformed
+ARRAY_TYPES = (np.ndarray, h5py.Dataset)
+# arrays larger than this are compared block by block, see arrays_equal
+COMPARE_BLOCK_BYTES = 1 << 24
+SPILL_MIN_BYTES = 1 << 26
+
+_spill_dir = None
+
+
+def same_storage(a, b) -> bool:
+    """
+    Whether a and b are the same data: the same HDF5 dataset, or arrays (e.g.
+    memmaps) viewing the same memory with the same layout. Slices of a memmap
+    keep its filename and offset, so these don't tell.
+    """
+    if isinstance(a, h5py.Dataset) and isinstance(b, h5py.Dataset):
+        return a.id == b.id
+    if isinstance(a, np.ndarray) and isinstance(b, np.ndarray):
+        return (
+            a.__array_interface__["data"][0] == b.__array_interface__["data"][0]
+            and a.dtype == b.dtype
+            and a.shape == b.shape
+            and a.strides == b.strides
+        )
+    return False
+
+
+def arrays_equal(a, b, block_bytes: int = COMPARE_BLOCK_BYTES) -> bool:
+    """
+    np.array_equal, comparing large (memory-mapped, HDF5) arrays block by block
+    along the first axis rather than with temporaries of their size.
+    """
+    if a is b:
+        return True
+    if not isinstance(a, ARRAY_TYPES) or not isinstance(b, ARRAY_TYPES):
+        return np.array_equal(a, b)
+    if a.shape != b.shape:
+        return False
+    if same_storage(a, b):
+        return True
+    nbytes = a.size * max(a.dtype.itemsize, b.dtype.itemsize)
+    if a.ndim == 0 or nbytes <= block_bytes:
+        return np.array_equal(a[()], b[()])
+    step = max(1, a.shape[0] * block_bytes // nbytes)
+    return all(
+        np.array_equal(a[start : start + step], b[start : start + step])
+        for start in range(0, a.shape[0], step)
+    )
+
+
+def spill_dir() -> str:
+    """
+    The scratch directory of spill_array, removed when the interpreter exits.
+    """
+    global _spill_dir
+    if _spill_dir is None:
+        _spill_dir = tempfile.TemporaryDirectory(prefix="pyambit-")
+    return _spill_dir.name
+
+
+def spill_array(
+    values,
+    directory: Optional[str] = None,
+    min_bytes: int = SPILL_MIN_BYTES,
+    block_bytes: int = COMPARE_BLOCK_BYTES,
+):
+    """
+    Moves a large array out of memory: copies it block by block into a .npy
+    file in directory and returns it memory-mapped (read-only). Memmaps, arrays
+    of Python objects and arrays smaller than min_bytes are returned as they
+    are, except that an h5py.Dataset is always turned into a NumPy array.
+
+    Args:
+        directory (str): By default a temporary directory of the process;
+            the files of other directories are left to the caller.
+    """
+    if isinstance(values, np.memmap) or not isinstance(values, ARRAY_TYPES):
+        return values
+    if values.dtype.hasobject or values.ndim == 0 or values.nbytes < min_bytes:
+        return values[()] if isinstance(values, h5py.Dataset) else values
+    fd, path = tempfile.mkstemp(
+        suffix=".npy", dir=spill_dir() if directory is None else directory
+    )
+    os.close(fd)
+    spilled = np.lib.format.open_memmap(
+        path, mode="w+", dtype=values.dtype, shape=values.shape
+    )
+    step = max(1, values.shape[0] * block_bytes // max(1, values.nbytes))
+    for start in range(0, values.shape[0], step):
+        spilled[start : start + step] = values[start : start + step]
+    spilled.flush()
+    del spilled
+    return np.load(path, mmap_mode="r")
+
+
 class BaseValueArray(AmbitModel):
     unit: Optional[str] = None
     # the arrays can in fact contain strings, we don't need textValue!
-    values: Union[npt.NDArray, None] = None
+    # values, errorValue and auxiliary arrays may be np.memmap or h5py.Dataset,
+    # they are kept as they are (see arrays_equal, spill)
+    values: Union[npt.NDArray, h5py.Dataset, None] = None
     errQualifier: Optional[str] = None
-    errorValue: Optional[Union[npt.NDArray, None]] = None
+    errorValue: Optional[Union[npt.NDArray, h5py.Dataset, None]] = None
     # but loValue - upValue need some support
     # also loValue + textValue as used in composition / analytics data
     # See ValueArray
@@ -172,24 +397,25 @@ class BaseValueArray(AmbitModel):
 
     @classmethod
     def model_construct(cls, **data):
-        def deserialize(value):
-            if isinstance(value, list):
-                return np.array(value)  # Convert lists back to numpy arrays
-            return value
-
-        values = deserialize(data.get("values"))
+        values = deserialize_array(data.get("values"))
         unit = data.get("unit")
         errQualifier = data.get("errQualifier")
-        errorValue = deserialize(data.get("errorValue"))
+        errorValue = deserialize_array(data.get("errorValue"))
 
         return cls(
             values=values, unit=unit, errQualifier=errQualifier, errorValue=errorValue
         )
 
-    def model_dump_json(self, **kwargs) -> str:
+    @field_serializer("values", "errorValue", mode="wrap")
+    def serialize_values(self, value, handler, info):
+        # through getattr, which reads the arrays of a LazyValueArray, also
+        # when it is dumped as a field of another model
+        return handler(getattr(self, info.field_name))
+
+    def model_dump_json(self, array_encoding: str = "list", **kwargs) -> str:
         def serialize(obj):
-            if isinstance(obj, np.ndarray):
-                return obj.tolist()  # Convert NumPy arrays to lists
+            if isinstance(obj, ARRAY_TYPES):
+                return serialize_array(obj, array_encoding)
             raise TypeError(f"Type {type(obj).__name__} not serializable")
 
         # Dump the model to a dictionary and then serialize it to JSON
@@ -202,10 +428,18 @@ class BaseValueArray(AmbitModel):
         return (
             self.unit == other.unit
             and self.errQualifier == other.errQualifier
-            and np.array_equal(self.values, other.values)
-            and np.array_equal(self.errorValue, other.errorValue)
+            and arrays_equal(self.values, other.values)
+            and arrays_equal(self.errorValue, other.errorValue)
         )
 
+    def spill(self, directory: Optional[str] = None, min_bytes: int = SPILL_MIN_BYTES):
+        """
+        Replaces the large arrays by memory-mapped copies, see spill_array.
+        """
+        self.values = spill_array(self.values, directory, min_bytes)
+        self.errorValue = spill_array(self.errorValue, directory, min_bytes)
+        return self
+
 
 class MetaValueArray(BaseValueArray):
     conditions: Optional[Dict[str, str]] = None
@@ -240,10 +474,10 @@ class MetaValueArray(BaseValueArray):
             conditions=conditions,
         )
 
-    def model_dump_json(self, **kwargs) -> str:
+    def model_dump_json(self, array_encoding: str = "list", **kwargs) -> str:
         def serialize(obj):
-            if isinstance(obj, np.ndarray):
-                return obj.tolist()  # Convert NumPy arrays to lists
+            if isinstance(obj, ARRAY_TYPES):
+                return serialize_array(obj, array_encoding)
             raise TypeError(f"Type {type(obj).__name__} not serializable")
 
         model_dict = self.model_dump()
@@ -256,7 +490,9 @@ class MetaValueArray(BaseValueArray):
 
 
 class ValueArray(MetaValueArray):
-    auxiliary: Optional[Dict[str, Union[npt.NDArray, "MetaValueArray"]]] = None
+    auxiliary: Optional[
+        Dict[str, Union[npt.NDArray, h5py.Dataset, "MetaValueArray"]]
+    ] = None
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
     @classmethod
@@ -280,24 +516,21 @@ class ValueArray(MetaValueArray):
 
     @classmethod
     def model_construct(cls, **data):
-        def deserialize(value):
-            if isinstance(value, list):
-                return np.array(value)  # Convert lists back to numpy arrays
-            return value
-
-        base_data = {k: deserialize(v) for k, v in data.items() if k != "auxiliary"}
+        base_data = {
+            k: deserialize_array(v) for k, v in data.items() if k != "auxiliary"
+        }
         base_instance = MetaValueArray.model_construct(**base_data)
         auxiliary_data = data.get("auxiliary", {})
 
         if auxiliary_data is not None:
             auxiliary = {}
             for key, value in auxiliary_data.items():
-                if isinstance(
-                    value, dict
+                if isinstance(value, dict) and not is_encoded_array(
+                    value
                 ):  # Check if it's a dictionary representing a MetaValueArray
                     auxiliary[key] = MetaValueArray.model_construct(**value)
                 else:
-                    auxiliary[key] = deserialize(value)
+                    auxiliary[key] = deserialize_array(value)
         else:
             auxiliary = None
 
@@ -310,9 +543,16 @@ class ValueArray(MetaValueArray):
             auxiliary=auxiliary,
         )
 
-    def model_dump(self):
-        base_dict = super().model_dump()
-        return {**base_dict, "auxiliary": self.auxiliary}
+    def model_dump(self, **kwargs):
+        base_dict = super().model_dump(**kwargs)
+        if "auxiliary" in base_dict:  # not excluded
+            base_dict["auxiliary"] = self.auxiliary
+        return base_dict
+
+    @field_serializer("auxiliary", mode="wrap")
+    def serialize_auxiliary(self, value, handler):
+        # through getattr, which reads the arrays of a LazyValueArray
+        return handler(self.auxiliary)
 
     def __eq__(self, other):
         if not isinstance(other, ValueArray):
@@ -329,12 +569,30 @@ class ValueArray(MetaValueArray):
             return False
         if aux1.keys() != aux2.keys():
             return False
-        return all(np.array_equal(aux1[k], aux2[k]) for k in aux1)
+        return all(ValueArray.auxiliary_equal(aux1[k], aux2[k]) for k in aux1)
 
-    def model_dump_json(self, **kwargs) -> str:
+    @staticmethod
+    def auxiliary_equal(item1, item2) -> bool:
+        if isinstance(item1, MetaValueArray) and isinstance(item2, MetaValueArray):
+            # e.g. a MetaValueArray and the LazyValueArray read back from NeXus
+            return MetaValueArray.__eq__(item1, item2) and ValueArray.compare_auxiliary(
+                getattr(item1, "auxiliary", None), getattr(item2, "auxiliary", None)
+            )
+        return arrays_equal(item1, item2)
+
+    def spill(self, directory: Optional[str] = None, min_bytes: int = SPILL_MIN_BYTES):
+        super().spill(directory, min_bytes)
+        for key, item in (self.auxiliary or {}).items():
+            if isinstance(item, MetaValueArray):
+                item.spill(directory, min_bytes)
+            else:
+                self.auxiliary[key] = spill_array(item, directory, min_bytes)
+        return self
+
+    def model_dump_json(self, array_encoding: str = "list", **kwargs) -> str:
         def serialize(obj):
-            if isinstance(obj, np.ndarray):
-                return obj.tolist()  # Convert NumPy arrays to lists
+            if isinstance(obj, ARRAY_TYPES):
+                return serialize_array(obj, array_encoding)
             if isinstance(obj, MetaValueArray):
                 return obj.model_dump()  # Serialize BaseValueArray to a dictionary
             raise TypeError(f"Type {type(obj).__name__} not serializable")
@@ -343,6 +601,74 @@ class ValueArray(MetaValueArray):
         return json.dumps(model_dict, default=serialize, **kwargs)
 
 
+class LazyArray:
+    """
+    Array payload read on first use, e.g. a dataset of a NeXus (HDF5) file.
+    The shape and dtype are known without reading the data.
+    """
+
+    def __init__(self, load: Callable[[], npt.NDArray], shape=None, dtype=None):
+        self._load = load
+        self.shape = shape
+        self.dtype = dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def load(self) -> npt.NDArray:
+        return self._load()
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.load()
+        return values if dtype is None else values.astype(dtype)
+
+    def __repr__(self):
+        return f"LazyArray(shape={self.shape}, dtype={self.dtype})"
+
+
+class LazyValueArray(ValueArray):
+    """
+    ValueArray whose values, errorValue and auxiliary arrays may be LazyArray;
+    they are read and replaced by NumPy arrays when the attribute is accessed.
+    """
+
+    values: Union[npt.NDArray, LazyArray, None] = None
+    errorValue: Optional[Union[npt.NDArray, LazyArray]] = None
+    auxiliary: Optional[Dict[str, Union[npt.NDArray, LazyArray, "MetaValueArray"]]] = (
+        None
+    )
+
+    def __getattribute__(self, name):
+        value = super().__getattribute__(name)
+        if name in ("values", "errorValue"):
+            if isinstance(value, LazyArray):
+                value = value.load()
+                self.__dict__[name] = value
+        elif name == "auxiliary" and value:
+            for key, item in value.items():
+                if isinstance(item, LazyArray):
+                    value[key] = item.load()
+        return value
+
+    def is_loaded(self) -> bool:
+        return not any(
+            isinstance(value, LazyArray)
+            for value in [
+                self.__dict__["values"],
+                self.__dict__["errorValue"],
+                *(self.__dict__["auxiliary"] or {}).values(),
+            ]
+        )
+
+
 class EffectRecord(AmbitModel):
     nx_name: Optional[str] = None
     endpoint: str
@@ -395,16 +721,19 @@ class EffectRecord(AmbitModel):
     @classmethod
     def model_construct(cls, **data: Any) -> "EffectRecord":
         if "result" in data and isinstance(data["result"], dict):
-            data["result"] = EffectResult(**data["result"])
+            data["result"] = EffectResult.model_construct(**data["result"])
 
-        if "conditions" in data:
+        if "conditions" in data and isinstance(data["conditions"], dict):
             new_conditions = {}
             for key, value in data["conditions"].items():
                 if isinstance(value, dict):
-                    new_conditions[key] = Value(**value)
+                    new_conditions[key] = Value.model_construct(**value)
                 else:
                     new_conditions[key] = value
             data["conditions"] = new_conditions
+        if "endpointSynonyms" not in data:
+            # spares pydantic the costly inspection of the default_factory
+            data["endpointSynonyms"] = []
 
         return super().model_construct(**data)
 
@@ -503,12 +832,22 @@ class EffectArray(EffectRecord):
     def create(cls, signal: ValueArray = None, axes: Dict[str, ValueArray] = None):
         return cls(signal=signal, axes=axes)
 
-    def model_dump_json(self, **kwargs) -> str:
+    def spill(self, directory: Optional[str] = None, min_bytes: int = SPILL_MIN_BYTES):
+        """
+        Replaces the large arrays of the signal and axes by memory-mapped
+        copies, see spill_array.
+        """
+        for array in [self.signal, *(self.axes or {}).values()]:
+            if array is not None:
+                array.spill(directory, min_bytes)
+        return self
+
+    def model_dump_json(self, array_encoding: str = "list", **kwargs) -> str:
         def serialize(obj):
             if isinstance(obj, ValueArray):
                 return obj.model_dump()
-            if isinstance(obj, np.ndarray):
-                return obj.tolist()
+            if isinstance(obj, ARRAY_TYPES):
+                return serialize_array(obj, array_encoding)
             return obj
 
         data = self.model_dump(exclude={"axes", "signal"})
@@ -610,7 +949,7 @@ class ProtocolEffectRecord(EffectRecord):
     @classmethod
     def model_construct(cls, **data):
         if "protocol" in data and isinstance(data["protocol"], dict):
-            data["protocol"] = Protocol(**data["protocol"])
+            data["protocol"] = Protocol.model_construct(**data["protocol"])
         return super().model_construct(**data)
 
     def __eq__(self, other):
@@ -757,9 +1096,9 @@ class SampleLink(AmbitModel):
     @classmethod
     def model_construct(cls, **data):
         if "substance" in data and isinstance(data["substance"], dict):
-            data["substance"] = Sample(**data["substance"])
+            data["substance"] = Sample.model_construct(**data["substance"])
         if "company" in data and isinstance(data["company"], dict):
-            data["company"] = Company(**data["company"])
+            data["company"] = Company.model_construct(**data["company"])
         return super().model_construct(**data)
 
     def __eq__(self, other):
@@ -774,6 +1113,464 @@ class SampleLink(AmbitModel):
 SampleLink = create_model("SampleLink", __base__=SampleLink)
 
 
+def label_key(value) -> Any:
+    # hashable key telling apart values which compare equal but differ in
+    # type (1, 1.0, True), for models and lists by their contents
+    if type(value) in (str, float, int, bool, type(None)):
+        return (type(value), value)
+    if isinstance(value, BaseModel):
+        return (
+            type(value),
+            tuple((k, label_key(v)) for k, v in value.__dict__.items()),
+        )
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(label_key(v) for v in value))
+    if isinstance(value, dict):
+        return (dict, tuple((k, label_key(v)) for k, v in value.items()))
+    return (type(value), value)
+
+
+def object_array(items: List) -> npt.NDArray:
+    # np.array would turn lists among the items into another dimension
+    arr = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        arr[i] = item
+    return arr
+
+
+def code_dtype(n_labels: int) -> np.dtype:
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_labels <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class CodedColumn:
+    """
+    Column of repeating values: the distinct values (labels) and the code of
+    every row into them, -1 for rows without a value.
+    """
+
+    __slots__ = ("codes", "labels", "_index")
+
+    def __init__(self, size: int):
+        self.codes = np.full(size, -1, dtype=np.int64)
+        self.labels = []
+        self._index = {}
+
+    def set(self, row: int, value, make: Optional[Callable[[Any], Any]] = None):
+        """
+        Args:
+            make: Converts a new distinct value into its label.
+        """
+        key = label_key(value)
+        code = self._index.get(key)
+        if code is None:
+            code = self._index[key] = len(self.labels)
+            self.labels.append(value if make is None else make(value))
+        self.codes[row] = code
+
+    def finish(self) -> "CodedColumn":
+        self.codes = self.codes.astype(code_dtype(len(self.labels)))
+        self.labels = object_array(self.labels)
+        self._index = None
+        return self
+
+    def decode(self, missing=None, labels: Optional[List] = None) -> npt.NDArray:
+        """
+        Object array of the row values, missing for rows without a value.
+
+        Args:
+            labels: Replaces the labels, e.g. by their model_dump.
+        """
+        lookup = np.empty(len(self.labels) + 1, dtype=object)
+        lookup[:-1] = self.labels if labels is None else object_array(labels)
+        # code -1 picks the trailing missing value
+        lookup[-1] = missing
+        return lookup[self.codes]
+
+    def is_mutable(self) -> bool:
+        return any(isinstance(label, (BaseModel, list)) for label in self.labels)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+
+def copy_label(value):
+    # the records built from a table don't share mutable values with it
+    if isinstance(value, BaseModel):
+        # shallow, as model_copy but without its overhead
+        copied = value.__class__.__new__(value.__class__)
+        object.__setattr__(copied, "__dict__", dict(value.__dict__))
+        object.__setattr__(
+            copied, "__pydantic_fields_set__", set(value.__pydantic_fields_set__)
+        )
+        object.__setattr__(copied, "__pydantic_extra__", value.__pydantic_extra__)
+        object.__setattr__(copied, "__pydantic_private__", value.__pydantic_private__)
+        return copied
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+class EffectRecordTable:
+    """
+    Columnar (struct of arrays) store of the EffectRecords of a
+    ProtocolApplication with many records, its effect_table: one array per
+    record field, result field and condition instead of pydantic models per
+    record.
+
+    The loValue, upValue and errorValue results are float64 (NaN for None),
+    all other values are coded into the distinct values of their column, as is
+    the order of the condition keys of every record. Iterating or indexing
+    builds the EffectRecords on access; changes to them are not written back.
+
+    Example:
+        papp.tabulate_effects()  # the EffectArrays stay in papp.effects
+        arrays, df = papp.convert_effectrecords2array()
+    """
+
+    FIELDS = tuple(
+        field
+        for field in EffectRecord.model_fields
+        if field not in ("result", "conditions")
+    )
+    RESULT_FIELDS = tuple(EffectResult.model_fields)
+    NUMERIC_RESULT_FIELDS = ("loValue", "upValue", "errorValue")
+
+    def __init__(
+        self,
+        rows: int,
+        fields: Dict[str, CodedColumn],
+        has_result: npt.NDArray,
+        results: Dict[str, Union[CodedColumn, npt.NDArray]],
+        conditions: Dict[str, CodedColumn],
+        condition_order: CodedColumn,
+    ):
+        self.rows = rows
+        self.fields = fields
+        self.has_result = has_result
+        self.results = results
+        self.conditions = conditions
+        # the condition keys of each row as a tuple, in the order of its record
+        self.condition_order = condition_order
+
+    @classmethod
+    def from_records(
+        cls, effects: Iterable[Union[EffectRecord, Dict[str, Any]]]
+    ) -> "EffectRecordTable":
+        """
+        Table of EffectRecords and their JSON dicts; the dicts are read as
+        with model_construct, without validation.
+
+        Raises:
+            TypeError: for other effects, e.g. EffectArray or
+                ProtocolEffectRecord.
+        """
+        records = []
+        for effect in effects:
+            if isinstance(effect, dict):
+                if "signal" in effect:
+                    raise TypeError("EffectRecordTable can't store EffectArray")
+                records.append(effect)
+            elif type(effect) is EffectRecord:
+                records.append(effect.__dict__)
+            else:
+                raise TypeError(
+                    f"EffectRecordTable can't store {type(effect).__name__}"
+                )
+
+        rows = len(records)
+        defaults = {
+            name: field.get_default(call_default_factory=True)
+            for name, field in EffectRecord.model_fields.items()
+        }
+        fields = {}
+        for field in cls.FIELDS:
+            column = fields[field] = CodedColumn(rows)
+            default = defaults[field]
+            for row, record in enumerate(records):
+                column.set(row, record.get(field, default))
+            column.finish()
+
+        has_result = np.zeros(rows, dtype=bool)
+        results = {
+            field: (
+                np.full(rows, np.nan)
+                if field in cls.NUMERIC_RESULT_FIELDS
+                else CodedColumn(rows)
+            )
+            for field in cls.RESULT_FIELDS
+        }
+        conditions = {}
+        condition_order = CodedColumn(rows)
+        for row, record in enumerate(records):
+            result = record.get("result")
+            if result is not None:
+                has_result[row] = True
+                if isinstance(result, BaseModel):
+                    result = result.__dict__
+                for field, column in results.items():
+                    value = result.get(field)
+                    if isinstance(column, CodedColumn):
+                        column.set(row, value)
+                    elif value is not None:
+                        column[row] = value
+            record_conditions = record.get("conditions") or {}
+            condition_order.set(row, tuple(record_conditions))
+            for key, value in record_conditions.items():
+                column = conditions.get(key)
+                if column is None:
+                    column = conditions[key] = CodedColumn(rows)
+                column.set(
+                    row,
+                    value,
+                    (
+                        (lambda v: Value.model_construct(**v))
+                        if isinstance(value, dict)
+                        else None
+                    ),
+                )
+        for column in itertools.chain(
+            results.values(), conditions.values(), [condition_order]
+        ):
+            if isinstance(column, CodedColumn):
+                column.finish()
+        return cls(rows, fields, has_result, results, conditions, condition_order)
+
+    def column(self, field: str, missing=None) -> npt.NDArray:
+        """
+        Object array of a record or result field; missing for the records
+        without a result.
+        """
+        if field in self.fields:
+            return self.fields[field].decode()
+        column = self.results[field]
+        if isinstance(column, CodedColumn):
+            return column.decode(missing)
+        values = column.astype(object)
+        values[np.isnan(column) & self.has_result] = None
+        values[~self.has_result] = missing
+        return values
+
+    def condition(self, key: str, missing=None) -> npt.NDArray:
+        """
+        Object array of a condition, missing for the records without it.
+        """
+        return self.conditions[key].decode(missing)
+
+    def to_frames(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        The fields, result and conditions DataFrames of effects2df.
+        """
+        df = to_df(
+            {field: self.column(field).tolist() for field in self.FIELDS}, self.rows
+        )
+        result_df = to_df(
+            (
+                {
+                    field: self.column(field, np.nan).tolist()
+                    for field in self.RESULT_FIELDS
+                }
+                if self.has_result.any()
+                else {}
+            ),
+            self.rows,
+        )
+        conditions = {}
+        for key, column in self.conditions.items():
+            # one dict per distinct Value, shared by its rows
+            labels = [dump_field(label) for label in column.labels]
+            conditions[key] = column.decode(np.nan, labels).tolist()
+        return df, result_df, to_df(conditions, self.rows)
+
+    def record(self, row: int) -> EffectRecord:
+        data = {
+            field: copy_label(column.labels[column.codes[row]])
+            for field, column in self.fields.items()
+        }
+        result = None
+        if self.has_result[row]:
+            result = {}
+            for field, column in self.results.items():
+                if isinstance(column, CodedColumn):
+                    result[field] = column.labels[column.codes[row]]
+                else:
+                    result[field] = (
+                        None if np.isnan(column[row]) else float(column[row])
+                    )
+            result = EffectResult.model_construct(**result)
+        data["result"] = result
+        data["conditions"] = conditions = {}
+        order = self.condition_order
+        for key in order.labels[order.codes[row]]:
+            column = self.conditions[key]
+            conditions[key] = copy_label(column.labels[column.codes[row]])
+        return EffectRecord.model_construct(**data)
+
+    def iter_records(self) -> Iterator[EffectRecord]:
+        # the codes are read as lists, only mutable values are copied per record
+        fields = [
+            (field, column.codes.tolist(), column.labels, column.is_mutable())
+            for field, column in self.fields.items()
+        ]
+        results = [(field, self.column(field).tolist()) for field in self.RESULT_FIELDS]
+        conditions = {
+            key: (key, column.codes.tolist(), column.labels, column.is_mutable())
+            for key, column in self.conditions.items()
+        }
+        # the conditions of the rows by their distinct key orders
+        orders = [
+            [conditions[key] for key in order] for order in self.condition_order.labels
+        ]
+        order_codes = self.condition_order.codes.tolist()
+        has_result = self.has_result.tolist()
+        for row in range(self.rows):
+            data = {}
+            for field, codes, labels, mutable in fields:
+                value = labels[codes[row]]
+                data[field] = copy_label(value) if mutable else value
+            data["result"] = (
+                EffectResult.model_construct(
+                    **{field: values[row] for field, values in results}
+                )
+                if has_result[row]
+                else None
+            )
+            data["conditions"] = record_conditions = {}
+            for key, codes, labels, mutable in orders[order_codes[row]]:
+                value = labels[codes[row]]
+                record_conditions[key] = copy_label(value) if mutable else value
+            yield EffectRecord.model_construct(**data)
+
+    def __iter__(self) -> Iterator[EffectRecord]:
+        return self.iter_records()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("EffectRecordTable index out of range")
+        return self.record(index)
+
+    def __eq__(self, other):
+        if not isinstance(other, (EffectRecordTable, list)):
+            return False
+        return len(self) == len(other) and list(self) == list(other)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the arrays of codes and numbers (not of the distinct values).
+        """
+        return self.has_result.nbytes + sum(
+            column.nbytes
+            for column in itertools.chain(
+                self.fields.values(),
+                self.results.values(),
+                self.conditions.values(),
+                [self.condition_order],
+            )
+        )
+
+    def __repr__(self):
+        return (
+            f"EffectRecordTable(records={self.rows}, "
+            f"conditions={list(self.conditions)!r})"
+        )
+
+
+def array_token(values) -> Dict[str, Any]:
+    """
+    JSON stand-in of an array in effects_digest: its dtype, shape and the hash
+    of its data, read block by block.
+    """
+    if values.dtype.hasobject:
+        return {"dtype": "object", "values": np.asarray(values).tolist()}
+    digest = hashlib.sha256()
+    if values.ndim == 0:
+        digest.update(np.ascontiguousarray(values[()]))
+    else:
+        step = max(1, values.shape[0] * COMPARE_BLOCK_BYTES // max(1, values.nbytes))
+        for start in range(0, values.shape[0], step):
+            digest.update(np.ascontiguousarray(values[start : start + step]))
+    return {
+        "dtype": values.dtype.str,
+        "shape": list(values.shape),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def digest_fallback(value):
+    if isinstance(value, ARRAY_TYPES):
+        return array_token(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Type {type(value).__name__} can't be hashed")
+
+
+def effects_digest(effects, chunk_size: int = 4096) -> str:
+    """
+    Stable content hash of papp.effect_records() (a list or an
+    EffectRecordTable) and the library version, the key of the array_cache
+    entries. EffectArrays are passed through by the conversion, they are not
+    hashed (nor lazy arrays read).
+
+    Raises:
+        TypeError: for effects holding values that can't be hashed.
+    """
+    digest = hashlib.sha256(array_cache.CACHE_VERSION.encode("utf-8"))
+
+    def update(value):
+        try:
+            digest.update(
+                to_json(value, inf_nan_mode="constants", fallback=digest_fallback)
+            )
+        except PydanticSerializationError as err:
+            raise TypeError(str(err)) from err
+
+    if isinstance(effects, EffectRecordTable):
+        update(
+            [
+                "EffectRecordTable",
+                effects.rows,
+                list(effects.fields),
+                list(effects.results),
+                list(effects.conditions),
+            ]
+        )
+        for column in itertools.chain(
+            [effects.has_result],
+            effects.fields.values(),
+            effects.results.values(),
+            effects.conditions.values(),
+            [effects.condition_order],
+        ):
+            if isinstance(column, CodedColumn):
+                update([column.codes, list(column.labels)])
+            else:
+                update(column)
+        return digest.hexdigest()
+    effects = [effect for effect in effects if not isinstance(effect, EffectArray)]
+    # the fields of the records by chunks, with their classes; serializing the
+    # field dicts is several times faster than serializing the models
+    for start in range(0, len(effects), chunk_size):
+        chunk = effects[start : start + chunk_size]
+        update(
+            [
+                [type(effect).__name__ for effect in chunk],
+                [effect.__dict__ for effect in chunk],
+            ]
+        )
+    return digest.hexdigest()
+
+
 class ProtocolApplication(AmbitModel):
     """
     ProtocolApplication : store results for single assay and a single sample
@@ -784,6 +1581,8 @@ class ProtocolApplication(AmbitModel):
     Returns:
         protocol: Protocol
         effects: List[EffectRecord]
+        effect_table: EffectRecordTable, optional columnar store of the
+            EffectRecords of large papps, read before those of effects.
 
     Examples:
         from typing import List
@@ -807,12 +1606,14 @@ class ProtocolApplication(AmbitModel):
     parameters: Optional[Dict[str, Union[str, Value, None]]] = None
     citation: Optional[Citation] = None
     effects: List[Union[EffectRecord, EffectArray]]
+    # serialized with the effects, see serialize_effects
+    effect_table: Optional[EffectRecordTable] = Field(default=None, exclude=True)
     owner: Optional[SampleLink] = None
     protocol: Optional[Protocol] = None
     investigation_uuid: Optional[str] = None
     assay_uuid: Optional[str] = None
     updated: Optional[str] = None
-    model_config = ConfigDict(populate_by_name=True)
+    model_config = ConfigDict(populate_by_name=True, arbitrary_types_allowed=True)
 
     @classmethod
     def create(
@@ -827,6 +1628,49 @@ class ProtocolApplication(AmbitModel):
             effects = []
         return cls(protocol=protocol, effects=effects, **kwargs)
 
+    @field_serializer("effects", mode="wrap")
+    def serialize_effects(self, effects, handler):
+        if self.effect_table is not None:
+            effects = list(self.iter_effects())
+        return handler(effects)
+
+    def iter_effects(self) -> Iterator[Union[EffectRecord, EffectArray]]:
+        """
+        The records of effect_table, then the effects.
+        """
+        if self.effect_table is not None:
+            yield from self.effect_table
+        yield from self.effects or []
+
+    def effect_records(self) -> Union[List[EffectRecord], EffectRecordTable]:
+        """
+        The EffectRecords of the papp in iter_effects order; effect_table
+        itself if effects holds no other records.
+        """
+        records = [
+            effect
+            for effect in self.effects or []
+            if isinstance(effect, EffectRecord) and not isinstance(effect, EffectArray)
+        ]
+        table = self.effect_table
+        if table is None or table.rows == 0:
+            return records
+        return list(table) + records if records else table
+
+    def tabulate_effects(self) -> EffectRecordTable:
+        """
+        Moves the EffectRecords of effects into effect_table, after the
+        records already there; the EffectArrays stay in effects.
+        """
+        records = [effect for effect in self.effects if type(effect) is EffectRecord]
+        if self.effect_table is not None:
+            records = itertools.chain(self.effect_table, records)
+        self.effect_table = EffectRecordTable.from_records(records)
+        self.effects = [
+            effect for effect in self.effects if type(effect) is not EffectRecord
+        ]
+        return self.effect_table
+
     @field_validator("parameters", mode="before")
     @classmethod
     def clean_parameters(cls, v):
@@ -852,9 +1696,10 @@ class ProtocolApplication(AmbitModel):
             }
         if self.citation:
             data["citation"] = self.citation.model_dump()
-        if self.effects:
+        if self.effects or self.effect_table:
             data["effects"] = [
-                e.model_dump() if isinstance(e, BaseModel) else e for e in self.effects
+                e.model_dump() if isinstance(e, BaseModel) else e
+                for e in self.iter_effects()
             ]
         if self.owner:
             data["owner"] = self.owner.model_dump()
@@ -866,15 +1711,23 @@ class ProtocolApplication(AmbitModel):
     def model_construct(cls, **data):
         if "parameters" in data and isinstance(data["parameters"], dict):
             data["parameters"] = {
-                k: Value(**v) if isinstance(v, dict) else v
+                k: Value.model_construct(**v) if isinstance(v, dict) else v
                 for k, v in data["parameters"].items()
             }
 
         if "citation" in data and isinstance(data["citation"], dict):
-            data["citation"] = Citation(**data["citation"])
+            data["citation"] = Citation.model_construct(**data["citation"])
         if "effects" in data:
             data["effects"] = [
-                EffectRecord.model_construct(**e) if isinstance(e, dict) else e
+                (
+                    (
+                        EffectArray.model_construct(**e)
+                        if "signal" in e
+                        else EffectRecord.model_construct(**e)
+                    )
+                    if isinstance(e, dict)
+                    else e
+                )
                 for e in data["effects"]
             ]
         if "owner" in data and isinstance(data["owner"], dict):
@@ -892,7 +1745,7 @@ class ProtocolApplication(AmbitModel):
             and self.interpretationCriteria == other.interpretationCriteria
             and self.parameters == other.parameters
             and self.citation == other.citation
-            and self.effects == other.effects
+            and list(self.iter_effects()) == list(other.iter_effects())
             and self.owner == other.owner
             and self.protocol == other.protocol
             and self.investigation_uuid == other.investigation_uuid
@@ -909,6 +1762,7 @@ class ProtocolApplication(AmbitModel):
             f"parameters={self.parameters!r}, "
             f"citation={self.citation!r}, "
             f"effects={self.effects!r}, "
+            f"effect_table={self.effect_table!r}, "
             f"owner={self.owner!r}, "
             f"protocol={self.protocol!r}, "
             f"investigation_uuid={self.investigation_uuid!r}, "
@@ -917,6 +1771,9 @@ class ProtocolApplication(AmbitModel):
             ")"
         )
 
+    @instrumented(
+        "create_multidimensional_matrix", rows=lambda self, df, *args, **kw: len(df)
+    )
     def create_multidimensional_matrix(
         self,
         df: pd.DataFrame,
@@ -953,9 +1810,6 @@ class ProtocolApplication(AmbitModel):
 
         # Extract unique values for each primary axis
         axis_values = [sorted(df[axis].unique()) for axis in primary_axis_cols]
-        axis_indices = [
-            {value: idx for idx, value in enumerate(values)} for values in axis_values
-        ]
 
         # axes = {axis: sorted(df[axis].unique()) for axis in primary_axis_cols}
 
@@ -980,35 +1834,32 @@ class ProtocolApplication(AmbitModel):
                     auxsignals[a] = np.full(shape, np.nan)
 
         # Populate the matrix with signal values
-        for _, row in df.iterrows():
-            try:
-                indices = tuple(
-                    axis_indices[i][row[primary_axis_cols[i]]]
-                    for i in range(len(primary_axis_cols))
-                )
-                if signal_col:
-                    signal_value = row[signal_col]
-                    if not pd.isna(signal_value):
-                        matrix[indices] = signal_value
-                if matrix_errors is not None:
-                    if not pd.isna(row[errors_col]):
-                        matrix_errors[indices] = row[errors_col]
-                if auxsignal_cols:
-                    for a in auxsignal_cols:
-                        if not pd.isna(row[a]):
-                            if isinstance(row[a], bytes):
-                                auxsignals[a][indices] = row[a].decode("utf-8")
-                            else:
-                                auxsignals[a][indices] = row[a]
-            except:  # noqa: B001,E722 FIXME
-                # print("matrix", self.uuid)
-                # print(row)
-                print(axis_indices)
-                print(primary_axis_cols)
-                print(traceback.format_exc())
-
-        for axis in primary_axis_cols:
-            unique_values = sorted(df[axis].unique())
+        try:
+            scatter_matrix(
+                df,
+                primary_axis_cols,
+                axis_values,
+                shape,
+                signal_col,
+                matrix,
+                errors_col,
+                matrix_errors,
+                auxsignals,
+            )
+        except (TypeError, ValueError):
+            # heterogeneous columns, e.g. strings in a numeric signal
+            scatter_matrix_rowwise(
+                df,
+                primary_axis_cols,
+                axis_values,
+                signal_col,
+                matrix,
+                errors_col,
+                matrix_errors,
+                auxsignals,
+            )
+
+        for axis, unique_values in zip(primary_axis_cols, axis_values):
             axes[axis].values = unique_values
 
         # Collect alternative axis values - tbd - sorting may change order of
@@ -1022,202 +1873,216 @@ class ProtocolApplication(AmbitModel):
 
         return matrix, axes, matrix_errors, auxsignals
 
+    @instrumented(
+        "convert_effectrecords2array",
+        rows=lambda self: len(self.effects or []) + len(self.effect_table or []),
+    )
     def convert_effectrecords2array(self):
+        """
+        The EffectArrays of the papp, with the EffectRecords converted into
+        arrays, and the effects2df frame of the records.
+
+        While an array_cache.ArrayCache is active, the converted arrays and the
+        frame are cached under the effects_digest of the records; cached
+        results are returned as copies.
+        """
+        cache = array_cache.active()
+        if cache is None:
+            return self.effectrecords2array()
+        records = self.effect_records()
+        if len(records) == 0:
+            return self.effectrecords2array()
+        passed = [effect for effect in self.effects if isinstance(effect, EffectArray)]
+        try:
+            key = effects_digest(records)
+        except TypeError:
+            return self.effectrecords2array()
+        cached = cache.get(key)
+        if cached is None:
+            arrays, df = self.effectrecords2array()
+            if df is not None:
+                cache.put(key, copy.deepcopy((arrays[len(passed) :], df)))
+            return arrays, df
+        converted, df = cached
+        return passed + copy.deepcopy(converted), df.copy()
+
+    def effectrecords2array(self):
+        """
+        convert_effectrecords2array without the cache.
+        """
         effects: List[Union[EffectRecord, EffectArray]] = self.effects
-        records = [
-            effect
-            for effect in effects
-            if isinstance(effect, EffectRecord) and not isinstance(effect, EffectArray)
-        ]
+        # effects2df reads the columns of an effect_table
+        records = self.effect_records()
         arrays = [effect for effect in effects if isinstance(effect, EffectArray)]
         if len(records) == 0:
             return effects, None
 
         _df, cols, result, conditions = effects2df(records)
 
-        _nonnumcols = find_string_only_columns(_df[conditions])
-        df_set = {"ALL": _df}
-        if len(_nonnumcols) > 0:
-            df_set = split_df_by_columns(_df, _nonnumcols)
-        # debug
+        # classified once, the class of a column holds for the rows of each group
+        _classes = classify_columns(
+            _df, list(conditions) + ["loValue", "upValue", "textValue"]
+        )
+        _nonnumcols = find_string_only_columns(_df[conditions], _classes)
+        # one pass over all effect records: the string only conditions split the
+        # records into separate arrays, then by endpointtype, endpoint and unit
+        group_cols = list(_nonnumcols) + ["endpointtype", "endpoint", "unit"]
         # here the null columns (e.g. replicates) are lost
-        # print(df_set)
 
-        for _key, df in df_set.items():
-            # df.to_excel("{}_{}.xlsx".format(self.uuid,key),index=False)
+        for _key, rows in nested_groups(_df, group_cols, leading=len(_nonnumcols)):
+            endpointtype, endpoint, unit = _key[-3:]
+            _tmp = _df.take(rows).reset_index(drop=True)
+            _tmp.dropna(how="all", inplace=True)
 
-            for endpointtype in df["endpointtype"].unique():
-                if endpointtype is None:
-                    dft = df.loc[df["endpointtype"].isna()].reset_index(drop=True)
-                else:
-                    dft = df.loc[df["endpointtype"] == endpointtype].reset_index(
-                        drop=True
-                    )
-                for endpoint in dft["endpoint"].unique():
-                    dfe = dft.loc[dft["endpoint"] == endpoint].reset_index(drop=True)
-                    for unit in dfe["unit"].unique():
-                        if unit is None:
-                            _tmp = dfe.loc[dfe["unit"].isna()].reset_index(drop=True)
-                        else:
-                            _tmp = dfe.loc[dfe["unit"] == unit].reset_index(drop=True)
-                        _tmp.dropna(how="all", inplace=True)
-
-                        if _tmp.shape[0] == 0:
-                            print("empty", uuid, endpointtype, endpoint, unit)
-                            continue
-
-                        axes = {}
-                        new_conditions = {}
-                        df_axes = pd.DataFrame()
-
-                        # handle alternative concentration axes. tbd generic solution
-                        alt_axes = [
-                            s for s in conditions if s.startswith("CONCENTRATION")
-                        ]
-                        alt_axes = [s for s in alt_axes if s not in _nonnumcols]
-                        if len(alt_axes) < 2:  # means there are no alternative axes
-                            alt_axes = None
-                        else:
-                            alt_axes = {alt_axes[0]: alt_axes[1:]}
-
-                        for _col in conditions:
-                            if _col in _nonnumcols:
-                                new_conditions[_col] = _tmp[_col].unique()[0]
-                                continue
-                            if "DATE" in _col:  # TBD !
-                                continue
-                            if _col in _tmp:
-                                _f = pd.json_normalize(_tmp[_col])
-                                if _f.empty:
-                                    axis = transform_array(_tmp[_col].values)
-                                    if axis is not None:
-                                        axes[_col] = ValueArray(values=axis)
-                                        df_axes[_col] = axis
-                                else:
-                                    # nan_indices = _f[_f['loValue'].isna()].index
-                                    # print(_tmp.loc[nan_indices,_col])
-
-                                    try:
-                                        _f["loValue"] = _f["loValue"].fillna(_tmp[_col])
-                                    except Exception:
-                                        # print(
-                                        #     _f['loValue'].apply(type).value_counts()
-                                        # )
-                                        traceback.print_exc()
-                                        # print(_col, _f["loValue"], self.uuid)
-
-                                    loValues = (
-                                        None
-                                        if _f["loValue"].dropna().empty
-                                        else transform_array(_f["loValue"].values)
-                                    )
-                                    if loValues is not None:
-                                        axes[_col] = ValueArray(
-                                            values=loValues,
-                                            unit=" ".join(_f["unit"].dropna().unique()),
-                                        )
-                                        df_axes[_col] = loValues
+            if _tmp.shape[0] == 0:
+                print("empty", uuid, endpointtype, endpoint, unit)
+                continue
+
+            axes = {}
+            new_conditions = {}
+            df_axes = pd.DataFrame()
+
+            # handle alternative concentration axes. tbd generic solution
+            alt_axes = [s for s in conditions if s.startswith("CONCENTRATION")]
+            alt_axes = [s for s in alt_axes if s not in _nonnumcols]
+            if len(alt_axes) < 2:  # means there are no alternative axes
+                alt_axes = None
+            else:
+                alt_axes = {alt_axes[0]: alt_axes[1:]}
+
+            for _col in conditions:
+                if _col in _nonnumcols:
+                    new_conditions[_col] = _tmp[_col].unique()[0]
+                    continue
+                if "DATE" in _col:  # TBD !
+                    continue
+                if _col in _tmp:
+                    _f = pd.json_normalize(_tmp[_col])
+                    if _f.empty:
+                        axis = transform_array(_tmp[_col].values, _classes[_col])
+                        if axis is not None:
+                            axes[_col] = ValueArray(values=axis)
+                            df_axes[_col] = axis
+                    else:
+                        # nan_indices = _f[_f['loValue'].isna()].index
+                        # print(_tmp.loc[nan_indices,_col])
+
+                        try:
+                            _f["loValue"] = _f["loValue"].fillna(_tmp[_col])
+                        except Exception:
+                            # print(
+                            #     _f['loValue'].apply(type).value_counts()
+                            # )
+                            traceback.print_exc()
+                            # print(_col, _f["loValue"], self.uuid)
 
                         loValues = (
                             None
-                            if _tmp["loValue"].dropna().empty
-                            else transform_array(_tmp["loValue"].values)
+                            if _f["loValue"].dropna().empty
+                            else transform_array(_f["loValue"].values)
                         )
-                        # _loQualifier = (
-                        #     None
-                        #     if _tmp["loQualifier"].dropna().empty
-                        #     else transform_array(_tmp["loQualifier"].values)
-                        # )
-                        # _upQualifier = (
-                        #     None
-                        #     if _tmp["upQualifier"].dropna().empty
-                        #     else transform_array(_tmp["upQualifier"].values)
-                        # )
-
-                        errqualifier = _tmp["errQualifier"].unique()[0]
-                        # if _tmp["errQualifier"].nunique() == 1
-                        # else _tmp["errQualifier"]
-
-                        # df_axes["loValue"] = loValues
-                        auxsignal_cols = []
-                        signal_col = None
-                        for tag in ["loValue", "upValue", "textValue"]:
-                            _values = (
-                                None
-                                if _tmp[tag].dropna().empty
-                                else transform_array(_tmp[tag].values)
+                        if loValues is not None:
+                            axes[_col] = ValueArray(
+                                values=loValues,
+                                unit=" ".join(_f["unit"].dropna().unique()),
                             )
-                            if _values is not None:
-                                if (signal_col is None) and (tag != "textValue"):
-                                    signal_col = tag
-                                else:
-                                    auxsignal_cols.append(tag)
-                                df_axes[tag] = _values
-
-                        if df_axes.isna().any().any():
-                            # for some reason there are still nan values
-                            axes_all = []
-                            nan_columns = df_axes.columns[df_axes.isna().any()].tolist()
-                            df_axes_nan = df_axes[
-                                df_axes[nan_columns].isna().any(axis=1)
-                            ]
-                            df_axes_nan = df_axes_nan.dropna(axis=1, how="all")
-                            df_axes_not_nan = df_axes[
-                                df_axes[nan_columns].notna().all(axis=1)
-                            ]
-                            if not df_axes_not_nan.empty:
-                                axes_all.append(df_axes_not_nan)
-                                # print(print(df_axes_not_nan))
-                            if not df_axes_nan.empty:
-                                # ignore for now
-                                # axes_all.append(df_axes_nan)
-                                print(df_axes_nan)
-                        else:
-                            axes_all = [df_axes]
-
-                        for df_axes in axes_all:
-                            if _tmp["errorValue"].dropna().empty:
-                                error_col = None
-                            else:
-                                error_col = "errorValue"
-                                df_axes[error_col] = _tmp[error_col]
-
-                            matrix, axes, matrix_errors, auxsignals = (
-                                self.create_multidimensional_matrix(
-                                    df_axes,
-                                    signal_col,
-                                    axes,
-                                    alt_axes,
-                                    error_col,
-                                    auxsignal_cols,
-                                )
-                            )
-                            # Remove items where the value is None or NaN
-                            new_conditions = {
-                                k: v
-                                for k, v in new_conditions.items()
-                                if v is not None
-                                and not (isinstance(v, float) and np.isnan(v))
-                            }
-
-                            earray = EffectArray(
-                                endpoint=endpoint,
-                                endpointtype=endpointtype,
-                                conditions=new_conditions,
-                                signal=ValueArray(
-                                    unit=unit,
-                                    # values=textValue if loValues is None
-                                    # else loValues,
-                                    values=matrix,
-                                    errQualifier=errqualifier,
-                                    errorValue=matrix_errors,
-                                    auxiliary=auxsignals,
-                                ),
-                                axes=axes,
-                                axis_groups=alt_axes,
-                            )
-                            arrays.append(earray)
-                            # print(earray)
+                            df_axes[_col] = loValues
+
+            loValues = (
+                None
+                if _tmp["loValue"].dropna().empty
+                else transform_array(_tmp["loValue"].values, _classes["loValue"])
+            )
+            # _loQualifier = (
+            #     None
+            #     if _tmp["loQualifier"].dropna().empty
+            #     else transform_array(_tmp["loQualifier"].values)
+            # )
+            # _upQualifier = (
+            #     None
+            #     if _tmp["upQualifier"].dropna().empty
+            #     else transform_array(_tmp["upQualifier"].values)
+            # )
+
+            errqualifier = _tmp["errQualifier"].unique()[0]
+            # if _tmp["errQualifier"].nunique() == 1
+            # else _tmp["errQualifier"]
+
+            # df_axes["loValue"] = loValues
+            auxsignal_cols = []
+            signal_col = None
+            for tag in ["loValue", "upValue", "textValue"]:
+                _values = (
+                    None
+                    if _tmp[tag].dropna().empty
+                    else transform_array(_tmp[tag].values, _classes[tag])
+                )
+                if _values is not None:
+                    if (signal_col is None) and (tag != "textValue"):
+                        signal_col = tag
+                    else:
+                        auxsignal_cols.append(tag)
+                    df_axes[tag] = _values
+
+            if df_axes.isna().any().any():
+                # for some reason there are still nan values
+                axes_all = []
+                nan_columns = df_axes.columns[df_axes.isna().any()].tolist()
+                df_axes_nan = df_axes[df_axes[nan_columns].isna().any(axis=1)]
+                df_axes_nan = df_axes_nan.dropna(axis=1, how="all")
+                df_axes_not_nan = df_axes[df_axes[nan_columns].notna().all(axis=1)]
+                if not df_axes_not_nan.empty:
+                    axes_all.append(df_axes_not_nan)
+                    # print(print(df_axes_not_nan))
+                if not df_axes_nan.empty:
+                    # ignore for now
+                    # axes_all.append(df_axes_nan)
+                    print(df_axes_nan)
+            else:
+                axes_all = [df_axes]
+
+            for df_axes in axes_all:
+                if _tmp["errorValue"].dropna().empty:
+                    error_col = None
+                else:
+                    error_col = "errorValue"
+                    df_axes[error_col] = _tmp[error_col]
+
+                matrix, axes, matrix_errors, auxsignals = (
+                    self.create_multidimensional_matrix(
+                        df_axes,
+                        signal_col,
+                        axes,
+                        alt_axes,
+                        error_col,
+                        auxsignal_cols,
+                    )
+                )
+                # Remove items where the value is None or NaN
+                new_conditions = {
+                    k: v
+                    for k, v in new_conditions.items()
+                    if v is not None and not (isinstance(v, float) and np.isnan(v))
+                }
+
+                earray = EffectArray(
+                    endpoint=endpoint,
+                    endpointtype=endpointtype,
+                    conditions=new_conditions,
+                    signal=ValueArray(
+                        unit=unit,
+                        # values=textValue if loValues is None
+                        # else loValues,
+                        values=matrix,
+                        errQualifier=errqualifier,
+                        errorValue=matrix_errors,
+                        auxiliary=auxsignals,
+                    ),
+                    axes=axes,
+                    axis_groups=alt_axes,
+                )
+                arrays.append(earray)
+                # print(earray)
         return arrays, _df
 
 
@@ -1251,6 +2116,27 @@ class Study(AmbitModel):
             data["study"] = [pa.model_dump() for pa in data["study"]]
         return data
 
+    @classmethod
+    def iter_from_file(
+        cls, path: str, chunk_size: int = 1 << 16, validate: bool = True
+    ) -> Iterator[ProtocolApplication]:
+        """
+        Parse the "study" array of an AMBIT JSON file incrementally, yielding one
+        ProtocolApplication at a time. With validate=False the records are built
+        with model_construct, for trusted input.
+
+        Example:
+            for papp in Study.iter_from_file("study.json"):
+                print(papp.uuid)
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            for item in iter_json_array(file, "study", chunk_size):
+                yield (
+                    ProtocolApplication(**item)
+                    if validate
+                    else ProtocolApplication.model_construct(**item)
+                )
+
     @classmethod
     def model_construct(cls, **data):
         if "study" in data and isinstance(data["study"], list):
@@ -1595,6 +2481,27 @@ class Substances(AmbitModel):
         data["substance"] = [substance.model_dump() for substance in self.substance]
         return data
 
+    @classmethod
+    def iter_from_file(
+        cls, path: str, chunk_size: int = 1 << 16, validate: bool = True
+    ) -> Iterator[SubstanceRecord]:
+        """
+        Parse the "substance" array of an AMBIT JSON file incrementally, yielding
+        one SubstanceRecord at a time. With validate=False the records are built
+        with model_construct, for trusted input.
+
+        Example:
+            for substance in Substances.iter_from_file("substance.json"):
+                print(substance.i5uuid)
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            for item in iter_json_array(file, "substance", chunk_size):
+                yield (
+                    SubstanceRecord(**item)
+                    if validate
+                    else SubstanceRecord.model_construct(**item)
+                )
+
     @classmethod
     def model_construct(cls, **data: Any) -> "Substances":
         if "substance" in data:
@@ -1653,29 +2560,209 @@ def configure_papp(
     papp.owner = SampleLink(substance=substance, company=company)
 
 
-def transform_array(arr):
-    any_strings = any(isinstance(item, str) for item in arr)
-    if any_strings:
+def iter_json_array(file: TextIO, key: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Incrementally parse the array under the top level key of a JSON object,
+    yielding the parsed elements one at a time.
+    Only the current element and the read buffer are held in memory; other top
+    level values are parsed and discarded.
+
+    Args:
+        file: text stream with a JSON object, e.g. AMBIT /study or /substance
+        key: "study" or "substance"
+        chunk_size: number of characters to read at once
+
+    Raises:
+        ValueError: if the stream is not a JSON object
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read(size=chunk_size):
+        nonlocal buffer, pos, eof
+        chunk = file.read(size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                raise ValueError("Unexpected end of JSON stream")
+            read()
+
+    def expect(chars):
+        nonlocal pos
+        char = peek()
+        if char not in chars:
+            raise ValueError(
+                "Expected one of {!r} but found {!r} in JSON stream".format(chars, char)
+            )
+        pos += 1
+        return char
+
+    def decode():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if (
+                    eof
+                    or isinstance(value, bool)
+                    or not isinstance(value, (int, float))
+                    or (end < len(buffer) and buffer[end] not in "0123456789.eE+-")
+                ):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # grow the reads, so large values are not parsed over and over
+            read(max(chunk_size, len(buffer) - pos))
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        name = decode()
+        expect(":")
+        if name == key:
+            expect("[")
+            if peek() == "]":
+                return
+            while True:
+                yield decode()
+                if expect(",]") == "]":
+                    return
+        decode()
+        if expect(",}") == "}":
+            return
+
+
+ARRAY_CLASSES = ("null", "numeric", "string", "mixed")
+# pandas infer_dtype(skipna=True) results which decide the class; "mixed"
+# may or may not include strings, and all NaT arrays infer as "datetime"
+INFERRED_CLASSES = {
+    "empty": "null",
+    "string": "string",
+    **{
+        inferred: "numeric"
+        for inferred in (
+            "integer",
+            "floating",
+            "mixed-integer-float",
+            "decimal",
+            "complex",
+            "boolean",
+            "bytes",
+        )
+    },
+}
+# below this size a list comprehension encodes faster than the numpy casts
+ENCODE_BULK_SIZE = 256
+
+
+def classify_array(arr) -> str:
+    """
+    One of ARRAY_CLASSES: "null" if there is no value other than None / NaN,
+    "string" if all values are strings, "mixed" if some are, otherwise
+    "numeric" (numbers, or other objects).
+    """
+    arr = np.asarray(arr)
+    kind = arr.dtype.kind
+    if arr.size == 0:
+        return "null"
+    if kind == "U":
+        return "string"
+    if kind in "fc":
+        return "null" if np.isnan(arr).all() else "numeric"
+    if kind != "O":
+        return "numeric"
+    # one pass in C, short-circuits on the first value of a second type
+    inferred = pd.api.types.infer_dtype(arr.ravel(), skipna=True)
+    if inferred in INFERRED_CLASSES:
+        return INFERRED_CLASSES[inferred]
+    types = set(map(type, arr.ravel()))
+    has_strings = any(issubclass(t, str) for t in types)
+    types = [t for t in types if not issubclass(t, str) and t is not type(None)]
+    if types:
+        # NaN, NaT, pd.NA are not values either
+        null = pd.isna(arr)
+        if not null.all() and (
+            not has_strings
+            or not all(issubclass(t, str) for t in set(map(type, arr[~null].ravel())))
+        ):
+            return "mixed" if has_strings else "numeric"
+    return "string" if has_strings else "null"
+
+
+def encode_ascii(arr) -> npt.NDArray:
+    """
+    Fixed width bytes (S) array of the values as ASCII text (str(value)),
+    None as "=".
+    """
+    arr = np.asarray(arr)
+    if arr.dtype.kind != "O" or arr.size == 0:
+        return np.char.encode(arr.astype(str), "ascii", "ignore")
+    if arr.size < ENCODE_BULK_SIZE:
+        return np.array(
+            [
+                b"=" if x is None else str(x).encode("ascii", errors="ignore")
+                for x in arr.ravel()
+            ]
+        ).reshape(arr.shape)
+    types = set(map(type, arr.ravel()))
+    if type(None) in types:
+        none = np.fromiter(
+            map(operator.is_, arr.ravel(), itertools.repeat(None)), bool, arr.size
+        )
+        arr = arr.copy()
+        arr[none.reshape(arr.shape)] = "="
+        types.discard(type(None))
+        types.add(str)
+    if all(issubclass(t, str) for t in types):
+        # text columns repeat few labels, only these are encoded
+        codes, labels = pd.factorize(arr.ravel())
+        encoded = np.array([label.encode("ascii", "ignore") for label in labels])
+        return encoded[codes].reshape(arr.shape)
+    if any(issubclass(t, bytes) for t in types):
+        # the casts to S and U would keep the bytes, not str(value)
+        arr = np.frompyfunc(str, 1, 1)(arr)
+    try:
+        return arr.astype("S")
+    except UnicodeEncodeError:
+        return np.char.encode(arr.astype(str), "ascii", "ignore")
+
+
+def transform_array(arr, array_class: Optional[str] = None):
+    """
+    The values as numbers if they can be converted, otherwise as ASCII bytes
+    if there are strings; None if there are no values.
+
+    Args:
+        array_class: classify_array of arr or of the column arr was taken
+            from; "null" and "numeric" mean there are no strings to check.
+    """
+    if array_class not in ("null", "numeric"):
+        array_class = classify_array(arr)
+    if array_class in ("string", "mixed"):
         try:
             return pd.to_numeric(arr, errors="raise")
         except Exception:
-            _converted = np.array(
-                [
-                    (
-                        "=".encode("ascii", errors="ignore")  # Default value for None
-                        if x is None
-                        else (
-                            x.encode("ascii", errors="ignore")  # Encode strings
-                            if isinstance(x, str)
-                            else str(x).encode(
-                                "ascii", errors="ignore"
-                            )  # Convert non-strings to string and encode
-                        )
-                    )
-                    for x in arr
-                ]
-            )
-            return _converted
+            return encode_ascii(arr)
+    if np.asarray(arr).dtype.kind in "iubfc":
+        # numbers need no conversion, classify_array checked them for NaN
+        return None if classify_array(arr) == "null" else arr
     numeric_array = pd.to_numeric(arr, errors="coerce")
     all_nans = np.all(np.isnan(numeric_array))
     if all_nans:
@@ -1684,25 +2771,201 @@ def transform_array(arr):
         return arr
 
 
+def axis_codes(series: pd.Series, values: List) -> npt.NDArray:
+    """
+    Position of every element of ``series`` within the sorted axis ``values``.
+    Missing values and values not on the axis are coded as -1.
+    """
+    codes, uniques = pd.factorize(series)
+    position = {value: idx for idx, value in enumerate(values)}
+    lookup = np.array([position.get(u, -1) for u in uniques] + [-1], dtype=np.intp)
+    # factorize codes NaN as -1, which picks the trailing -1 in lookup
+    return lookup[codes]
+
+
+def scatter_last(target: npt.NDArray, flat_indices: npt.NDArray, values) -> None:
+    """
+    Assign ``values`` into the flattened ``target``; where an index repeats, the
+    last value wins, as it would when assigning row by row.
+    """
+    if len(flat_indices) == 0:
+        return
+    _, last = np.unique(flat_indices[::-1], return_index=True)
+    last = len(flat_indices) - 1 - last
+    # convert before writing, so a failing cast leaves target untouched
+    values = np.asarray(values, dtype=object)[last].astype(target.dtype)
+    target.reshape(-1)[flat_indices[last]] = values
+
+
+def scatter_matrix(
+    df: pd.DataFrame,
+    axis_cols: List[str],
+    axis_values: List[List],
+    shape: Tuple[int, ...],
+    signal_col: str,
+    matrix: npt.NDArray,
+    errors_col: str,
+    matrix_errors: npt.NDArray,
+    auxsignals: Dict[str, npt.NDArray],
+) -> None:
+    """
+    Fill the signal, error and auxiliary matrices in bulk.
+    Each axis column is factorized once and rows are mapped to flat indices
+    with np.ravel_multi_index. Rows with a missing axis value are skipped.
+    """
+    if axis_cols:
+        codes = [
+            axis_codes(df[axis], values) for axis, values in zip(axis_cols, axis_values)
+        ]
+        valid = np.logical_and.reduce([c >= 0 for c in codes])
+        flat = np.ravel_multi_index(tuple(c[valid] for c in codes), shape)
+    else:
+        valid = np.ones(df.shape[0], dtype=bool)
+        flat = np.zeros(df.shape[0], dtype=np.intp)
+
+    def scatter(target, col, decode=False):
+        values = df[col].values[valid]
+        notna = ~pd.isna(values)
+        values = values[notna]
+        if decode:
+            values = np.array(
+                [v.decode("utf-8") if isinstance(v, bytes) else v for v in values],
+                dtype=object,
+            )
+        scatter_last(target, flat[notna], values)
+
+    if signal_col:
+        scatter(matrix, signal_col)
+    if matrix_errors is not None:
+        scatter(matrix_errors, errors_col)
+    for a, _arr in auxsignals.items():
+        scatter(_arr, a, decode=_arr.dtype == object)
+
+
+def scatter_matrix_rowwise(
+    df: pd.DataFrame,
+    axis_cols: List[str],
+    axis_values: List[List],
+    signal_col: str,
+    matrix: npt.NDArray,
+    errors_col: str,
+    matrix_errors: npt.NDArray,
+    auxsignals: Dict[str, npt.NDArray],
+) -> None:
+    """
+    Row by row equivalent of scatter_matrix, for columns numpy can't assign in bulk.
+    """
+    axis_indices = [
+        {value: idx for idx, value in enumerate(values)} for values in axis_values
+    ]
+    for _, row in df.iterrows():
+        try:
+            indices = tuple(
+                axis_indices[i][row[axis_cols[i]]] for i in range(len(axis_cols))
+            )
+            if signal_col:
+                signal_value = row[signal_col]
+                if not pd.isna(signal_value):
+                    matrix[indices] = signal_value
+            if matrix_errors is not None:
+                if not pd.isna(row[errors_col]):
+                    matrix_errors[indices] = row[errors_col]
+            for a in auxsignals:
+                if not pd.isna(row[a]):
+                    if isinstance(row[a], bytes):
+                        auxsignals[a][indices] = row[a].decode("utf-8")
+                    else:
+                        auxsignals[a][indices] = row[a]
+        except:  # noqa: B001,E722 FIXME
+            print(axis_indices)
+            print(axis_cols)
+            print(traceback.format_exc())
+
+
+def dump_field(value: Any) -> Any:
+    # what model_dump() returns for a field value
+    if isinstance(value, Value):
+        return dict(value.__dict__)
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return {k: dump_field(v) for k, v in value.items()}
+    return value
+
+
+def model_columns(items: List[Optional[BaseModel]], exclude=()) -> Dict[str, List]:
+    """
+    Field values of the models as columns, in field order. None items and fields
+    a model does not have are NaN, as with pd.DataFrame([m.model_dump() ...]).
+    """
+    fields = {}
+    for _type in dict.fromkeys(type(item) for item in items if item is not None):
+        fields.update(dict.fromkeys(_type.model_fields))
+    dicts = [None if item is None else item.__dict__ for item in items]
+    columns = {}
+    for field in fields:
+        if field in exclude:
+            continue
+        try:
+            values = list(map(operator.itemgetter(field), dicts))
+        except (KeyError, TypeError):  # mixed models or None items
+            values = [np.nan if d is None else d.get(field, np.nan) for d in dicts]
+        if any(issubclass(t, (BaseModel, list, dict)) for t in set(map(type, values))):
+            values = [dump_field(v) for v in values]
+        columns[field] = values
+    return columns
+
+
+def to_df(columns: Dict[str, List], rows: int) -> pd.DataFrame:
+    return pd.DataFrame(columns, index=pd.RangeIndex(rows), columns=list(columns))
+
+
+@instrumented("effects2df", rows=lambda effects, *args, **kw: len(effects))
 def effects2df(effects, drop_parsed_cols=True):
-    # Convert the list of EffectRecord objects to a list of dictionaries
+    if isinstance(effects, EffectRecordTable):
+        if effects.rows == 0:
+            return (None, None, None, None)
+        if drop_parsed_cols:
+            df, result_df, conditions_df = effects.to_frames()
+            return (
+                pd.concat([df, result_df, conditions_df], axis=1),
+                df.columns,
+                result_df.columns,
+                conditions_df.columns,
+            )
+        effects = list(effects)
+    # Read the EffectRecord fields straight into preallocated columns,
+    # instead of model_dump() per record and exploding the dicts afterwards
     effectrecord_only = list(
         filter(lambda item: not isinstance(item, EffectArray), effects)
     )
     if not effectrecord_only:  # empty
         return (None, None, None, None)
-    effect_records_dicts = [er.model_dump() for er in effectrecord_only]
-    # Convert the list of dictionaries to a DataFrame
-    df = pd.DataFrame(effect_records_dicts)
-    _tag = "conditions"
-    conditions_df = pd.DataFrame(df[_tag].tolist())
-    # Drop the original 'conditions' column from the main DataFrame
-    if drop_parsed_cols:
-        df.drop(columns=[_tag], inplace=True)
-    _tag = "result"
-    result_df = pd.DataFrame(df[_tag].tolist())
-    if drop_parsed_cols:
-        df.drop(columns=[_tag], inplace=True)
+    rows = len(effectrecord_only)
+    df = to_df(
+        model_columns(
+            effectrecord_only,
+            exclude=("conditions", "result") if drop_parsed_cols else (),
+        ),
+        rows,
+    )
+    result_df = to_df(model_columns([er.result for er in effectrecord_only]), rows)
+    conditions = {}
+    for row, er in enumerate(effectrecord_only):
+        if not er.conditions:
+            continue
+        for key, value in er.conditions.items():
+            column = conditions.get(key)
+            if column is None:
+                column = conditions[key] = [np.nan] * rows
+            if isinstance(value, Value):
+                value = dict(value.__dict__)
+            elif isinstance(value, BaseModel):
+                value = value.model_dump()
+            column[row] = value
+    conditions_df = to_df(conditions, rows)
     # Concatenate the main DataFrame and the result and conditions DataFrame
     return (
         pd.concat([df, result_df, conditions_df], axis=1),
@@ -1726,27 +2989,101 @@ def find_non_numeric_columns(df):
     return non_numeric_cols
 
 
-def find_string_only_columns(df):
-    # Identify columns with dtype 'object'
-    object_cols = df.select_dtypes(include="object").columns
+def classify_columns(
+    df: pd.DataFrame, columns: Optional[List[str]] = None
+) -> Dict[str, str]:
+    """
+    classify_array of every column (or of the given columns).
+    """
+    return {
+        col: classify_array(df[col].values)
+        for col in (df.columns if columns is None else columns)
+    }
 
-    # Function to check if all values in the column are strings
-    def is_string_only(series):
-        # Check if all values in the series are either strings or NaN
-        return series.apply(lambda x: isinstance(x, str) or pd.isna(x)).all()
 
-    # Use list comprehension to check if each column is string only and cannot be
-    # converted to numeric.
-    string_only_cols = [
-        col
-        for col in object_cols
-        if is_string_only(df[col])
-        and pd.to_numeric(df[col], errors="coerce").isna().all()
-    ]
-    # print(string_only_cols)
+def has_numeric_strings(arr) -> bool:
+    """
+    Whether any string of a "string" class array reads as a number.
+    """
+    labels = pd.unique(np.asarray(arr, dtype=object).ravel())
+    return bool(pd.notna(pd.to_numeric(labels, errors="coerce")).any())
+
+
+@instrumented("find_string_only_columns", rows=lambda df, *args, **kw: len(df))
+def find_string_only_columns(df, classes: Optional[Dict[str, str]] = None):
+    """
+    The object columns holding only strings (or no values at all), none of
+    which reads as a number.
+
+    Args:
+        classes: classify_columns of df, if already known.
+    """
+    if classes is None:
+        classes = classify_columns(df)
+    string_only_cols = []
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        array_class = classes[col]
+        if array_class == "null" or (
+            array_class == "string" and not has_numeric_strings(df[col].values)
+        ):
+            string_only_cols.append(col)
     return string_only_cols
 
 
+def group_rows(
+    df: pd.DataFrame, columns: List[str]
+) -> Tuple[List[tuple], List[npt.NDArray]]:
+    """
+    The distinct value combinations of columns (missing values equal) in order
+    of first appearance, and the row positions of each, from one groupby pass.
+    """
+    codes = df.groupby(columns, dropna=False, sort=False).ngroup().to_numpy()
+    rows = np.argsort(codes, kind="stable")
+    groups = np.split(rows, np.cumsum(np.bincount(codes))[:-1])
+    keys = list(
+        df[columns].iloc[[g[0] for g in groups]].itertuples(index=False, name=None)
+    )
+    return keys, groups
+
+
+def nested_groups(df: pd.DataFrame, columns: List[str], leading: int = 1):
+    """
+    Split df by the values of columns in a single groupby pass, treating missing
+    values as equal.
+
+    Yields (key, row positions) in the order nested loops over the unique values
+    of each column would visit them: by first appearance of the first column, then
+    of the second column within it and so on.
+
+    Args:
+        leading (int): The first leading columns form the outer loop together,
+            ordered by first appearance of their value combinations (as in
+            split_df_by_columns).
+    """
+    if df.shape[0] == 0:
+        return
+    keys, groups = group_rows(df, columns)
+    # groups come in order of their first row; rank every key prefix the same way
+    prefixes = [
+        [
+            tuple(None if pd.isna(v) else v for v in key[:level])
+            for level in range(max(1, leading), len(columns))
+        ]
+        for key in keys
+    ]
+    rank = {}
+    for key_prefixes in prefixes:
+        for prefix in key_prefixes:
+            rank.setdefault(prefix, len(rank))
+    order = sorted(
+        range(len(groups)), key=lambda i: [rank[prefix] for prefix in prefixes[i]]
+    )
+    for i in order:
+        yield keys[i], groups[i]
+
+
 def split_df_by_columns_bad_with_nans(df, columns):
     # Create a dictionary to hold the split DataFrames
     split_dfs = {}
@@ -1768,27 +3105,23 @@ def split_df_by_columns_bad_with_nans(df, columns):
     return split_dfs
 
 
-def split_df_by_columns(df, columns):
-    # Create a dictionary to hold the split DataFrames
-    split_dfs = {}
-
-    # Identify unique combinations of values for the specified columns
-    unique_combinations = df[columns].drop_duplicates()
-
-    for _, row in unique_combinations.iterrows():
-        # Create a filter condition that treats NaN as equal
-        filter_condition = pd.DataFrame(
-            {
-                col: (df[col] == row[col]) | (pd.isna(df[col]) & pd.isna(row[col]))
-                for col in columns
-            }
-        ).all(axis=1)
-
-        # Create a new DataFrame for this combination
-        split_df = df[filter_condition]
+@instrumented("split_df_by_columns", rows=lambda df, *args, **kw: len(df))
+def split_df_by_columns(df, columns, as_index=False):
+    """
+    Split df by the distinct value combinations of columns, treating missing
+    values as equal, in one groupby pass.
 
-        # Use a tuple of the unique values as the key, treating NaN gracefully
-        key = tuple(row)
-        split_dfs[key] = split_df
+    Args:
+        as_index (bool): Map to the row positions (numpy arrays) of each
+            combination instead of DataFrames taken from df.
 
-    return split_dfs
+    Returns:
+        Dict[tuple, DataFrame]: the rows (in df order) per combination, in
+        order of first appearance.
+    """
+    if df.shape[0] == 0:
+        return {}
+    keys, groups = group_rows(df, columns)
+    if as_index:
+        return dict(zip(keys, groups))
+    return {key: df.take(rows) for key, rows in zip(keys, groups)}
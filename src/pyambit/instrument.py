@@ -0,0 +1,238 @@
+"""
+Opt-in instrumentation of the named conversion stages (effects2df,
+convert_effectrecords2array, effectarray2data, substancerecord2solr, ...).
+
+    with Instrumentation(trace_memory=True) as stats:
+        study.to_nexus(nx.NXroot())
+    print(stats.to_json())
+
+Without an active Instrumentation an instrumented function only checks a
+module global before calling through. Stages run in worker processes
+(workers > 1) are not recorded.
+"""
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+_active: Optional["Instrumentation"] = None
+
+
+class StageStats:
+    """
+    Totals of one stage; peak_bytes is the largest allocation peak of a
+    single call above the memory in use when it started (tracemalloc).
+    """
+
+    __slots__ = ("calls", "seconds", "rows", "peak_bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.peak_bytes = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "rows": self.rows,
+            "peak_bytes": self.peak_bytes,
+        }
+
+
+class Instrumentation:
+    """
+    Records the instrumented stages called while it is active (within the
+    with block).
+
+    Args:
+        trace_memory (bool): Measures the allocation peaks with tracemalloc,
+            which slows down the traced code considerably.
+        callbacks: Called after every stage call with
+            (stage, seconds, rows, peak_bytes).
+    """
+
+    def __init__(
+        self,
+        trace_memory: bool = False,
+        callbacks: Optional[
+            List[Callable[[str, float, int, Optional[int]], Any]]
+        ] = None,
+    ):
+        self.trace_memory = trace_memory
+        self.callbacks = list(callbacks or [])
+        self.stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._previous = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        _active = self._previous
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def add_callback(self, callback: Callable[[str, float, int, Optional[int]], Any]):
+        self.callbacks.append(callback)
+
+    def frames(self) -> List[List[int]]:
+        """
+        The memory at the start and the peak so far of the stages running in
+        this thread, innermost last.
+        """
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def record(
+        self, stage: str, seconds: float, rows: int, peak_bytes: Optional[int] = None
+    ):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.rows += rows
+            if peak_bytes is not None:
+                stats.peak_bytes = max(stats.peak_bytes or 0, peak_bytes)
+        for callback in self.callbacks:
+            callback(stage, seconds, rows, peak_bytes)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: stats.as_dict() for stage, stats in self.stages.items()}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix: str = "pyambit") -> str:
+        """
+        The stage totals in the Prometheus text exposition format.
+        """
+        stages = self.to_dict()
+        metrics = [
+            ("stage_calls_total", "counter", "calls", "Calls of the stage."),
+            ("stage_seconds_total", "counter", "seconds", "Wall time in the stage."),
+            ("stage_rows_total", "counter", "rows", "Rows processed by the stage."),
+            (
+                "stage_peak_bytes",
+                "gauge",
+                "peak_bytes",
+                "Largest allocation peak of a stage call.",
+            ),
+        ]
+        lines = []
+        for name, kind, key, description in metrics:
+            samples = [
+                (stage, stats[key])
+                for stage, stats in sorted(stages.items())
+                if stats[key] is not None
+            ]
+            if not samples:
+                continue
+            lines.append("# HELP {}_{} {}".format(prefix, name, description))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            for stage, value in samples:
+                lines.append(
+                    '{}_{}{{stage="{}"}} {}'.format(prefix, name, stage, value)
+                )
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    def __init__(self, instrumentation: Instrumentation, name: str, rows: int = 0):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.rows = rows
+        self.frame = None
+
+    def __enter__(self):
+        if self.instrumentation.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            frames = self.instrumentation.frames()
+            if frames:
+                # reset_peak below loses the peak of the enclosing stage
+                frames[-1][1] = max(frames[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.frame = [current, current]
+            frames.append(self.frame)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        peak_bytes = None
+        if self.frame is not None:
+            frames = self.instrumentation.frames()
+            frames.pop()
+            peak = max(
+                self.frame[1],
+                tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0,
+            )
+            peak_bytes = peak - self.frame[0]
+            if frames:
+                frames[-1][1] = max(frames[-1][1], peak)
+        self.instrumentation.record(self.name, seconds, self.rows, peak_bytes)
+
+
+class NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NO_STAGE = NoStage()
+
+
+def stage(name: str, rows: int = 0):
+    """
+    Context manager recording the enclosed code as a stage, if an
+    Instrumentation is active.
+    """
+    instrumentation = _active
+    if instrumentation is None:
+        return NO_STAGE
+    return StageTimer(instrumentation, name, rows)
+
+
+def instrumented(name: str, rows: Optional[Callable[..., int]] = None):
+    """
+    Decorator recording the calls of the function as the stage name.
+
+    Args:
+        rows: Called with the arguments of the function, returns the number
+            of rows (records, effects, array elements) the call processes.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            instrumentation = _active
+            if instrumentation is None:
+                return func(*args, **kwargs)
+            count = 0 if rows is None else rows(*args, **kwargs)
+            with StageTimer(instrumentation, name, count):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,13 +1,18 @@
+import functools
 import traceback
-from typing import Dict
+from typing import Dict, List, Optional
 
 import nexusformat.nexus as nx
+import numpy as np
 
 from pyambit.datamodel import (
     Citation,
+    EffectArray,
     EffectRecord,
     EffectResult,
     EndpointCategory,
+    LazyArray,
+    LazyValueArray,
     Protocol,
     ProtocolApplication,
     SampleLink,
@@ -16,6 +21,111 @@ from pyambit.datamodel import (
     Value,
 )
 
+# attributes written by nexusformat / effectarray2data, not effect conditions
+NXDATA_ATTRS = ("NX_class", "signal", "axes", "auxiliary_signals", "interpretation")
+NXFIELD_ATTRS = ("units", "long_name", "errors", "target")
+
+
+def read_nxfield(field: nx.NXfield) -> np.ndarray:
+    values = np.asarray(field.nxdata)
+    if values.dtype.hasobject or values.dtype.kind == "S":
+        values = np.array(
+            [v.decode("utf-8") if isinstance(v, bytes) else v for v in values.flat],
+            dtype=object,
+        ).reshape(values.shape)
+    return values
+
+
+def lazy_nxfield(field: nx.NXfield) -> LazyArray:
+    """
+    The field data, read from the file only when used.
+    """
+    return LazyArray(
+        functools.partial(read_nxfield, field), shape=field.shape, dtype=field.dtype
+    )
+
+
+def nxattrs(attrs, exclude=NXFIELD_ATTRS) -> Optional[Dict]:
+    conditions = {
+        key: attrs[key]
+        for key in attrs
+        if key not in exclude and not key.endswith("_indices")
+    }
+    return conditions if conditions else None
+
+
+def nxattr_list(attrs, key) -> List[str]:
+    if key not in attrs:
+        return []
+    value = attrs[key]
+    return [value] if isinstance(value, str) else list(value)
+
+
+def effectarray_from_nexus(endpointtype_name: str, data: nx.NXdata) -> EffectArray:
+    """
+    EffectArray from an NXdata group written by effectarray2data; the arrays
+    are LazyArray until accessed.
+    """
+    signal_name = data.attrs["signal"]
+    signal_field = data[signal_name]
+    signal_unit = signal_field.attrs["units"] if "units" in signal_field.attrs else None
+    errors_name = "{}_errors".format(signal_name)
+
+    auxiliary = {}
+    for name in nxattr_list(data.attrs, "auxiliary_signals"):
+        field = data[name]
+        unit = field.attrs["units"] if "units" in field.attrs else None
+        conditions = nxattrs(field.attrs)
+        if conditions is None and unit == signal_unit:
+            auxiliary[name] = lazy_nxfield(field)
+        else:
+            auxiliary[name] = LazyValueArray(
+                values=lazy_nxfield(field), unit=unit, conditions=conditions
+            )
+
+    axis_names = nxattr_list(data.attrs, "axes")
+    axes = {}
+    for name in axis_names:
+        field = data[name]
+        axes[name] = LazyValueArray(
+            values=lazy_nxfield(field),
+            unit=field.attrs["units"] if "units" in field.attrs else None,
+            errorValue=(
+                np.asarray(field.attrs["errors"]) if "errors" in field.attrs else None
+            ),
+        )
+
+    # alternative axes share the *_indices of their primary axis
+    primary_axes = {}
+    axis_groups = {}
+    for name in axis_names:
+        key = "{}_indices".format(name)
+        if key not in data.attrs:
+            continue
+        index = int(data.attrs[key])
+        if index in primary_axes:
+            axis_groups.setdefault(primary_axes[index], []).append(name)
+        else:
+            primary_axes[index] = name
+
+    # passing conditions=None would validate into {}
+    conditions = nxattrs(data.attrs, NXDATA_ATTRS)
+    kwargs = {} if conditions is None else {"conditions": conditions}
+    return EffectArray(
+        endpoint=signal_name,
+        endpointtype=endpointtype_name,
+        signal=LazyValueArray(
+            values=lazy_nxfield(signal_field),
+            unit=signal_unit,
+            errorValue=lazy_nxfield(data[errors_name]) if errors_name in data else None,
+            conditions=nxattrs(signal_field.attrs),
+            auxiliary=auxiliary if auxiliary else None,
+        ),
+        axes=axes,
+        axis_groups=axis_groups if axis_groups else None,
+        **kwargs,
+    )
+
 
 class Nexus2Ambit:
 
@@ -141,7 +251,11 @@ class Nexus2Ambit:
         # the sample
         try:
             _owner = SampleLink.create(
-                sample_uuid=nxentry["sample/substance"].attrs["uuid"],
+                sample_uuid=(
+                    nxentry["sample/substance"].attrs["uuid"]
+                    if "substance" in nxentry["sample"]
+                    else nxentry["sample"].attrs["uuid"]
+                ),
                 sample_provider=nxentry["sample/provider"].nxdata,
             )
         except Exception as err:
@@ -182,17 +296,14 @@ class Nexus2Ambit:
                 continue
             for _name_data, data in enddpointtype_group.items():
                 if isinstance(data, nx.NXdata):
-                    if self.index_only:
-                        papp.effects.append(
-                            self.parse_effect(
-                                endpointtype_name,
-                                data,
-                                relative_path,
-                                nxentry["definition"].nxvalue,
-                            )
+                    papp.effects.append(
+                        self.parse_effect(
+                            endpointtype_name,
+                            data,
+                            relative_path,
+                            nxentry["definition"].nxvalue,
                         )
-                    else:
-                        raise NotImplementedError("Not implemented")
+                    )
 
         return papp
 
@@ -203,6 +314,10 @@ class Nexus2Ambit:
         relative_path: str,
         nxdefinition: str = None,
     ) -> EffectRecord:
+        """
+        With index_only, an EffectRecord pointing to the NXdata; otherwise the
+        EffectArray, with the arrays read on first access.
+        """
         if self.index_only:
             return EffectRecord(
                 endpoint=data.attrs["signal"],
@@ -217,4 +332,4 @@ class Nexus2Ambit:
                 sampleID=None,
             )
         else:
-            raise NotImplementedError("Not implemented")
+            return effectarray_from_nexus(endpointtype_name, data)
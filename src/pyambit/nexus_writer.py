@@ -1,8 +1,13 @@
+import functools
 import math
+import os.path
 import re
 import traceback
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePosixPath
+from typing import Any, Dict, List, Optional, Union
 
+import h5py
 import nexusformat.nexus as nx
 import numpy as np
 
@@ -11,20 +16,117 @@ from h5py import string_dtype
 from pyambit.ambit_deco import add_ambitmodel_method
 
 from pyambit.datamodel import (
+    ARRAY_TYPES,
     Composition,
     EffectArray,
     MetaValueArray,
     ProtocolApplication,
+    spill_array,
     Study,
     SubstanceRecord,
     Substances,
     Value,
     ValueArray,
 )
+from pyambit.instrument import instrumented, stage
 
 # tbd parameterize
 
 
+# h5py filters per NXdata field role, see dataset_options in to_nexus;
+# benchmarks/bench_nexus_compression.py was used to choose the levels and the
+# min_size, below which chunking costs more than the compression saves.
+DATASET_OPTIONS = {
+    "gzip": {"compression": "gzip", "compression_opts": 4, "shuffle": True},
+    "lzf": {"compression": "lzf", "shuffle": True},
+}
+DATASET_ROLES = ("signal", "errors", "axes", "auxiliary")
+DATASET_MIN_SIZE = 4096
+DATASET_CHUNK_BYTES = 1 << 18
+
+
+def resolve_dataset_options(
+    dataset_options: Union[str, Dict[str, Dict[str, Any]], None],
+) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Expands dataset_options to h5py options per field role
+    ("signal", "errors", "axes", "auxiliary").
+
+    Args:
+        dataset_options: None keeps the nexusformat defaults, "gzip" or "lzf"
+            apply DATASET_OPTIONS to every role, a dict maps roles to h5py
+            options (compression, compression_opts, shuffle, chunks) and
+            optionally "min_size"; roles not in the dict keep the defaults.
+    """
+    if dataset_options is None:
+        return None
+    if isinstance(dataset_options, str):
+        if dataset_options not in DATASET_OPTIONS:
+            raise ValueError(
+                "Unknown dataset_options {!r}, expected one of {}".format(
+                    dataset_options, list(DATASET_OPTIONS)
+                )
+            )
+        return {role: DATASET_OPTIONS[dataset_options] for role in DATASET_ROLES}
+    unknown = set(dataset_options) - set(DATASET_ROLES)
+    if unknown:
+        raise ValueError(
+            "Unknown dataset roles {}, expected {}".format(
+                sorted(unknown), DATASET_ROLES
+            )
+        )
+    return dataset_options
+
+
+def chunk_shape(shape, itemsize: int, chunk_bytes: int = DATASET_CHUNK_BYTES):
+    """
+    Chunks of at most about chunk_bytes, splitting the leading axes first so
+    that spectra (the last axis) stay contiguous.
+    """
+    chunks = list(shape)
+    for axis in range(len(chunks)):
+        if math.prod(chunks[axis:]) * itemsize <= chunk_bytes:
+            break
+        trailing = math.prod(chunks[axis + 1 :]) * itemsize
+        chunks[axis] = max(1, min(chunks[axis], chunk_bytes // trailing))
+    return tuple(chunks)
+
+
+def nxfield_options(values, role: str, dataset_options) -> Dict[str, Any]:
+    """
+    NXfield keyword arguments (h5py filters and chunks) for a field.
+    """
+    if dataset_options is None or role not in dataset_options:
+        return {}
+    options = dict(dataset_options[role])
+    min_size = options.pop("min_size", DATASET_MIN_SIZE)
+    if not hasattr(values, "dtype"):  # lists and scalars
+        values = np.asarray(values)
+    # shape and dtype only: an h5py.Dataset is not read
+    shape = tuple(values.shape)
+    dtype = np.dtype(values.dtype)
+    if len(shape) == 0 or math.prod(shape) < min_size:
+        # contiguous; also overrides the nexusformat compression of large fields
+        return {"chunks": None, "compression": None, "shuffle": None}
+    if dtype.hasobject:
+        # filters only see the pointers of variable length strings
+        options.pop("compression", None)
+        options.pop("compression_opts", None)
+        options.pop("shuffle", None)
+    options.setdefault("chunks", chunk_shape(shape, dtype.itemsize))
+    options.setdefault("compression", None)
+    return options
+
+
+def nxvalues(values):
+    """
+    The payload of an NXfield. nexusformat shares the memory of an np.memmap,
+    but reads an h5py.Dataset into memory; large datasets are spilled to a
+    memmap instead (see spill_array).
+    """
+    return spill_array(values) if isinstance(values, h5py.Dataset) else values
+
+
 def param_lookup(prm, value):
     target = ["environment"]
     _prmlo = prm.lower()
@@ -75,7 +177,17 @@ def param_lookup(prm, value):
 
 
 @add_ambitmodel_method(ProtocolApplication)
-def to_nexus(papp: ProtocolApplication, nx_root: nx.NXroot = None, hierarchy=False):
+@instrumented(
+    "to_nexus",
+    rows=lambda papp, *args, **kw: len(papp.effects or [])
+    + len(papp.effect_table or []),
+)
+def to_nexus(
+    papp: ProtocolApplication,
+    nx_root: nx.NXroot = None,
+    hierarchy=False,
+    dataset_options: Union[str, Dict[str, Dict[str, Any]], None] = None,
+):
     """
     ProtocolApplication to nexus entry (NXentry)
     Tries to follow https://manual.nexusformat.org/rules.html
@@ -83,6 +195,8 @@ def to_nexus(papp: ProtocolApplication, nx_root: nx.NXroot = None, hierarchy=Fal
     Args:
         papp (ProtocolApplication): The object to be written into nexus format.
         nx_root (nx.NXroot()): Nexus root (or None).
+        dataset_options: Chunking and compression of the NXdata fields,
+            "gzip", "lzf" or per role options, see resolve_dataset_options.
 
     Returns:
         nx_root: Nexus root
@@ -329,7 +443,7 @@ def to_nexus(papp: ProtocolApplication, nx_root: nx.NXroot = None, hierarchy=Fal
             ) from err
 
     try:
-        process_pa(papp, nx_root[entry_id], nx_root)
+        process_pa(papp, nx_root[entry_id], nx_root, dataset_options)
     except Exception as err:
         print("Exception traceback:\n%s", traceback.format_exc())
         raise Exception(
@@ -349,18 +463,25 @@ def to_nexus(papp: ProtocolApplication, nx_root: nx.NXroot = None, hierarchy=Fal
 
 
 @add_ambitmodel_method(Study)
-def to_nexus(study: Study, nx_root: nx.NXroot = None, hierarchy=False):  # noqa: F811
+def to_nexus(  # noqa: F811
+    study: Study, nx_root: nx.NXroot = None, hierarchy=False, dataset_options=None
+):
     if nx_root is None:
         nx_root = nx.NXroot()
     for papp in study.study:
-        papp.to_nexus(nx_root=nx_root, hierarchy=hierarchy)
+        papp.to_nexus(
+            nx_root=nx_root, hierarchy=hierarchy, dataset_options=dataset_options
+        )
 
     return nx_root
 
 
 @add_ambitmodel_method(SubstanceRecord)
 def to_nexus(  # noqa: F811
-    substance: SubstanceRecord, nx_root: nx.NXroot = None, hierarchy=False
+    substance: SubstanceRecord,
+    nx_root: nx.NXroot = None,
+    hierarchy=False,
+    dataset_options=None,
 ):
     """
     SubstanceRecord to nexus entry (NXentry)
@@ -442,22 +563,258 @@ def to_nexus(  # noqa: F811
 
     if substance.study is not None:
         for papp in substance.study:
-            papp.to_nexus(nx_root, hierarchy=hierarchy)
+            papp.to_nexus(nx_root, hierarchy=hierarchy, dataset_options=dataset_options)
 
     return nx_root
 
 
 @add_ambitmodel_method(Substances)
 def to_nexus(  # noqa: F811
-    substances: Substances, nx_root: nx.NXroot = None, hierarchy=False
+    substances: Substances,
+    nx_root: nx.NXroot = None,
+    hierarchy=False,
+    dataset_options=None,
 ):
     if nx_root is None:
         nx_root = nx.NXroot()
     for substance in substances.substance:
-        substance.to_nexus(nx_root, hierarchy)
+        substance.to_nexus(nx_root, hierarchy, dataset_options)
     return nx_root
 
 
+# the h5py options of an NXfield, as its public properties
+NXFIELD_H5OPTS = (
+    "chunks",
+    "compression",
+    "compression_opts",
+    "fillvalue",
+    "fletcher32",
+    "maxshape",
+    "scaleoffset",
+    "shuffle",
+)
+
+
+def nxfield_h5opts(field: nx.NXfield) -> Dict[str, Any]:
+    """
+    The create_dataset options NXroot.save() uses for an NXfield.
+    """
+    options = {}
+    for name in NXFIELD_H5OPTS:
+        value = getattr(field, name, None)
+        if value is not None:
+            options[name] = value
+    return options
+
+
+def nxattrs2h5(attrs, h5obj):
+    for name, value in attrs.items():
+        if value.nxdata is not None:
+            h5obj.attrs[name] = value.nxdata
+
+
+def nxgroup2h5(group, h5group) -> list:
+    """
+    Writes the children of a nexusformat group into an h5py group, the way
+    NXroot.save() does; existing datasets are replaced, existing groups merged.
+    Only public nexusformat attributes are read, except whether a link is
+    soft (hard if unknown); to_nexus writes hard links only.
+
+    Returns:
+        (path, target, soft) of the links, written once all targets exist.
+    """
+    links = []
+    nxattrs2h5(group.attrs, h5group)
+    for name, child in group.items():
+        path = "{}/{}".format(h5group.name.rstrip("/"), name)
+        if child.nxtarget is not None and child.nxfilename is None:
+            links.append((path, child.nxtarget, getattr(child, "_soft", False)))
+        elif isinstance(child, nx.NXfield):
+            if child.dtype is None:  # None values are not saved either
+                continue
+            if name in h5group:
+                del h5group[name]
+            dataset = h5group.create_dataset(
+                name, shape=child.shape, dtype=child.dtype, **nxfield_h5opts(child)
+            )
+            if child.nxdata is not None:
+                dataset[()] = child.nxdata
+            nxattrs2h5(child.attrs, dataset)
+        elif isinstance(child, nx.NXgroup):
+            if name not in h5group:
+                h5group.create_group(name)
+            if child.nxclass and child.nxclass != "NXgroup":
+                h5group[name].attrs["NX_class"] = child.nxclass
+            links += nxgroup2h5(child, h5group[name])
+    return links
+
+
+@instrumented("nexus2h5")
+def nexus2h5(nx_root: nx.NXroot, h5file: h5py.File):
+    """
+    Writes (merges) an in-memory NeXus tree into an open h5py file.
+    """
+    links = nxgroup2h5(nx_root, h5file)
+    for path, target, soft in links:
+        target_path = str(PurePosixPath(path).parent.joinpath(target))
+        if path in h5file or target_path not in h5file or path == target_path:
+            continue
+        if soft:
+            h5file[path] = h5py.SoftLink(target)
+        else:
+            h5file[path] = h5file[target_path]
+        if "target" not in h5file[target_path].attrs:
+            h5file[target_path].attrs["target"] = target_path
+
+
+@add_ambitmodel_method(ProtocolApplication)
+def to_nexus_h5(
+    papp: ProtocolApplication,
+    h5file: h5py.File,
+    hierarchy=False,
+    substance: SubstanceRecord = None,
+    dataset_options=None,
+):
+    """
+    Streams a ProtocolApplication into an open h5py file, with the same layout
+    as to_nexus: the entry is built by to_nexus, which defines the layout, and
+    written with h5py. Only the tree of this entry is kept in memory; its
+    fields share the arrays of the papp.
+
+    Args:
+        papp (ProtocolApplication): The object to be written.
+        h5file (h5py.File): File opened for writing.
+        hierarchy (bool): As in to_nexus.
+        substance (SubstanceRecord): Owner of the study, written to
+            /substance as by SubstanceRecord.to_nexus.
+        dataset_options: As in to_nexus.
+
+    Examples:
+        with h5py.File("studies.nxs", "w") as h5file:
+            substances.to_nexus_h5(h5file)
+    """
+    nx_root = nx.NXroot()
+    if substance is not None:
+        substance.model_copy(update={"study": None}).to_nexus(nx_root)
+    papp.to_nexus(nx_root, hierarchy=hierarchy, dataset_options=dataset_options)
+    nexus2h5(nx_root, h5file)
+    return h5file
+
+
+@add_ambitmodel_method(Study)
+def to_nexus_h5(  # noqa: F811
+    study: Study, h5file: h5py.File, hierarchy=False, dataset_options=None
+):
+    for papp in study.study:
+        papp.to_nexus_h5(h5file, hierarchy=hierarchy, dataset_options=dataset_options)
+    return h5file
+
+
+@add_ambitmodel_method(SubstanceRecord)
+def to_nexus_h5(  # noqa: F811
+    substance: SubstanceRecord,
+    h5file: h5py.File,
+    hierarchy=False,
+    dataset_options=None,
+):
+    if not substance.study:
+        nexus2h5(substance.to_nexus(nx.NXroot()), h5file)
+    else:
+        for papp in substance.study:
+            papp.to_nexus_h5(
+                h5file,
+                hierarchy=hierarchy,
+                substance=substance,
+                dataset_options=dataset_options,
+            )
+    return h5file
+
+
+@add_ambitmodel_method(Substances)
+def to_nexus_h5(  # noqa: F811
+    substances: Substances, h5file: h5py.File, hierarchy=False, dataset_options=None
+):
+    for substance in substances.substance:
+        substance.to_nexus_h5(
+            h5file, hierarchy=hierarchy, dataset_options=dataset_options
+        )
+    return h5file
+
+
+def study_nexus_file(papp: ProtocolApplication, substance_index: int, index: int):
+    """
+    Deterministic file name of a study (ProtocolApplication) exported on its own.
+    """
+    if papp.uuid is None:
+        return "study_{}_{}.nxs".format(substance_index, index)
+    return "study_{}.nxs".format(papp.uuid)
+
+
+def write_study_nexus(
+    papp: ProtocolApplication, file: str, hierarchy=False, dataset_options=None
+) -> Optional[str]:
+    """
+    Writes one study to its own NeXus file.
+
+    Returns:
+        None on success, the formatted traceback if the study failed.
+    """
+    try:
+        nx_root = nx.NXroot()
+        papp.to_nexus(nx_root, hierarchy=hierarchy, dataset_options=dataset_options)
+        with stage("nexus_save"):
+            nx_root.save(file, mode="w")
+        return None
+    except Exception:
+        return traceback.format_exc()
+
+
+def export_nexus(
+    substances: Substances,
+    out_dir: str,
+    workers: int = 1,
+    hierarchy=False,
+    dataset_options=None,
+) -> Dict[str, Optional[str]]:
+    """
+    Writes every study (ProtocolApplication) of the substances to a separate
+    NeXus file in out_dir, named by study_nexus_file.
+
+    Args:
+        substances (Substances): The studies to be written.
+        out_dir (str): Existing output folder.
+        workers (int): Number of processes; 1 converts in this process.
+        hierarchy (bool): Passed to ProtocolApplication.to_nexus.
+        dataset_options: Passed to ProtocolApplication.to_nexus.
+
+    Returns:
+        Dict[str, Optional[str]]: file path -> None if written, or the traceback
+        of the error; a failing study does not stop the others.
+    """
+    tasks = {}
+    for substance_index, substance in enumerate(substances.substance):
+        for index, papp in enumerate(substance.study or []):
+            file = os.path.join(out_dir, study_nexus_file(papp, substance_index, index))
+            # the same study listed twice is written once
+            tasks.setdefault(file, papp)
+
+    files = list(tasks)
+    papps = list(tasks.values())
+    write = functools.partial(
+        write_study_nexus, hierarchy=hierarchy, dataset_options=dataset_options
+    )
+    if workers is None or workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            errors = pool.map(
+                write,
+                papps,
+                files,
+                chunksize=max(1, len(files) // (4 * (workers or os.cpu_count()))),
+            )
+            return dict(zip(files, errors))
+    return dict(zip(files, map(write, papps, files)))
+
+
 @add_ambitmodel_method(Composition)
 def to_nexus(composition: Composition, nx_root: nx.NXroot = None):  # noqa: F811
     if nx_root is None:
@@ -471,7 +828,11 @@ def format_name(meta_dict, key, default=""):
     return name if isinstance(name, str) else default if math.isnan(name) else name
 
 
-def effectarray2data(effect: EffectArray):
+@instrumented(
+    "effectarray2data",
+    rows=lambda effect, *args, **kw: np.size(effect.signal.values),
+)
+def effectarray2data(effect: EffectArray, dataset_options=None):
 
     def is_alternate_axis(key: str, alt_axes: Dict[str, List[str]]) -> bool:
         """
@@ -492,25 +853,28 @@ def effectarray2data(effect: EffectArray):
                 return True
         return False
 
+    dataset_options = resolve_dataset_options(dataset_options)
+
     # uncertanties can be specified for both signal and axes through FIELDNAME_errors
     axes = []
     for key in effect.axes:
         axes.append(
             nx.tree.NXfield(
-                effect.axes[key].values,
+                nxvalues(effect.axes[key].values),
                 name=key.replace("/", "_"),
                 long_name="{}{}{}".format(
                     key,
                     "" if effect.axes[key].unit is None else "/",
                     "" if effect.axes[key].unit is None else effect.axes[key].unit,
                 ).strip(),
-                errors=effect.axes[key].errorValue,
+                errors=nxvalues(effect.axes[key].errorValue),
                 units=effect.axes[key].unit,
+                **nxfield_options(effect.axes[key].values, "axes", dataset_options),
             )
         )
 
     signal = nx.tree.NXfield(
-        effect.signal.values,
+        nxvalues(effect.signal.values),
         name=effect.endpoint,
         units=effect.signal.unit,
         long_name="{}{}{}".format(
@@ -518,15 +882,21 @@ def effectarray2data(effect: EffectArray):
             "" if effect.signal.unit is None else "/",
             "" if effect.signal.unit is None else effect.signal.unit,
         ).strip(),
+        **nxfield_options(effect.signal.values, "signal", dataset_options),
     )
     if effect.signal.conditions is not None:
         for key in effect.signal.conditions:
             signal.attrs[key] = effect.signal.conditions[key]
 
+    errors = nxvalues(effect.signal.errorValue)
+    if errors is not None and dataset_options is not None:
+        errors = nx.tree.NXfield(
+            errors, **nxfield_options(errors, "errors", dataset_options)
+        )
     nxdata = nx.tree.NXdata(
         signal=signal,
         axes=None if len(axes) == 0 else axes,
-        errors=effect.signal.errorValue,
+        errors=errors,
         # auxiliary_signals=None if len(aux_signals) < 1 else aux_signals,
     )
     aux_signals = []
@@ -535,12 +905,12 @@ def effectarray2data(effect: EffectArray):
         for a in effect.signal.auxiliary:
             item = effect.signal.auxiliary[a]
             if isinstance(item, MetaValueArray or isinstance(item, ValueArray)):
-                _tmp = item.values
+                _tmp = nxvalues(item.values)
                 _tmp_unit = item.unit
                 _tmp_meta = item.conditions
 
-            elif isinstance(item, np.ndarray):
-                _tmp = item
+            elif isinstance(item, ARRAY_TYPES):
+                _tmp = nxvalues(item)
                 _tmp_unit = effect.signal.unit
                 _tmp_meta = None
             else:
@@ -561,10 +931,15 @@ def effectarray2data(effect: EffectArray):
                         units=_tmp_unit,
                         long_name=long_name,
                         dtype=string_dtype(encoding="utf-8"),
+                        **nxfield_options(_tmp, "auxiliary", dataset_options),
                     )
                 else:
                     nxdata[_auxname] = nx.tree.NXfield(
-                        _tmp, name=_auxname, units=_tmp_unit, long_name=long_name
+                        _tmp,
+                        name=_auxname,
+                        units=_tmp_unit,
+                        long_name=long_name,
+                        **nxfield_options(_tmp, "auxiliary", dataset_options),
                     )
 
                 if _tmp_meta is not None:
@@ -601,7 +976,12 @@ def effectarray2data(effect: EffectArray):
     return nxdata
 
 
-def process_pa(pa: ProtocolApplication, entry=None, nx_root: nx.NXroot = None):
+def process_pa(
+    pa: ProtocolApplication,
+    entry=None,
+    nx_root: nx.NXroot = None,
+    dataset_options: Union[str, Dict[str, Dict[str, Any]], None] = None,
+):
 
     if entry is None:
         entry = nx.tree.NXentry()
@@ -647,7 +1027,7 @@ def process_pa(pa: ProtocolApplication, entry=None, nx_root: nx.NXroot = None):
                 del entry[_group_key][entryid]
                 print("replacing {}/{}".format(_group_key, entryid))
 
-            nxdata = effectarray2data(effect)
+            nxdata = effectarray2data(effect, dataset_options)
 
             entry[_group_key][entryid] = nxdata
             if _default is None:
@@ -0,0 +1,130 @@
+"""
+Reads the effect records written by parquet_writer back into EffectRecords.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError as err:
+    raise ImportError(
+        "pyambit.parquet_parser requires pyarrow, install pyambit[parquet]"
+    ) from err
+
+from pyambit.datamodel import EffectRecord, EffectRecordTable, Value
+from pyambit.parquet_writer import (
+    HAS_RESULT,
+    ID_FIELDS,
+    PARTITIONING,
+    RECORD_FIELDS,
+    RESULT_FIELDS,
+)
+
+VALUE_FIELDS = tuple(Value.model_fields)
+
+
+def open_dataset(
+    base_dir: str, partitioning: Tuple[str, ...] = PARTITIONING
+) -> ds.Dataset:
+    """
+    The Parquet dataset written by write_parquet. The files of different
+    batches may have different condition columns, the dataset has all.
+    """
+    types = dict(ID_FIELDS)
+    # declared, as the type of a partition without values can't be inferred
+    partitioning = ds.partitioning(
+        pa.schema([(name, types[name]) for name in partitioning]), flavor="hive"
+    )
+    dataset = ds.dataset(base_dir, format="parquet", partitioning=partitioning)
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    if len(schemas) < 2:
+        return dataset
+    schema = pa.unify_schemas([dataset.schema] + schemas)
+    return ds.dataset(
+        base_dir, schema=schema, format="parquet", partitioning=partitioning
+    )
+
+
+def struct2condition(value: Optional[Dict[str, Any]]):
+    if value is None:
+        return None
+    for field in ("text", "integer", "number", "boolean"):
+        # boolean is missing in the files of earlier versions
+        if value.get(field) is not None:
+            return value[field]
+    return {field: value[field] for field in VALUE_FIELDS}
+
+
+def table2effects(
+    table: pa.Table,
+) -> Dict[Tuple[Optional[str], Optional[str]], List[Dict[str, Any]]]:
+    """
+    The effect records of a to_arrow table (or of several concatenated) as
+    JSON like dicts, per (substance_uuid, papp_uuid) in papp.iter_effects()
+    order.
+    """
+    reserved = {
+        name for name, _ in ID_FIELDS + [HAS_RESULT] + RECORD_FIELDS + RESULT_FIELDS
+    }
+    conditions = [name for name in table.column_names if name not in reserved]
+    table = table.sort_by(
+        [
+            (name, "ascending")
+            for name in ("substance_uuid", "papp_uuid", "effect_index")
+        ]
+    )
+    columns = {name: table.column(name).to_pylist() for name in table.column_names}
+    # None in the files of earlier versions
+    has_result = columns.get(HAS_RESULT[0], [None] * table.num_rows)
+    records = {}
+    for row in range(table.num_rows):
+        key = (columns["substance_uuid"][row], columns["papp_uuid"][row])
+        effect = {name: columns[name][row] for name, _ in RECORD_FIELDS}
+        if effect["endpointSynonyms"] is None:
+            effect["endpointSynonyms"] = []
+        result = {name: columns[name][row] for name, _ in RESULT_FIELDS}
+        if has_result[row] is None:
+            has_result[row] = any(value is not None for value in result.values())
+        effect["result"] = result if has_result[row] else None
+        effect["conditions"] = {}
+        for name in conditions:
+            value = struct2condition(columns[name][row])
+            if value is not None:
+                effect["conditions"][name] = value
+        records.setdefault(key, []).append(effect)
+    return records
+
+
+def read_parquet(
+    base_dir: str,
+    filter: Optional[ds.Expression] = None,
+    as_table: bool = False,
+    partitioning: Tuple[str, ...] = PARTITIONING,
+) -> Dict[
+    Tuple[Optional[str], Optional[str]], Union[List[EffectRecord], EffectRecordTable]
+]:
+    """
+    The EffectRecords of a Parquet dataset written by write_parquet, per
+    (substance_uuid, papp_uuid), built without validation.
+
+    Args:
+        filter: Rows to read, e.g. ds.field("topcategory") == "TOX" reads only
+            the matching partitions.
+        as_table (bool): EffectRecordTables instead of lists.
+        partitioning: The partitioning given to write_parquet.
+
+    Example:
+        effects = read_parquet("effects", ds.field("category") == "ENM_0000068_SECTION")
+    """
+    table = open_dataset(base_dir, partitioning).to_table(filter=filter)
+    records = table2effects(table)
+    if as_table:
+        return {
+            key: EffectRecordTable.from_records(effects)
+            for key, effects in records.items()
+        }
+    return {
+        key: [EffectRecord.model_construct(**effect) for effect in effects]
+        for key, effects in records.items()
+    }
@@ -0,0 +1,299 @@
+"""
+The effect records as one flat Arrow table: a row per EffectRecord with the
+columns of effects2df and the identifiers of its study, written to a Parquet
+dataset partitioned by topcategory / category.
+
+    substances.to_parquet("effects")
+    dataset = pyarrow.dataset.dataset("effects", partitioning="hive")
+
+Each condition is a struct column with the Value fields, text for string,
+integer for int, number for float and boolean for bool conditions (read from
+the records, as effects2df turns int columns with gaps into float), and
+has_result tells records without a result from those with an empty one, so
+the records can be read back as they were (see parquet_parser). EffectArrays
+are not exported.
+"""
+
+import itertools
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError as err:
+    raise ImportError(
+        "pyambit.parquet_writer requires pyarrow, install pyambit[parquet]"
+    ) from err
+
+from pyambit.ambit_deco import add_ambitmodel_method
+from pyambit.datamodel import (
+    EffectArray,
+    EffectRecordTable,
+    EffectResult,
+    effects2df,
+    ProtocolApplication,
+    Study,
+    SubstanceRecord,
+    Substances,
+    Value,
+)
+from pyambit.instrument import instrumented
+
+ID_FIELDS = [
+    ("substance_uuid", pa.string()),
+    ("papp_uuid", pa.string()),
+    ("investigation_uuid", pa.string()),
+    ("assay_uuid", pa.string()),
+    ("topcategory", pa.string()),
+    ("category", pa.string()),
+    # position of the record in papp.iter_effects()
+    ("effect_index", pa.int32()),
+]
+# whether the record has a result, which may have no values
+HAS_RESULT = ("has_result", pa.bool_())
+RECORD_FIELDS = [
+    ("nx_name", pa.string()),
+    ("endpoint", pa.string()),
+    ("endpointtype", pa.string()),
+    ("idresult", pa.int64()),
+    ("endpointGroup", pa.int64()),
+    ("endpointSynonyms", pa.list_(pa.string())),
+    ("sampleID", pa.string()),
+]
+NUMBER_FIELDS = ("loValue", "upValue", "errorValue")
+RESULT_FIELDS = [
+    (field, pa.float64() if field in NUMBER_FIELDS else pa.string())
+    for field in EffectResult.model_fields
+]
+CONDITION_TYPE = pa.struct(
+    [
+        (field, pa.float64() if field in NUMBER_FIELDS else pa.string())
+        for field in Value.model_fields
+    ]
+    + [
+        ("text", pa.string()),
+        ("integer", pa.int64()),
+        ("number", pa.float64()),
+        ("boolean", pa.bool_()),
+    ]
+)
+RESERVED_COLUMNS = {
+    name
+    for name, _ in itertools.chain(
+        ID_FIELDS, [HAS_RESULT], RECORD_FIELDS, RESULT_FIELDS
+    )
+}
+PARTITIONING = ("topcategory", "category")
+BATCH_ROWS = 1 << 20
+
+
+def effect_conditions(effects) -> Dict[str, List]:
+    """
+    The conditions of the EffectRecords as columns, None where a record does
+    not have one. Unlike the effects2df columns, the values keep their type.
+    """
+    if isinstance(effects, EffectRecordTable):
+        return {key: effects.condition(key).tolist() for key in effects.conditions}
+    records = [effect for effect in effects if not isinstance(effect, EffectArray)]
+    columns = {}
+    for row, effect in enumerate(records):
+        for key, value in (effect.conditions or {}).items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * len(records)
+            column[row] = value
+    return columns
+
+
+def condition2struct(value) -> Optional[Dict[str, Any]]:
+    if isinstance(value, Value):
+        return dict(value.__dict__)
+    if isinstance(value, str):
+        return {"text": value}
+    if value is None:
+        return None
+    if isinstance(value, bool):  # before int, its superclass
+        return {"boolean": value}
+    if isinstance(value, int):
+        return {"integer": value}
+    if isinstance(value, float):
+        return None if value != value else {"number": value}
+    raise TypeError(f"Condition of type {type(value).__name__} can't be exported")
+
+
+@add_ambitmodel_method(ProtocolApplication)
+@instrumented(
+    "to_arrow",
+    rows=lambda papp, *args, **kw: len(papp.effects or [])
+    + len(papp.effect_table or []),
+)
+def to_arrow(
+    papp: ProtocolApplication, substance_uuid: Optional[str] = None
+) -> Optional[pa.Table]:
+    """
+    The EffectRecords of the papp as a flat Arrow table, None if it has none.
+
+    Args:
+        substance_uuid (str): By default the papp.owner substance.
+
+    Raises:
+        ValueError: if a condition is named like a record or result column.
+    """
+    records = papp.effect_records()
+    df, _, _, _ = effects2df(records)
+    if df is None:
+        return None
+    conditions = effect_conditions(records)
+    clashes = RESERVED_COLUMNS.intersection(conditions)
+    if clashes:
+        raise ValueError(
+            f"Conditions {sorted(clashes)} of {papp.uuid} clash with effect columns"
+        )
+    if substance_uuid is None and papp.owner is not None:
+        substance_uuid = papp.owner.substance.uuid
+    protocol = papp.protocol
+    category = None
+    if protocol is not None and protocol.category is not None:
+        category = protocol.category.code
+    rows = df.shape[0]
+    ids = [
+        substance_uuid,
+        papp.uuid,
+        papp.investigation_uuid,
+        papp.assay_uuid,
+        None if protocol is None else protocol.topcategory,
+        category,
+    ]
+    # the records of the effect_table come first, the EffectArrays are skipped
+    offset = len(papp.effect_table or [])
+    index = list(range(offset)) + [
+        offset + i
+        for i, effect in enumerate(papp.effects or [])
+        if not isinstance(effect, EffectArray)
+    ]
+    arrays = [
+        pa.repeat(pa.scalar(value, dtype), rows)
+        for value, (_, dtype) in zip(ids, ID_FIELDS)
+    ]
+    arrays.append(pa.array(index, pa.int32()))
+    if isinstance(records, EffectRecordTable):
+        has_result = records.has_result
+    else:
+        has_result = [effect.result is not None for effect in records]
+    arrays.append(pa.array(has_result, HAS_RESULT[1]))
+    for name, dtype in itertools.chain(RECORD_FIELDS, RESULT_FIELDS):
+        arrays.append(pa.array(df[name], dtype, from_pandas=True))
+    for values in conditions.values():
+        arrays.append(
+            pa.array([condition2struct(value) for value in values], CONDITION_TYPE)
+        )
+    names = [
+        name
+        for name, _ in itertools.chain(
+            ID_FIELDS, [HAS_RESULT], RECORD_FIELDS, RESULT_FIELDS
+        )
+    ]
+    return pa.Table.from_arrays(arrays, names=names + list(conditions))
+
+
+def iter_papps(
+    substances: Substances,
+) -> Iterator[Tuple[str, ProtocolApplication]]:
+    for substance in substances.substance:
+        for papp in substance.study or []:
+            yield substance.i5uuid, papp
+
+
+def iter_batches(
+    papps: Iterable[Tuple[Optional[str], ProtocolApplication]],
+    batch_rows: int = BATCH_ROWS,
+) -> Iterator[pa.Table]:
+    """
+    The to_arrow tables of the (substance_uuid, papp) pairs, concatenated into
+    tables of about batch_rows rows; the condition columns of a batch are the
+    union of those of its papps.
+    """
+    tables = []
+    rows = 0
+    for substance_uuid, papp in papps:
+        table = papp.to_arrow(substance_uuid)
+        if table is None:
+            continue
+        tables.append(table)
+        rows += table.num_rows
+        if rows >= batch_rows:
+            yield pa.concat_tables(tables, promote_options="default")
+            tables = []
+            rows = 0
+    if tables:
+        yield pa.concat_tables(tables, promote_options="default")
+
+
+def write_parquet(
+    papps: Iterable[Tuple[Optional[str], ProtocolApplication]],
+    base_dir: str,
+    partitioning: Tuple[str, ...] = PARTITIONING,
+    batch_rows: int = BATCH_ROWS,
+    **write_options,
+) -> List[str]:
+    """
+    Writes the effect records of the (substance_uuid, papp) pairs to a Parquet
+    dataset in base_dir, hive partitioned (topcategory=.../category=...).
+    Every batch adds new files, so a dataset can be extended by further calls.
+
+    Args:
+        batch_rows (int): Rows buffered before they are written; bounds the
+            memory used for large databases.
+        write_options: Passed to pyarrow.dataset.write_dataset, e.g.
+            max_rows_per_file.
+
+    Returns:
+        List[str]: the written files.
+    """
+    files = []
+    for batch in iter_batches(papps, batch_rows):
+        ds.write_dataset(
+            batch,
+            base_dir,
+            format="parquet",
+            partitioning=list(partitioning),
+            partitioning_flavor="hive",
+            basename_template="part-{}-{{i}}.parquet".format(uuid.uuid4().hex),
+            existing_data_behavior="overwrite_or_ignore",
+            file_visitor=lambda written: files.append(written.path),
+            **write_options,
+        )
+    return files
+
+
+@add_ambitmodel_method(ProtocolApplication)
+def to_parquet(papp: ProtocolApplication, base_dir: str, **kwargs) -> List[str]:
+    return write_parquet([(None, papp)], base_dir, **kwargs)
+
+
+@add_ambitmodel_method(Study)
+def to_parquet(study: Study, base_dir: str, **kwargs) -> List[str]:  # noqa: F811
+    return write_parquet(((None, papp) for papp in study.study), base_dir, **kwargs)
+
+
+@add_ambitmodel_method(SubstanceRecord)
+def to_parquet(  # noqa: F811
+    substance: SubstanceRecord, base_dir: str, **kwargs
+) -> List[str]:
+    return write_parquet(
+        ((substance.i5uuid, papp) for papp in substance.study or []),
+        base_dir,
+        **kwargs,
+    )
+
+
+@add_ambitmodel_method(Substances)
+def to_parquet(  # noqa: F811
+    substances: Substances, base_dir: str, **kwargs
+) -> List[str]:
+    """
+    The effect records of all substances as one Parquet dataset, see
+    write_parquet.
+    """
+    return write_parquet(iter_papps(substances), base_dir, **kwargs)
@@ -1,21 +1,230 @@
+import hashlib
+import http.client
+import itertools
 import json
-from typing import Dict, Union
+import math
+import os.path
+import queue
+import sqlite3
+import time
+import urllib.parse
+from concurrent.futures import (
+    as_completed,
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
 
 from pyambit.datamodel import (
     EffectArray,
     EffectRecord,
+    EffectRecordTable,
     EffectResult,
     ProtocolApplication,
     SubstanceRecord,
     Substances,
     Value,
 )
+from pyambit.instrument import instrumented
+
+
+class SolrError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+    def __str__(self):
+        return "Solr update failed with HTTP {}: {}".format(self.status, self.message)
+
+
+class SolrUpdateClient:
+    """
+    Posts JSON documents to a Solr /update handler over a pool of keep-alive
+    connections, retrying failed requests with exponential backoff.
+
+    Args:
+        url (str): The update handler, e.g. http://localhost:8983/solr/core/update
+        pool_size (int): Maximum number of idle connections kept open.
+        timeout (float): Socket timeout in seconds.
+        retries (int): Retries after a connection error or HTTP 429/5xx.
+        backoff (float): Delay before the first retry, doubled for each next one.
+    """
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        url: str,
+        pool_size: int = 4,
+        timeout: float = 60,
+        retries: int = 5,
+        backoff: float = 0.5,
+    ):
+        self.url = urllib.parse.urlsplit(url)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connection(self) -> http.client.HTTPConnection:
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            if self.url.scheme == "https":
+                return http.client.HTTPSConnection(
+                    self.url.netloc, timeout=self.timeout
+                )
+            return http.client.HTTPConnection(self.url.netloc, timeout=self.timeout)
+
+    def release(self, connection: http.client.HTTPConnection):
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def post(self, body: bytes, params: Optional[Dict] = None) -> bytes:
+        query = self.url.query
+        if params:
+            query = "&".join(filter(None, [query, urllib.parse.urlencode(params)]))
+        path = urllib.parse.urlunsplit(("", "", self.url.path or "/", query, ""))
+        headers = {"Content-Type": "application/json"}
+        for attempt in itertools.count():
+            connection = self.connection()
+            try:
+                connection.request("POST", path, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (OSError, http.client.HTTPException) as err:
+                connection.close()
+                if attempt >= self.retries:
+                    raise
+                error = err
+            else:
+                self.release(connection)
+                if response.status < 300:
+                    return content
+                error = SolrError(
+                    response.status, content.decode("utf-8", errors="replace")
+                )
+                if response.status not in self.RETRY_STATUS or attempt >= self.retries:
+                    raise error
+            time.sleep(self.backoff * 2**attempt)
+
+
+EMBEDDING_SIMILARITY = ("cosine", "dot_product", "euclidean")
+
+
+class SolrIndexState:
+    """
+    Local SQLite record of the indexed Solr documents: document id -> content
+    hash and the stamp of the source data (see Ambit2Solr.iter_delta).
+
+    Changes are committed when the with block exits without an exception,
+    i.e. only once the delta has been written or posted.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS docs "
+            "(id TEXT PRIMARY KEY, hash TEXT NOT NULL, stamp TEXT)"
+        )
+        self.seen = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.commit()
+        else:
+            self.connection.rollback()
+        self.connection.close()
+
+    def lookup(self, doc_id: str) -> Optional[Tuple[str, Optional[str]]]:
+        return self.connection.execute(
+            "SELECT hash, stamp FROM docs WHERE id = ?", (doc_id,)
+        ).fetchone()
+
+    def update(self, doc_id: str, digest: str, stamp: Optional[str]):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO docs (id, hash, stamp) VALUES (?, ?, ?)",
+            (doc_id, digest, stamp),
+        )
+
+    def removed(self) -> List[str]:
+        """
+        Ids of the recorded documents not seen in this run; they are dropped
+        from the state and should be deleted from Solr.
+        """
+        ids = [
+            doc_id
+            for (doc_id,) in self.connection.execute("SELECT id FROM docs")
+            if doc_id not in self.seen
+        ]
+        self.connection.executemany(
+            "DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids]
+        )
+        return ids
 
 
 class Ambit2Solr:
+    """
+    Converts substances and their studies to Solr documents.
 
-    def __init__(self, prefix: str):
+    EffectArrays with endpointtype "embeddings" are written as dense vectors
+    in a field named after the endpoint.
+
+    Args:
+        prefix (str): The dbtag of the substances.
+        embeddings (Dict[str, int]): Vector dimension per embeddings field;
+            for fields not listed the dimension of the first vector is used.
+            A vector of another dimension raises ValueError.
+        normalize_embeddings (bool): Scale the vectors to unit L2 norm.
+        embedding_dtype: The vectors are cast to this dtype (float32 is what
+            Solr indexes), which rounds float64 values in the documents;
+            None keeps the values as earlier versions wrote them (float for
+            normalized integer vectors).
+        similarity (str): similarityFunction of the knn_vector field types,
+            see embedding_schema.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        embeddings: Optional[Dict[str, int]] = None,
+        normalize_embeddings: bool = False,
+        embedding_dtype=np.float32,
+        similarity: str = "cosine",
+    ):
+        if similarity not in EMBEDDING_SIMILARITY:
+            raise ValueError(
+                f"Unknown similarity {similarity!r}, expected one of"
+                f" {EMBEDDING_SIMILARITY}"
+            )
         self.prefix = prefix
+        self.embeddings = dict(embeddings or {})
+        self.normalize_embeddings = normalize_embeddings
+        self.embedding_dtype = embedding_dtype
+        self.similarity = similarity
 
     def __enter__(self):
         self._solr = []
@@ -54,7 +263,13 @@ class Ambit2Solr:
         if effect_result.textValue is not None:
             solr_index["textValue_s"] = effect_result.textValue
 
-    def effectrecord2solr(self, effect: EffectRecord, solr_index=None):
+    def effectrecord2solr(self, effect: EffectRecord, solr_index=None, embeddings=None):
+        """
+        Args:
+            embeddings (list): If given, the embeddings effects are appended
+                as (solr_index, effect) for a later embeddings2solr call
+                instead of being converted one by one.
+        """
         if solr_index is None:
             solr_index = {}
         if isinstance(effect, EffectArray):
@@ -63,74 +278,221 @@ class Ambit2Solr:
                 self.effectresult2solr(effect.result, solr_index)
             # e.g. vector search
             if effect.endpointtype == "embeddings":
-                solr_index[effect.endpoint] = effect.signal.values.tolist()
+                if embeddings is None:
+                    self.embeddings2solr([(solr_index, effect)])
+                else:
+                    embeddings.append((solr_index, effect))
         elif isinstance(effect, EffectRecord):
             # conditions
             if effect.result is not None:  # EffectResult
                 self.effectresult2solr(effect.result, solr_index)
 
-    def entry2solr(self, papp: ProtocolApplication):
-        papp_solr = []
-        for _id, effect in enumerate(papp.effects, start=1):
-            _solr = {}
-            _solr["id"] = "{}/{}".format(papp.uuid, _id)
-            _solr["investigation_uuid_s"] = papp.investigation_uuid
-            _solr["assay_uuid_s"] = papp.assay_uuid
-            _solr["type_s"] = "study"
-            _solr["document_uuid_s"] = papp.uuid
-
-            _solr["topcategory_s"] = papp.protocol.topcategory
-            _solr["endpointcategory_s"] = (
-                "UNKNOWN"
-                if papp.protocol.category is None
-                else papp.protocol.category.code
+    @instrumented("embeddings2solr", rows=lambda self, embeddings: len(embeddings))
+    def embeddings2solr(self, embeddings: List[Tuple[Dict, EffectArray]]):
+        """
+        Writes the embeddings effects as dense vectors into their Solr
+        documents, converting all vectors of a field as one 2-D array.
+        """
+        fields = {}
+        for solr_index, effect in embeddings:
+            fields.setdefault(effect.endpoint, []).append((solr_index, effect))
+        for field, items in fields.items():
+            vectors = []
+            for _, effect in items:
+                vector = np.asarray(effect.signal.values)
+                if vector.ndim > 1:
+                    vector = vector.squeeze()
+                if vector.ndim != 1:
+                    raise ValueError(
+                        f"Embeddings {field!r}: expected one vector, got shape"
+                        f" {effect.signal.values.shape}"
+                    )
+                dimension = self.embeddings.setdefault(field, vector.size)
+                if vector.size != dimension:
+                    raise ValueError(
+                        f"Embeddings {field!r}: expected dimension {dimension},"
+                        f" got {vector.size}"
+                    )
+                vectors.append(vector)
+            matrix = np.stack(vectors)
+            if matrix.dtype.kind not in "biuf":
+                matrix = matrix.astype(np.float64)
+            if not np.isfinite(matrix).all():
+                raise ValueError(f"Embeddings {field!r}: non finite values")
+            if self.normalize_embeddings:
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix = matrix / np.where(norms == 0, 1, norms)
+            if self.embedding_dtype is not None:
+                matrix = matrix.astype(self.embedding_dtype)
+            for (solr_index, _), row in zip(items, matrix.tolist()):
+                solr_index[field] = row
+
+    def embedding_schema(self) -> Dict[str, List[Dict]]:
+        """
+        Solr Schema API commands adding a knn_vector field type per vector
+        dimension and the embeddings fields, for the fields configured or
+        seen so far.
+        """
+        dimensions = sorted(set(self.embeddings.values()))
+        return {
+            "add-field-type": [
+                {
+                    "name": "knn_vector_{}".format(dimension),
+                    "class": "solr.DenseVectorField",
+                    "vectorDimension": dimension,
+                    "similarityFunction": self.similarity,
+                }
+                for dimension in dimensions
+            ],
+            "add-field": [
+                {
+                    "name": field,
+                    "type": "knn_vector_{}".format(dimension),
+                    "indexed": True,
+                    "stored": True,
+                }
+                for field, dimension in sorted(self.embeddings.items())
+            ],
+        }
+
+    def effecttable2solr(
+        self, table: EffectRecordTable
+    ) -> Iterator[Tuple[str, Optional[str], Dict, List[Tuple[str, Any]]]]:
+        """
+        (endpoint, endpointtype, result fields, conditions) of the records of
+        the table as effectrecord2solr and prm2solr read them, from the
+        columns of the table without building EffectRecords.
+        """
+        endpoints = table.column("endpoint").tolist()
+        endpointtypes = table.column("endpointtype").tolist()
+        results = [
+            (solr_field, table.column(field).tolist())
+            for field, solr_field in (
+                ("loValue", "loValue_d"),
+                ("loQualifier", "loQualifier_s"),
+                ("upQualifier", "upQualifier_s"),
+                ("upValue", "upValue_d"),
+                ("unit", "unit_s"),
+                ("textValue", "textValue_s"),
             )
-            _solr["guidance_s"] = papp.protocol.guideline
-            # _solr["guidance_synonym_ss"] = ["FIX_0000058"]
-            # _solr["E.method_synonym_ss"] = ["FIX_0000058"]
-            _solr["endpoint_s"] = papp.protocol.endpoint
-            _solr["effectendpoint_s"] = effect.endpoint
-            _solr["effectendpoint_type_s"] = effect.endpointtype
-            # _solr["effectendpoint_synonym_ss"] = ["CHMO_0000823"]
-            _solr["reference_owner_s"] = papp.citation.owner
-            _solr["reference_year_s"] = papp.citation.year
-            _solr["reference_s"] = papp.citation.title
-            _solr["updated_s"] = papp.updated
-            if "E.method_s" in papp.parameters:
-                _solr["E.method_s"] = papp.parameters["E.method_s"]
-            self.effectrecord2solr(effect, _solr)
-
-            _conditions = {"type_s": "conditions"}
-            _conditions["topcategory_s"] = papp.protocol.topcategory
-            _conditions["endpointcategory_s"] = (
-                "UNKNOWN"
-                if papp.protocol.category is None
-                else papp.protocol.category.code
+        ]
+        conditions = [(key, table.condition(key).tolist()) for key in table.conditions]
+        for row in range(table.rows):
+            yield (
+                endpoints[row],
+                endpointtypes[row],
+                {
+                    solr_field: values[row]
+                    for solr_field, values in results
+                    if values[row] is not None
+                },
+                [
+                    (key, values[row])
+                    for key, values in conditions
+                    if values[row] is not None
+                ],
             )
-            _conditions["document_uuid_s"] = papp.uuid
+
+    @instrumented(
+        "entry2solr",
+        rows=lambda self, papp, *args, **kw: len(papp.effects or [])
+        + len(papp.effect_table or []),
+    )
+    def entry2solr(self, papp: ProtocolApplication, embeddings=None):
+        # the fields shared by all effects of the papp are computed once
+        endpointcategory = (
+            "UNKNOWN" if papp.protocol.category is None else papp.protocol.category.code
+        )
+        method = (
+            {"E.method_s": papp.parameters["E.method_s"]}
+            if "E.method_s" in papp.parameters
+            else {}
+        )
+        study_head = {
+            "investigation_uuid_s": papp.investigation_uuid,
+            "assay_uuid_s": papp.assay_uuid,
+            "type_s": "study",
+            "document_uuid_s": papp.uuid,
+            "topcategory_s": papp.protocol.topcategory,
+            "endpointcategory_s": endpointcategory,
+            "guidance_s": papp.protocol.guideline,
+            # "guidance_synonym_ss": ["FIX_0000058"],
+            # "E.method_synonym_ss": ["FIX_0000058"],
+            "endpoint_s": papp.protocol.endpoint,
+        }
+        study_tail = {
+            # "effectendpoint_synonym_ss": ["CHMO_0000823"],
+            "reference_owner_s": papp.citation.owner,
+            "reference_year_s": papp.citation.year,
+            "reference_s": papp.citation.title,
+            "updated_s": papp.updated,
+            **method,
+        }
+        conditions_head = {
+            "type_s": "conditions",
+            "topcategory_s": papp.protocol.topcategory,
+            "endpointcategory_s": endpointcategory,
+            "document_uuid_s": papp.uuid,
+        }
+
+        def effect_doc(_id, endpoint, endpointtype, result, conditions, effect=None):
+            _solr = {"id": "{}/{}".format(papp.uuid, _id), **study_head}
+            _solr["effectendpoint_s"] = endpoint
+            _solr["effectendpoint_type_s"] = endpointtype
+            _solr.update(study_tail)
+            if effect is None:
+                _solr.update(result)
+            else:
+                self.effectrecord2solr(effect, _solr, embeddings)
+
+            _conditions = dict(conditions_head)
             _conditions["id"] = "{}/cn".format(_solr["id"])
-            for prm in effect.conditions:
-                self.prm2solr(_conditions, prm, effect.conditions[prm])
+            for prm, value in conditions:
+                self.prm2solr(_conditions, prm, value)
             _solr["_childDocuments_"] = [_conditions]
+            return _solr
 
-        _params = {}
-        for prm in papp.parameters:
-            self.prm2solr(_params, prm, papp.parameters[prm])
-            _params["document_uuid_s"] = papp.uuid
-            _params["id"] = "{}/prm".format(papp.uuid)
-            _params["topcategory_s"] = papp.protocol.topcategory
-            _params["endpointcategory_s"] = (
-                "UNKNOWN"
-                if papp.protocol.category is None
-                else papp.protocol.category.code
+        papp_solr = []
+        rows = 0
+        if papp.effect_table is not None:
+            # the records are read from the columns, then the effects
+            for _id, row in enumerate(
+                self.effecttable2solr(papp.effect_table), start=1
+            ):
+                _solr = effect_doc(_id, *row)
+            rows = papp.effect_table.rows
+        for _id, effect in enumerate(papp.effects, start=rows + 1):
+            _solr = effect_doc(
+                _id,
+                effect.endpoint,
+                effect.endpointtype,
+                None,
+                effect.conditions.items(),
+                effect,
+            )
+
+        if papp.parameters:
+            _params = {}
+            for prm in papp.parameters:
+                self.prm2solr(_params, prm, papp.parameters[prm])
+            _params.update(
+                {
+                    "document_uuid_s": papp.uuid,
+                    "id": "{}/prm".format(papp.uuid),
+                    "topcategory_s": papp.protocol.topcategory,
+                    "endpointcategory_s": endpointcategory,
+                    **method,
+                    "type_s": "params",
+                }
             )
-            if "E.method_s" in papp.parameters:
-                _params["E.method_s"] = papp.parameters["E.method_s"]
-            _params["type_s"] = "params"
             _solr["_childDocuments_"] = [_params]
         papp_solr.append(_solr)
         return papp_solr
 
+    @instrumented(
+        "substancerecord2solr",
+        rows=lambda self, substance: len(substance.study or []),
+    )
     def substancerecord2solr(self, substance: SubstanceRecord):
         _solr = {}
         _solr["content_hss"] = []
@@ -143,9 +505,10 @@ class Ambit2Solr:
         _solr["s_uuid_hs"] = substance.i5uuid
         _solr["id"] = substance.i5uuid
         _studies = []
+        _embeddings = []
         _solr["SUMMARY.RESULTS_hss"] = []
         for _papp in substance.study:
-            _study_solr = self.entry2solr(_papp)
+            _study_solr = self.entry2solr(_papp, _embeddings)
             for _study in _study_solr:
                 _study["s_uuid_s"] = substance.i5uuid
                 _study["type_s"] = "study"
@@ -154,23 +517,392 @@ class Ambit2Solr:
                 _study["substanceType_s"] = substance.substanceType
                 _study["owner_name_s"] = substance.ownerName
             _studies.extend(_study_solr)
+        if _embeddings:
+            self.embeddings2solr(_embeddings)
         _solr["_childDocuments_"] = _studies
         _solr["SUMMARY.REFS_hss"] = []
         _solr["SUMMARY.REFOWNERS_hss"] = []
 
         return _solr
 
-    def substances2solr(self, substances: Substances, buffer=None):
+    def substances2solr(
+        self,
+        substances: Substances,
+        buffer=None,
+        workers: int = 1,
+        ordered: bool = True,
+        shard_size: Optional[int] = None,
+    ):
+        """
+        Solr documents of the substances, appended to buffer.
+
+        Args:
+            workers (int): Number of processes converting shards of the
+                substance list; 1 converts in this process.
+            ordered (bool): Keep the order of the substances; otherwise the
+                shards are appended as they complete.
+            shard_size (int): Substances per shard, by default about four
+                shards per worker.
+        """
         if buffer is None:
             buffer = []
+        if workers is None or workers > 1:
+            records = list(substances.substance)
+            if shard_size is None:
+                shard_size = max(
+                    1, math.ceil(len(records) / (4 * (workers or os.cpu_count())))
+                )
+            shards = [
+                records[i : i + shard_size] for i in range(0, len(records), shard_size)
+            ]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                if ordered:
+                    results = pool.map(self.shard2solr, shards)
+                else:
+                    results = (
+                        future.result()
+                        for future in as_completed(
+                            [pool.submit(self.shard2solr, shard) for shard in shards]
+                        )
+                    )
+                for docs, embeddings in results:
+                    buffer.extend(docs)
+                    self.merge_embeddings(embeddings)
+            return buffer
         for substance in substances.substance:
             buffer.append(self.substancerecord2solr(substance))
         return buffer
 
+    def shard2solr(
+        self, substances: List[SubstanceRecord]
+    ) -> Tuple[List[Dict], Dict[str, int]]:
+        """
+        The documents of a shard and the embeddings dimensions known after
+        converting it; in a worker process these are lost with its copy of the
+        writer, see merge_embeddings.
+        """
+        docs = [self.substancerecord2solr(substance) for substance in substances]
+        return docs, self.embeddings
+
+    def merge_embeddings(self, embeddings: Dict[str, int]):
+        """
+        Adds the embeddings dimensions inferred by another writer (a worker).
+
+        Raises:
+            ValueError: if a field has another dimension here.
+        """
+        for field, dimension in embeddings.items():
+            known = self.embeddings.setdefault(field, dimension)
+            if known != dimension:
+                raise ValueError(
+                    f"Embeddings {field!r}: expected dimension {known},"
+                    f" got {dimension}"
+                )
+
+    def iter_solr(
+        self, substances: Union[Substances, Iterable[SubstanceRecord]]
+    ) -> Iterator[Dict]:
+        """
+        Solr documents, one per substance, converted as they are consumed.
+        """
+        if isinstance(substances, Substances):
+            substances = substances.substance
+        for substance in substances:
+            yield self.substancerecord2solr(substance)
+
+    def index(
+        self,
+        substances: Union[Substances, Iterable[SubstanceRecord]],
+        url: str,
+        batch_size: int = 100,
+        concurrency: int = 4,
+        commit_within: Optional[int] = None,
+        commit: bool = True,
+        retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 60,
+        state_file: Optional[str] = None,
+    ) -> Dict[str, int]:
+        """
+        Posts the Solr documents in batches to a Solr /update handler.
+
+        At most concurrency batches are in flight; the conversion of further
+        substances waits until one of them completes.
+
+        Args:
+            substances: Substances or any iterable of SubstanceRecord.
+            url (str): The update handler, e.g. http://localhost:8983/solr/core/update
+            batch_size (int): Documents (substances) per request.
+            concurrency (int): Parallel requests.
+            commit_within (int): Sent as commitWithin (ms) with every batch.
+            commit (bool): Sends an explicit commit after the last batch.
+            retries, backoff, timeout: See SolrUpdateClient.
+            state_file (str): SolrIndexState of the previous runs; only the
+                added and changed documents are posted, and the removed ones
+                are deleted by id.
+
+        Returns:
+            Dict[str, int]: Number of documents and batches posted (and deleted).
+        """
+        if state_file is not None:
+            with SolrIndexState(state_file) as state:
+                return self.index_docs(
+                    self.iter_delta(substances, state),
+                    url,
+                    batch_size=batch_size,
+                    concurrency=concurrency,
+                    commit_within=commit_within,
+                    commit=commit,
+                    retries=retries,
+                    backoff=backoff,
+                    timeout=timeout,
+                    deleted=state.removed,
+                )
+        return self.index_docs(
+            self.iter_solr(substances),
+            url,
+            batch_size=batch_size,
+            concurrency=concurrency,
+            commit_within=commit_within,
+            commit=commit,
+            retries=retries,
+            backoff=backoff,
+            timeout=timeout,
+        )
+
+    def index_docs(
+        self,
+        docs: Iterable[Dict],
+        url: str,
+        batch_size: int = 100,
+        concurrency: int = 4,
+        commit_within: Optional[int] = None,
+        commit: bool = True,
+        retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 60,
+        deleted: Optional[Callable[[], List[str]]] = None,
+    ) -> Dict[str, int]:
+        """
+        Posts Solr documents in batches, see index; deleted is called once all
+        documents are posted and returns the ids to delete.
+        """
+        params = None if commit_within is None else {"commitWithin": commit_within}
+        docs = iter(docs)
+        stats = {"documents": 0, "batches": 0}
+        with SolrUpdateClient(
+            url,
+            pool_size=concurrency,
+            timeout=timeout,
+            retries=retries,
+            backoff=backoff,
+        ) as client, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            pending = set()
+            try:
+                while True:
+                    batch = list(itertools.islice(docs, batch_size))
+                    if not batch:
+                        break
+                    if len(pending) >= concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(
+                        pool.submit(
+                            client.post, json.dumps(batch).encode("utf-8"), params
+                        )
+                    )
+                    stats["documents"] += len(batch)
+                    stats["batches"] += 1
+                for future in pending:
+                    future.result()
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+            if deleted is not None:
+                ids = deleted()
+                if ids:
+                    client.post(json.dumps({"delete": ids}).encode("utf-8"), params)
+                stats["deleted"] = len(ids)
+            if commit:
+                client.post(b"{}", {"commit": "true"})
+        return stats
+
+    def substance_stamp(self, substance: SubstanceRecord) -> Optional[str]:
+        """
+        Digest of the substance fields and the uuid / updated of its studies,
+        or None if a study has no updated date.
+        """
+        studies = [(papp.uuid, papp.updated) for papp in substance.study or []]
+        if any(updated is None for _, updated in studies):
+            return None
+        key = [
+            self.prefix,
+            substance.name,
+            substance.publicname,
+            substance.ownerName,
+            substance.substanceType,
+            studies,
+        ]
+        return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+    def iter_delta(
+        self,
+        substances: Union[Substances, Iterable[SubstanceRecord]],
+        state: SolrIndexState,
+        trust_updated: bool = True,
+    ) -> Iterator[Dict]:
+        """
+        Solr documents of the added and changed substances only. The documents
+        for which state.removed() is called afterwards are the deleted ones.
+
+        Args:
+            trust_updated (bool): Skip the conversion of a substance if its
+                studies (uuid and updated) and fields are the same as in the
+                last run; otherwise only the content hash decides.
+        """
+        if isinstance(substances, Substances):
+            substances = substances.substance
+        for substance in substances:
+            doc_id = substance.i5uuid
+            state.seen.add(doc_id)
+            previous = state.lookup(doc_id)
+            stamp = self.substance_stamp(substance) if trust_updated else None
+            if stamp is not None and previous is not None and previous[1] == stamp:
+                continue
+            doc = self.substancerecord2solr(substance)
+            digest = hashlib.sha256(
+                json.dumps(doc, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+            state.update(doc_id, digest, stamp)
+            if previous is None or previous[0] != digest:
+                yield doc
+
     def to_json(self, substances: Substances):
         return self.substances2solr(substances)
 
-    def write(self, substances, file_path):
-        _json = self.to_json(substances)
-        with open(file_path, "w") as file:
-            json.dump(_json, file)
+    def write(self, substances, file_path, write_schema: bool = False):
+        self.write_stream(
+            substances, file_path, format="json", write_schema=write_schema
+        )
+
+    def write_stream(
+        self,
+        substances: Union[Substances, Iterable[SubstanceRecord]],
+        file_path: str,
+        format: str = "ndjson",
+        max_file_size: Optional[int] = None,
+        buffer_size: int = 1 << 20,
+        state_file: Optional[str] = None,
+        write_schema: bool = False,
+    ) -> List[str]:
+        """
+        Writes the Solr documents while the substances are converted, without
+        holding the document list in memory.
+
+        Args:
+            substances: Substances or any iterable (e.g. a generator) of
+                SubstanceRecord.
+            file_path (str): Output file; with max_file_size the parts are
+                named <name>_00000<ext>, <name>_00001<ext>, ...
+            format (str): "ndjson", one document per line, or "json", a JSON
+                array (the Solr /update format) per file.
+            max_file_size (int): Starts a new file before exceeding this many
+                bytes; a document larger than that gets a file of its own.
+            buffer_size (int): Write buffer size in bytes.
+            state_file (str): SolrIndexState of the previous runs; only the
+                added and changed documents are written, and the ids of the
+                removed ones go to <name>_delete.json as a Solr delete command.
+            write_schema (bool): If embeddings were written, the Schema API
+                commands for their fields (see embedding_schema) go to
+                <name>_schema.json.
+
+        Returns:
+            List[str]: The files written.
+        """
+        if state_file is None:
+            files = self.write_docs(
+                self.iter_solr(substances),
+                file_path,
+                format,
+                max_file_size,
+                buffer_size,
+            )
+        else:
+            with SolrIndexState(state_file) as state:
+                files = self.write_docs(
+                    self.iter_delta(substances, state),
+                    file_path,
+                    format,
+                    max_file_size,
+                    buffer_size,
+                )
+                ids = state.removed()
+                if ids:
+                    path = "{}_delete.json".format(os.path.splitext(file_path)[0])
+                    with open(path, "w", encoding="utf-8") as file:
+                        json.dump({"delete": ids}, file)
+                    files.append(path)
+        if write_schema and self.embeddings:
+            path = "{}_schema.json".format(os.path.splitext(file_path)[0])
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(self.embedding_schema(), file, indent=2)
+            files.append(path)
+        return files
+
+    def write_docs(
+        self,
+        docs: Iterable[Dict],
+        file_path: str,
+        format: str = "ndjson",
+        max_file_size: Optional[int] = None,
+        buffer_size: int = 1 << 20,
+    ) -> List[str]:
+        """
+        Writes Solr documents, see write_stream.
+        """
+        if format == "ndjson":
+            start, separator, end = b"", b"\n", b"\n"
+        elif format == "json":
+            start, separator, end = b"[", b", ", b"]"
+        else:
+            raise ValueError(f"Unknown format {format!r}, expected 'ndjson' or 'json'")
+        root, ext = os.path.splitext(file_path)
+        files = []
+
+        def open_part():
+            path = (
+                file_path
+                if max_file_size is None
+                else "{}_{:05d}{}".format(root, len(files), ext)
+            )
+            files.append(path)
+            part = open(path, "wb", buffering=buffer_size)
+            part.write(start)
+            return part
+
+        file = open_part()
+        size = len(start)
+        empty = True
+        try:
+            for doc in docs:
+                data = json.dumps(doc).encode("utf-8")
+                if not empty and max_file_size is not None:
+                    if size + len(separator) + len(data) + len(end) > max_file_size:
+                        file.write(end)
+                        file.close()
+                        file = open_part()
+                        size = len(start)
+                        empty = True
+                if not empty:
+                    file.write(separator)
+                    size += len(separator)
+                file.write(data)
+                size += len(data)
+                empty = False
+            if format == "json" or not empty:
+                file.write(end)
+        finally:
+            file.close()
+        return files
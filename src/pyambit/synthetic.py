@@ -0,0 +1,254 @@
+"""
+Synthetic AMBIT payloads for scale testing, shaped like the study.json and
+substance.json test resources and deterministic per seed.
+"""
+
+import json
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from pyambit.datamodel import serialize_array, Study, Substances
+
+ENDPOINTS = ("ABSORPTION_AT_450_NM", "FLUORESCENCE_AT_590_NM", "CELL_VIABILITY")
+CELL_TYPES = ("HEK293", "A549", "HepG2", "THP-1")
+
+
+def synthetic_uuid(rng: np.random.Generator, prefix: str = "SYNT") -> str:
+    return "{}-{}".format(prefix, uuid.UUID(bytes=rng.bytes(16), version=4))
+
+
+def dose_response_effects(
+    rng: np.random.Generator,
+    n_endpoints: int = 1,
+    n_conc: int = 8,
+    n_time: int = 3,
+    n_replicate: int = 3,
+    concentration_mass: bool = True,
+    materials: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    One EffectRecord per endpoint x CONCENTRATION x E.EXPOSURE_TIME x
+    REPLICATE (x MATERIAL) combination. CONCENTRATION_MASS is the
+    alternative axis of CONCENTRATION.
+    """
+    concentrations = np.round(np.geomspace(0.1, 100, n_conc), 3).tolist()
+    surface = float(rng.uniform(0.5, 5))
+    effects = []
+    for endpoint in (ENDPOINTS * n_endpoints)[:n_endpoints]:
+        for material in materials or [None]:
+            base = rng.uniform(0.2, 2)
+            for c in concentrations:
+                response = base / (1 + c / 10)
+                for t in range(n_time):
+                    for r in range(n_replicate):
+                        conditions = {
+                            "CONCENTRATION": {"loValue": c, "unit": "ug/cm2"},
+                            "E.EXPOSURE_TIME": {"loValue": 24 * (t + 1), "unit": "h"},
+                            "REPLICATE": {"loValue": r + 1},
+                        }
+                        if concentration_mass:
+                            conditions["CONCENTRATION_MASS"] = {
+                                "loValue": round(c * surface, 3),
+                                "unit": "ug/ml",
+                            }
+                        if material is not None:
+                            conditions["MATERIAL"] = material
+                        value = response * (1 + rng.normal(0, 0.05))
+                        effects.append(
+                            {
+                                "endpoint": endpoint,
+                                "endpointtype": "RAW DATA",
+                                "conditions": conditions,
+                                "result": {
+                                    "loValue": round(float(value), 4),
+                                    "errorValue": round(float(abs(value) / 20), 4),
+                                    "unit": "",
+                                },
+                            }
+                        )
+    return effects
+
+
+def spectrum_effect(
+    rng: np.random.Generator,
+    n_points: int = 1024,
+    n_spectra: int = 1,
+    array_encoding: str = "list",
+) -> Dict[str, Any]:
+    """
+    EffectArray of n_spectra Raman like spectra with n_points each.
+    """
+    x = np.linspace(100, 3200, n_points)
+    centers = rng.uniform(400, 3000, 5)
+    widths = rng.uniform(10, 40, 5)
+    peaks = sum(
+        h * np.exp(-(((x - c) / w) ** 2))
+        for h, c, w in zip(rng.uniform(100, 1000, 5), centers, widths)
+    )
+    signal = rng.uniform(0.5, 1.5, (n_spectra, 1)) * peaks + rng.normal(
+        0, 5, (n_spectra, n_points)
+    )
+    axes = {"x": {"values": serialize_array(x, array_encoding), "unit": "cm-1"}}
+    if n_spectra == 1:
+        signal = signal[0]
+    else:
+        axes = {
+            "sample": {"values": serialize_array(np.arange(n_spectra), array_encoding)},
+            **axes,
+        }
+    return {
+        "endpoint": "Raman spectrum",
+        "endpointtype": "RAW_DATA",
+        "conditions": {},
+        "signal": {
+            "values": serialize_array(np.round(signal, 2), array_encoding),
+            "unit": "count",
+        },
+        "axes": axes,
+    }
+
+
+def study_json(
+    n_studies: int = 10,
+    effects_per_study: Optional[int] = None,
+    n_endpoints: int = 1,
+    n_conc: int = 8,
+    n_time: int = 3,
+    n_replicate: int = 3,
+    concentration_mass: bool = True,
+    n_materials: int = 0,
+    spectra_per_study: int = 0,
+    spectrum_length: int = 1024,
+    array_encoding: str = "list",
+    substance_uuid: Optional[str] = None,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    A {"study": [...]} payload like study.json.
+
+    Args:
+        n_studies (int): Number of ProtocolApplications.
+        effects_per_study (int): Truncates the dose-response records of
+            each study to this many; by default n_endpoints x n_conc x
+            n_time x n_replicate (x n_materials).
+        n_conc, n_time, n_replicate (int): Cardinality of the CONCENTRATION,
+            E.EXPOSURE_TIME and REPLICATE axes.
+        concentration_mass (bool): Adds the CONCENTRATION_MASS alternative
+            axis.
+        n_materials (int): Adds a MATERIAL text condition with this many
+            values, which splits the records into separate arrays.
+        spectra_per_study (int): Adds an EffectArray with this many spectra
+            of spectrum_length points; array_encoding as in serialize_array.
+            These are read with Study.model_construct.
+        substance_uuid (str): owner.substance.uuid of the studies.
+        seed (int): The same seed gives the same payload.
+    """
+    rng = np.random.default_rng(seed)
+    if substance_uuid is None:
+        substance_uuid = synthetic_uuid(rng)
+    materials = ["material_{}".format(m) for m in range(n_materials)] or None
+    study = []
+    for i in range(n_studies):
+        effects = dose_response_effects(
+            rng,
+            n_endpoints=n_endpoints,
+            n_conc=n_conc,
+            n_time=n_time,
+            n_replicate=n_replicate,
+            concentration_mass=concentration_mass,
+            materials=materials,
+        )
+        if effects_per_study is not None:
+            effects = effects[:effects_per_study]
+        if spectra_per_study:
+            effects.append(
+                spectrum_effect(rng, spectrum_length, spectra_per_study, array_encoding)
+            )
+        cell_type = CELL_TYPES[i % len(CELL_TYPES)]
+        study.append(
+            {
+                "uuid": synthetic_uuid(rng),
+                "investigation_uuid": synthetic_uuid(rng),
+                "assay_uuid": synthetic_uuid(rng),
+                "owner": {
+                    "company": {"name": "SYNTHETIC"},
+                    "substance": {"uuid": substance_uuid},
+                },
+                "citation": {
+                    "owner": "SYNTHETIC",
+                    "title": "Synthetic study {}".format(i),
+                    "year": str(2015 + i % 10),
+                },
+                "protocol": {
+                    "topcategory": "TOX",
+                    "category": {
+                        "code": "ENM_0000068_SECTION",
+                        "term": "http://www.bioassayontology.org/bao#ENM_0000068",
+                        "title": "ENM_0000068 Cell Viability",
+                    },
+                    "endpoint": "Cell viability",
+                    "guideline": ["WST-1"],
+                },
+                "parameters": {
+                    "E.method": "WST-1",
+                    "E.cell_type": cell_type,
+                    "TOTAL_VOLUME_PER_WELL": {"loValue": 0.2, "unit": "ml"},
+                },
+                "updated": "2024-{:02d}-01 00:00:00".format(1 + i % 12),
+                "effects": effects,
+            }
+        )
+    return {"study": study}
+
+
+def substances_json(
+    n_substances: int = 10, studies_per_substance: int = 5, seed: int = 0, **kwargs
+) -> Dict[str, Any]:
+    """
+    A {"substance": [...]} payload like substance.json, each substance with
+    its studies; kwargs are passed to study_json.
+    """
+    rng = np.random.default_rng(seed)
+    substances = []
+    for i in range(n_substances):
+        i5uuid = synthetic_uuid(rng)
+        substances.append(
+            {
+                "URI": "https://example.org/substance/{}".format(i5uuid),
+                "ownerName": "SYNTHETIC",
+                "ownerUUID": synthetic_uuid(rng),
+                "i5uuid": i5uuid,
+                "name": "Synthetic material {}".format(i),
+                "publicname": "SYNT{:05d}".format(i),
+                "format": "synthetic",
+                "substanceType": "NPO_1542",
+                "study": study_json(
+                    n_studies=studies_per_substance,
+                    substance_uuid=i5uuid,
+                    seed=int(rng.integers(1 << 31)),
+                    **kwargs,
+                )["study"],
+            }
+        )
+    return {"substance": substances}
+
+
+def synthetic_study(**kwargs) -> Study:
+    """
+    study_json as a Study (constructed without validation).
+    """
+    return Study.model_construct(**study_json(**kwargs))
+
+
+def synthetic_substances(**kwargs) -> Substances:
+    """
+    substances_json as Substances (constructed without validation).
+    """
+    return Substances.model_construct(**substances_json(**kwargs))
+
+
+def write_json(data: Dict[str, Any], file_path: str):
+    with open(file_path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
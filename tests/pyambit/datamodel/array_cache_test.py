@@ -0,0 +1,91 @@
+import numpy as np
+
+from pyambit import array_cache, synthetic
+from pyambit.array_cache import ArrayCache
+from pyambit.datamodel import (
+    EffectArray,
+    EffectRecordTable,
+    effects_digest,
+    LazyArray,
+    LazyValueArray,
+    Study,
+)
+
+
+def test_convert_cached(tmp_path):
+    study = Study(**synthetic.study_json(n_studies=2, n_conc=3, n_time=2))
+    papp = study.study[0]
+    expected, expected_df = papp.convert_effectrecords2array()
+
+    with ArrayCache(directory=str(tmp_path)) as cache:
+        assert array_cache.active() is cache
+        arrays, df = papp.convert_effectrecords2array()
+        df["papp_uuid"] = papp.uuid
+        arrays[0].signal.values[:] = 0
+        cached, cached_df = papp.convert_effectrecords2array()
+        assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+        assert cached == expected and cached_df.equals(expected_df)
+
+        value = papp.effects[0].result.loValue
+        papp.effects[0].result.loValue = value + 1
+        changed, _ = papp.convert_effectrecords2array()
+        assert changed != expected and cache.misses == 2
+
+        table = EffectRecordTable.from_records(papp.effects)
+        assert effects_digest(table) == effects_digest(
+            EffectRecordTable.from_records(papp.effects)
+        )
+        assert effects_digest(table) != effects_digest(papp.effects)
+        cache.invalidate(effects_digest(papp.effects))
+        assert len(cache) == 1
+    assert array_cache.active() is None
+
+    assert cache.activate() is array_cache.active() is cache
+    cache.deactivate()
+    assert array_cache.active() is None
+
+    papp.effects[0].result.loValue = value
+    with ArrayCache(directory=str(tmp_path)) as cache:
+        arrays, _ = papp.convert_effectrecords2array()
+        assert cache.hits == 1 and arrays == expected
+        cache.clear()
+        assert len(cache) == 0 and not list(tmp_path.glob("*.pkl"))
+
+
+def test_convert_cached_lazy():
+    study = Study(**synthetic.study_json(n_studies=1, n_conc=3, n_time=2))
+    papp = study.study[0]
+    loads = []
+    signal = LazyValueArray(
+        values=LazyArray(lambda: loads.append(1) or np.zeros(3), (3,), "float64"),
+        unit="count",
+    )
+    lazy = EffectArray(endpoint="spectrum", endpointtype="RAW_DATA", signal=signal)
+    papp.effects.append(lazy)
+
+    with ArrayCache() as cache:
+        digest = effects_digest(papp.effects)
+        assert digest == effects_digest(papp.effects[:-1])
+        for _ in range(2):
+            arrays, _ = papp.convert_effectrecords2array()
+            assert arrays[0] is lazy
+        assert (cache.hits, cache.misses) == (1, 1)
+    assert not loads and not signal.is_loaded()
+
+
+def test_eviction(tmp_path):
+    cache = ArrayCache(max_entries=2, max_bytes=3000)
+    for key in "abc":
+        cache.put(key, np.zeros(100))
+    assert list(cache.entries) == ["b", "c"]
+    cache.get("b")
+    cache.put("d", np.zeros(200))
+    assert list(cache.entries) == ["b", "d"] and cache.nbytes == 2400
+    cache.put("e", np.zeros(1000))
+    assert cache.get("e") is None and cache.misses == 1
+
+    cache = ArrayCache(max_entries=0, directory=str(tmp_path), max_disk_bytes=2500)
+    for key in "abc":
+        cache.put(key, np.zeros(100))
+    assert sorted(path.stem for path in tmp_path.glob("*.pkl")) == ["b", "c"]
+    assert np.array_equal(cache.get("c"), np.zeros(100))
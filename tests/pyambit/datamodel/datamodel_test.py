@@ -1,10 +1,14 @@
+import io
 import json
 import os.path
 from pathlib import Path
 
+import h5py
 import numpy as np
 import numpy.typing as npt
+import pandas as pd
 import pyambit.datamodel as mb
+import pytest
 
 TEST_DIR = Path(__file__).parent.parent / "resources"
 
@@ -23,7 +27,8 @@ def test_substances_load():
     assert substances == new_val
 
 
-def test_basevaluearray_roundtrip():
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_basevaluearray_roundtrip(array_encoding):
     """
     Test the roundtrip serialization and deserialization of the ValueArray model.
     """
@@ -31,14 +36,15 @@ def test_basevaluearray_roundtrip():
     a0: npt.NDArray[np.float64] = np.zeros(5)
     val = mb.BaseValueArray(values=a1, unit="unit", errQualifier="SD", errorValue=a0)
 
-    data = json.loads(val.model_dump_json())
+    data = json.loads(val.model_dump_json(array_encoding=array_encoding))
     # print(data)
     new_val = mb.BaseValueArray.model_construct(**data)
 
     assert val == new_val
 
 
-def test_metavaluearray_roundtrip():
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_metavaluearray_roundtrip(array_encoding):
     """
     Test the roundtrip serialization and deserialization of the MetaValueArray model.
     """
@@ -52,14 +58,15 @@ def test_metavaluearray_roundtrip():
         conditions={"test": "test"},
     )
 
-    data = json.loads(val.model_dump_json())
+    data = json.loads(val.model_dump_json(array_encoding=array_encoding))
     # print(data)
     new_val = mb.MetaValueArray.model_construct(**data)
 
     assert val == new_val
 
 
-def test_valuearray_roundtrip():
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_valuearray_roundtrip(array_encoding):
     """
     Test the roundtrip serialization and deserialization of the ValueArray model.
     """
@@ -74,13 +81,14 @@ def test_valuearray_roundtrip():
     )
 
     assert val.conditions is not None
-    data = json.loads(val.model_dump_json())
+    data = json.loads(val.model_dump_json(array_encoding=array_encoding))
     new_val = mb.ValueArray.model_construct(**data)
 
     assert val == new_val
 
 
-def test_valuearrayaux_roundtrip():
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_valuearrayaux_roundtrip(array_encoding):
     """
     Test the roundtrip serialization and deserialization of the ValueArray model.
     """
@@ -98,7 +106,7 @@ def test_valuearrayaux_roundtrip():
         auxiliary={"upValue": matrix_upValue, "textValue": matrix_textValue},
     )
 
-    data = json.loads(val.model_dump_json())
+    data = json.loads(val.model_dump_json(array_encoding=array_encoding))
     new_val = mb.ValueArray.model_construct(**data)
     for key in val.auxiliary:
         print("old", key, type(val.auxiliary[key]))
@@ -107,7 +115,8 @@ def test_valuearrayaux_roundtrip():
     assert val == new_val
 
 
-def test_valuearray_roundtrip_withaux():
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_valuearray_roundtrip_withaux(array_encoding):
     """
     Test the roundtrip serialization and deserialization of the ValueArray model.
     """
@@ -121,12 +130,13 @@ def test_valuearray_roundtrip_withaux():
         auxiliary={"upValue": a1},
     )
 
-    data = json.loads(val.model_dump_json())
+    data = json.loads(val.model_dump_json(array_encoding=array_encoding))
     new_val = mb.ValueArray.model_construct(**data)
     assert val == new_val
 
 
-def test_valuearray_roundtrip_with_arrayaux():
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_valuearray_roundtrip_with_arrayaux(array_encoding):
     """
     Test the roundtrip serialization and deserialization of the ValueArray model.
     """
@@ -144,11 +154,28 @@ def test_valuearray_roundtrip_with_arrayaux():
         auxiliary={"upValue": a1, "array": aux},
     )
 
-    data = json.loads(val.model_dump_json())
+    data = json.loads(val.model_dump_json(array_encoding=array_encoding))
     new_val = mb.ValueArray.model_construct(**data)
     assert val == new_val
 
 
+def test_valuearray_base64_frombuffer():
+    values = np.arange(12, dtype=np.float32).reshape(3, 4)
+    val = mb.ValueArray(
+        values=values, auxiliary={"textValue": np.array(["a", None], dtype=object)}
+    )
+    data = json.loads(val.model_dump_json(array_encoding="base64"))
+    assert data["values"]["dtype"] == "<f4"
+    assert data["values"]["shape"] == [3, 4]
+    assert data["auxiliary"]["textValue"] == ["a", None]
+    new_val = mb.ValueArray.model_construct(**data)
+    assert new_val.values.dtype == np.float32
+    assert not new_val.values.flags.owndata
+    assert np.array_equal(new_val.values, values)
+    with pytest.raises(ValueError):
+        val.model_dump_json(array_encoding="npy")
+
+
 def test_value_roundtrip():
     """
     Test the roundtrip serialization and deserialization of the Value model.
@@ -269,13 +296,14 @@ def create_effectarray():
     )
 
 
-def test_effect_array_roundtrip():
+@pytest.mark.parametrize("array_encoding", mb.ARRAY_ENCODINGS)
+def test_effect_array_roundtrip(array_encoding):
     """
     Test the roundtrip serialization and deserialization of the EffectArray model.
     """
     original = create_effectarray()
 
-    json_string = original.model_dump_json()
+    json_string = original.model_dump_json(array_encoding=array_encoding)
     data = json.loads(json_string)
     new_instance = mb.EffectArray.model_construct(**data)
 
@@ -689,3 +717,393 @@ def test_convert_effectrecords2array():
     papp = create_protocolapp4test()
     papp.effects = [create_effectrecord()]
     arrays, _df = papp.convert_effectrecords2array()
+
+
+def test_create_multidimensional_matrix():
+    df = pd.DataFrame(
+        {
+            "CONCENTRATION": [0.0, 10.0, 1.0, 10.0, 0.0, 1.0],
+            "REPLICATE": [1, 1, 2, 2, 2, 2],
+            "loValue": [0.5, 1.5, np.nan, 2.5, 9.9, 3.5],
+            "errorValue": [0.1, np.nan, 0.3, 0.4, 0.5, 0.6],
+            "textValue": [b"a", np.nan, b"c", b"d", b"e", b"f"],
+        }
+    )
+    axes = {
+        "CONCENTRATION": mb.ValueArray(unit="mg/L"),
+        "REPLICATE": mb.ValueArray(),
+    }
+    papp = create_protocolapp4test()
+    matrix, axes, matrix_errors, aux = papp.create_multidimensional_matrix(
+        df, "loValue", axes, None, "errorValue", ["textValue"]
+    )
+    assert matrix.shape == (3, 2)
+    assert list(axes["CONCENTRATION"].values) == [0.0, 1.0, 10.0]
+    assert list(axes["REPLICATE"].values) == [1, 2]
+
+    axis_values = [[0.0, 1.0, 10.0], [1, 2]]
+    expected = np.full((3, 2), np.nan)
+    expected_errors = np.full((3, 2), np.nan)
+    expected_aux = {"textValue": np.full((3, 2), "", dtype=object)}
+    mb.scatter_matrix_rowwise(
+        df,
+        ["CONCENTRATION", "REPLICATE"],
+        axis_values,
+        "loValue",
+        expected,
+        "errorValue",
+        expected_errors,
+        expected_aux,
+    )
+    # duplicate (1.0, 2) keeps the last non-missing value
+    assert matrix[1, 1] == 3.5
+    assert aux["textValue"][1, 1] == "f"
+    np.testing.assert_array_equal(matrix, expected)
+    np.testing.assert_array_equal(matrix_errors, expected_errors)
+    np.testing.assert_array_equal(aux["textValue"], expected_aux["textValue"])
+
+
+def test_convert_effectrecords2array_order():
+    papp = create_protocolapp4test()
+    papp.effects = [
+        mb.EffectRecord(
+            endpoint=endpoint,
+            endpointtype=endpointtype,
+            conditions={
+                "CONCENTRATION": mb.Value(loValue=concentration, unit="ug/mL"),
+                "MATERIAL": material,
+            },
+            result=mb.EffectResult(loValue=concentration / 10, unit=unit),
+        )
+        for concentration in (1.0, 10.0)
+        for endpointtype, endpoint, unit, material in [
+            ("RAW DATA", "E1", "%", "A"),
+            ("MEAN", "E2", None, "A"),
+            ("RAW DATA", "E3", "%", "A"),
+            ("RAW DATA", "E1", "mg", "A"),
+            (None, "E1", "%", "B"),
+            ("RAW DATA", "E1", "%", "B"),
+        ]
+    ]
+    arrays, _df = papp.convert_effectrecords2array()
+    assert [
+        (a.conditions["MATERIAL"], a.endpointtype, a.endpoint, a.signal.unit)
+        for a in arrays
+    ] == [
+        ("A", "RAW DATA", "E1", "%"),
+        ("A", "RAW DATA", "E1", "mg"),
+        ("A", "RAW DATA", "E3", "%"),
+        ("A", "MEAN", "E2", None),
+        ("B", None, "E1", "%"),
+        ("B", "RAW DATA", "E1", "%"),
+    ]
+    for a in arrays:
+        np.testing.assert_array_equal(a.signal.values, [0.1, 1.0])
+
+
+def test_convert_effectrecords2array_order_string_conditions():
+    papp = create_protocolapp4test()
+    papp.effects = [
+        mb.EffectRecord(
+            endpoint=endpoint,
+            endpointtype="RAW DATA",
+            conditions={
+                "CONCENTRATION": mb.Value(loValue=concentration, unit="ug/mL"),
+                "MATERIAL": material,
+                "CELL": cell,
+            },
+            result=mb.EffectResult(loValue=concentration / 10, unit="%"),
+        )
+        for concentration in (1.0, 10.0)
+        for material, cell, endpoint in [
+            ("A", "X", "E1"),
+            ("B", "Y", "E2"),
+            ("A", "Z", "E1"),
+            ("B", "Y", "E1"),
+            ("A", "X", "E2"),
+        ]
+    ]
+    arrays, df = papp.convert_effectrecords2array()
+    # the combinations of string conditions keep the order of the baseline split
+    keys = list(mb.split_df_by_columns(df, ["MATERIAL", "CELL"]))
+    assert keys == [("A", "X"), ("B", "Y"), ("A", "Z")]
+    assert [
+        (a.conditions["MATERIAL"], a.conditions["CELL"], a.endpoint) for a in arrays
+    ] == [
+        ("A", "X", "E1"),
+        ("A", "X", "E2"),
+        ("B", "Y", "E2"),
+        ("B", "Y", "E1"),
+        ("A", "Z", "E1"),
+    ]
+
+
+def test_effects2df():
+    effects = [
+        create_effectrecord(),
+        mb.EffectRecord(
+            endpoint="other",
+            conditions={"condition4": "x"},
+            result=mb.EffectResult(loValue=1.0),
+        ),
+        create_effectarray(),
+    ]
+    df, cols, result_cols, condition_cols = mb.effects2df(effects)
+
+    dumps = [e.model_dump() for e in effects[:2]]
+    expected = pd.DataFrame(dumps).drop(columns=["conditions", "result"])
+    expected_result = pd.DataFrame([d["result"] for d in dumps])
+    expected_conditions = pd.DataFrame([d["conditions"] for d in dumps])
+    pd.testing.assert_index_equal(cols, expected.columns)
+    pd.testing.assert_index_equal(result_cols, expected_result.columns)
+    pd.testing.assert_index_equal(condition_cols, expected_conditions.columns)
+    pd.testing.assert_frame_equal(
+        df, pd.concat([expected, expected_result, expected_conditions], axis=1)
+    )
+    assert df["condition1"][0] == effects[0].conditions["condition1"].model_dump()
+
+
+@pytest.mark.parametrize("size", [5, 5 * mb.ENCODE_BULK_SIZE])
+def test_transform_array(size):
+    def column(values):
+        return np.array((values * size)[:size], dtype=object)
+
+    assert mb.classify_array(column([None, np.nan])) == "null"
+    assert mb.classify_array(column([1, None, 2.5])) == "numeric"
+    assert mb.classify_array(column(["a", None, np.nan])) == "string"
+    assert mb.classify_array(column(["a", 1, None])) == "mixed"
+
+    assert mb.transform_array(column([None, np.nan])) is None
+    values = column([1, None, 2.5])
+    assert mb.transform_array(values) is values
+    np.testing.assert_array_equal(
+        mb.transform_array(column(["1", "2.5", None])),
+        np.array(([1.0, 2.5, np.nan] * size)[:size]),
+    )
+    encoded = mb.transform_array(column(["ab", None, 1.5, "\u03a9x", b"y"]))
+    expected = [b"ab", b"=", b"1.5", b"x", b"b'y'"]
+    assert encoded.dtype == np.dtype("S4")
+    assert encoded.tolist() == (expected * size)[:size]
+    # the class of the whole column holds for its parts
+    assert mb.transform_array(column([np.nan]), "numeric") is None
+    assert mb.transform_array(column([np.nan]), "string") is None
+
+
+def test_find_string_only_columns():
+    df = pd.DataFrame(
+        {
+            "MATERIAL": ["A", None, "B"],
+            "REPLICATE": ["1", "2", None],
+            "EMPTY": pd.Series([None, np.nan, pd.NaT], dtype=object),
+            "CONCENTRATION": [{"loValue": 1}, {"loValue": 2}, None],
+            "MIXED": ["x", 1.0, None],
+            "TIME": [24.0, 48.0, np.nan],
+        }
+    )
+    classes = mb.classify_columns(df)
+    assert classes == {
+        "MATERIAL": "string",
+        "REPLICATE": "string",
+        "EMPTY": "null",
+        "CONCENTRATION": "numeric",
+        "MIXED": "mixed",
+        "TIME": "numeric",
+    }
+    assert mb.find_string_only_columns(df) == ["MATERIAL", "EMPTY"]
+    assert mb.find_string_only_columns(df, classes) == ["MATERIAL", "EMPTY"]
+
+
+def test_split_df_by_columns():
+    df = pd.DataFrame(
+        {
+            "MATERIAL": ["A", None, "B", "A", np.nan],
+            "CELL": ["x", "y", "x", "x", "y"],
+            "value": [1.0, 2.0, 3.0, 4.0, 5.0],
+        },
+        index=[10, 11, 12, 13, 14],
+    )
+    split = mb.split_df_by_columns(df, ["MATERIAL", "CELL"])
+    assert [key[1] for key in split] == ["x", "y", "x"]
+    assert [key[0] for key in split][::2] == ["A", "B"]
+    assert [part["value"].tolist() for part in split.values()] == [
+        [1.0, 4.0],
+        [2.0, 5.0],
+        [3.0],
+    ]
+    assert list(split[("A", "x")].index) == [10, 13]
+    rows = mb.split_df_by_columns(df, ["MATERIAL", "CELL"], as_index=True)
+    assert [r.tolist() for r in rows.values()] == [[0, 3], [1, 4], [2]]
+    assert mb.split_df_by_columns(df.iloc[:0], ["CELL"]) == {}
+
+
+def test_iter_json_array():
+    text = '{"records": 3, "other": [1, {"a": [2]}], "substance": [1, 2.5e3, "x"]}'
+    for chunk_size in (1, 4, 1 << 16):
+        assert list(mb.iter_json_array(io.StringIO(text), "substance", chunk_size)) == [
+            1,
+            2.5e3,
+            "x",
+        ]
+    assert list(mb.iter_json_array(io.StringIO('{"study": []}'), "study")) == []
+    assert list(mb.iter_json_array(io.StringIO("{}"), "study")) == []
+    with pytest.raises(ValueError):
+        list(mb.iter_json_array(io.StringIO('{"study": [{"a": 1}'), "study"))
+
+
+def test_study_iter_from_file():
+    with open(os.path.join(TEST_DIR, "study.json"), "r", encoding="utf-8") as file:
+        study = mb.Study(**json.load(file))
+    for chunk_size in (100, 1 << 16):
+        papps = list(
+            mb.Study.iter_from_file(os.path.join(TEST_DIR, "study.json"), chunk_size)
+        )
+        assert papps == study.study
+
+
+def test_substances_iter_from_file():
+    with open(os.path.join(TEST_DIR, "substance.json"), "r", encoding="utf-8") as file:
+        substances = mb.Substances(**json.load(file))
+    records = list(
+        mb.Substances.iter_from_file(os.path.join(TEST_DIR, "substance.json"), 16)
+    )
+    assert records == substances.substance
+
+
+def test_study_model_construct_trusted():
+    with open(os.path.join(TEST_DIR, "study.json"), "r", encoding="utf-8") as file:
+        json_study = json.load(file)
+    study = mb.Study.model_construct(**json_study)
+    papp = study.study[0]
+    assert isinstance(papp.citation, mb.Citation)
+    # not validated: the year stays a string as in the JSON
+    assert papp.citation.year == json_study["study"][0]["citation"]["year"]
+    assert isinstance(papp.owner.substance, mb.Sample)
+    assert isinstance(papp.protocol.category, mb.EndpointCategory)
+    effect = papp.effects[0]
+    assert isinstance(effect.result, mb.EffectResult)
+    assert isinstance(effect.conditions["CONCENTRATION"], mb.Value)
+    assert effect.conditions["CONCENTRATION"].loValue == 0
+
+    papps = list(
+        mb.Study.iter_from_file(os.path.join(TEST_DIR, "study.json"), validate=False)
+    )
+    assert papps == study.study
+
+
+def test_effect_record_table():
+    with open(os.path.join(TEST_DIR, "study.json"), "r", encoding="utf-8") as file:
+        study = mb.Study(**json.load(file))
+    papp = max(study.study, key=lambda papp: len(papp.effects))
+    table = mb.EffectRecordTable.from_records(papp.effects)
+    assert len(table) == table.rows == len(papp.effects)
+    assert table == papp.effects
+    assert table[3] == papp.effects[3] and table[-1] == papp.effects[-1]
+    # the records built from the table don't share values with it
+    record = table[0]
+    record.conditions[next(iter(record.conditions))] = "changed"
+    assert table[0] == papp.effects[0]
+
+    expected = mb.effects2df(papp.effects)
+    df, *columns = mb.effects2df(table)
+    pd.testing.assert_frame_equal(df, expected[0])
+    assert [list(c) for c in columns] == [list(c) for c in expected[1:]]
+
+    papp_table = papp.model_copy(deep=True)
+    table = papp_table.tabulate_effects()
+    assert papp_table.effects == [] and papp_table.effect_table is table
+    assert table == papp.effects
+    assert papp_table == papp
+    assert papp_table.model_dump_json() == papp.model_dump_json()
+    arrays, _ = papp.convert_effectrecords2array()
+    arrays_table, _ = papp_table.convert_effectrecords2array()
+    assert repr(arrays_table) == repr(arrays)
+
+    # effects stays a list, for the EffectArrays and records added later
+    spectrum = mb.EffectArray(
+        endpoint="spectrum",
+        conditions={},
+        signal=mb.ValueArray(values=np.arange(3.0)),
+    )
+    papp_table.effects.append(spectrum)
+    papp_table.effects.append(papp.effects[0])
+    expected = papp.effects + [papp.effects[0]]
+    assert list(papp_table.iter_effects()) == papp.effects + papp_table.effects
+    assert papp_table.effect_records() == expected
+    papp_table.tabulate_effects()
+    assert papp_table.effects == [spectrum] and papp_table.effect_table == expected
+    arrays, _ = papp_table.convert_effectrecords2array()
+    assert arrays[0] is spectrum
+
+    with pytest.raises(TypeError):
+        mb.EffectRecordTable.from_records([spectrum.model_dump()])
+    with pytest.raises(TypeError):
+        mb.EffectRecordTable.from_records(
+            [
+                mb.ProtocolEffectRecord(
+                    endpoint="E", protocol=mb.Protocol(), documentUUID="D"
+                )
+            ]
+        )
+
+
+def test_effect_record_table_condition_order():
+    conditions = [
+        {"CONCENTRATION": mb.Value(loValue=1, unit="uM"), "CELL": "A549"},
+        {"CELL": "A549", "CONCENTRATION": mb.Value(loValue=2, unit="uM")},
+        {"REPLICATE": "1", "CELL": "HaCaT", "TIME": 24.0},
+        {},
+        {"TIME": 2.5, "REPLICATE": "2"},
+    ]
+    papp = mb.ProtocolApplication(
+        uuid="P1",
+        effects=[
+            mb.EffectRecord(
+                endpoint="E",
+                conditions=record_conditions,
+                result=mb.EffectResult(loValue=row),
+            )
+            for row, record_conditions in enumerate(conditions)
+        ],
+    )
+    expected = papp.model_dump_json()
+    table = papp.tabulate_effects()
+    assert papp.model_dump_json() == expected
+    assert [list(record.conditions) for record in table] == [
+        list(mb.EffectRecord(endpoint="E", conditions=c).conditions) for c in conditions
+    ]
+    assert [list(table[row].conditions) for row in range(len(table))] == [
+        list(record.conditions) for record in table
+    ]
+
+
+def test_valuearray_out_of_core(tmp_path):
+    values = np.arange(12000.0).reshape(1200, 10)
+    np.save(tmp_path / "values.npy", values)
+    mapped = np.load(tmp_path / "values.npy", mmap_mode="r")
+    with h5py.File(tmp_path / "values.h5", "w") as h5file:
+        h5file["values"] = values
+    with h5py.File(tmp_path / "values.h5", "r") as h5file:
+        dataset = h5file["values"]
+        va = mb.ValueArray(values=mapped, auxiliary={"h5": dataset})
+        assert va.values is mapped and va.auxiliary["h5"] is dataset
+        assert va == mb.ValueArray(values=values, auxiliary={"h5": values})
+        assert va != mb.ValueArray(values=values + 1, auxiliary={"h5": values})
+        assert mb.arrays_equal(dataset, values, block_bytes=1000)
+        assert not mb.arrays_equal(mapped, values[::-1], block_bytes=1000)
+        assert mb.same_storage(mapped, mapped[:])
+        # slices of a memmap keep its filename and offset
+        assert not mb.same_storage(mapped[:10], mapped[10:20])
+        assert not mb.arrays_equal(mapped[:10], mapped[10:20])
+        assert not mb.arrays_equal(mapped[::2], mapped[1::2])
+        assert mb.ValueArray(values=mapped[:10]) != mb.ValueArray(values=mapped[10:20])
+        assert mb.arrays_equal(mapped, np.load(tmp_path / "values.npy", mmap_mode="r"))
+
+        va.spill(str(tmp_path), min_bytes=1)
+        assert va.values is mapped
+        assert isinstance(va.auxiliary["h5"], np.memmap)
+        assert os.path.dirname(va.auxiliary["h5"].filename) == str(tmp_path)
+        assert np.array_equal(va.auxiliary["h5"], values)
+
+        small = mb.spill_array(dataset)
+        assert type(small) is np.ndarray and np.array_equal(small, values)
+        assert mb.spill_array(values) is values
@@ -0,0 +1,50 @@
+import json
+
+import nexusformat.nexus.tree as nx
+
+from pyambit import instrument, nexus_writer, synthetic  # noqa: F401
+from pyambit.instrument import Instrumentation
+from pyambit.solr_writer import Ambit2Solr
+
+
+def test_instrumentation(tmp_path):
+    substances = synthetic.synthetic_substances(
+        n_substances=2, studies_per_substance=3, spectra_per_study=2
+    )
+    study = substances.substance[0]
+    events = []
+    with Instrumentation(
+        trace_memory=True, callbacks=[lambda *event: events.append(event)]
+    ) as stats:
+        nexus_writer.write_study_nexus(study.study[0], str(tmp_path / "study.nxs"))
+        study.to_nexus(nx.NXroot())
+        Ambit2Solr(prefix="TEST").to_json(substances)
+    assert instrument._active is None
+
+    stages = stats.to_dict()
+    assert stages["to_nexus"]["calls"] == 4
+    assert stages["convert_effectrecords2array"]["calls"] == 4
+    assert stages["convert_effectrecords2array"]["rows"] == 4 * (8 * 3 * 3 + 1)
+    assert stages["effects2df"]["rows"] == 4 * 8 * 3 * 3
+    assert stages["effectarray2data"]["calls"] == 4 * 2
+    assert stages["nexus_save"]["calls"] == 1
+    assert stages["substancerecord2solr"] == {
+        **stages["substancerecord2solr"],
+        "calls": 2,
+        "rows": 6,
+    }
+    assert stages["entry2solr"]["calls"] == 6
+    assert all(s["peak_bytes"] > 0 for s in stages.values())
+    assert (
+        stages["to_nexus"]["peak_bytes"]
+        >= stages["convert_effectrecords2array"]["peak_bytes"]
+    )
+    assert len(events) == sum(s["calls"] for s in stages.values())
+    assert json.loads(stats.to_json()) == stages
+
+    text = stats.to_prometheus()
+    assert "# TYPE pyambit_stage_calls_total counter" in text
+    assert 'pyambit_stage_calls_total{stage="to_nexus"} 4' in text.splitlines()
+
+    study.to_nexus(nx.NXroot())
+    assert stats.to_dict() == stages
@@ -0,0 +1,147 @@
+import json
+import os.path
+from pathlib import Path
+
+import nexusformat.nexus.tree as nx
+import numpy as np
+
+from pyambit import nexus_writer
+from pyambit.datamodel import (
+    EffectArray,
+    LazyValueArray,
+    MetaValueArray,
+    ProtocolApplication,
+    Study,
+    Substances,
+    ValueArray,
+)
+from pyambit.nexus_parser import effectarray_from_nexus, Nexus2Ambit
+
+TEST_DIR = Path(__file__).parent.parent / "resources"
+
+
+def test_effectarray_from_nexus(tmp_path):
+    effect = EffectArray(
+        endpoint="spectrum",
+        endpointtype="RAW_DATA",
+        conditions={"MATERIAL": "sample"},
+        signal=ValueArray(
+            values=np.random.random((3, 4)),
+            errorValue=np.random.random((3, 4)),
+            unit="count",
+            conditions={"replicate": "1"},
+            auxiliary={
+                "upValue": np.random.random((3, 4)),
+                "textValue": np.full((3, 4), "x", dtype=object),
+                "area": MetaValueArray(
+                    values=np.ones((3, 4)), unit="a.u.", conditions={"fit": "lorentz"}
+                ),
+            },
+        ),
+        axes={
+            "time": ValueArray(values=np.arange(3.0), unit="h"),
+            "x": ValueArray(
+                values=np.arange(4.0), unit="cm-1", errorValue=np.full(4, 0.5)
+            ),
+            "x_nm": ValueArray(values=np.arange(4.0) * 10, unit="nm"),
+        },
+        axis_groups={"x": ["x_nm"]},
+    )
+    nxroot = nx.NXroot()
+    nxroot["entry"] = nx.NXentry()
+    nxroot["entry/RAW_DATA"] = nx.NXgroup()
+    nxroot["entry/RAW_DATA/spectrum_1"] = nexus_writer.effectarray2data(effect)
+    nxroot.save(str(tmp_path / "effect.nxs"), mode="w")
+
+    data = nx.nxload(str(tmp_path / "effect.nxs"))["entry/RAW_DATA/spectrum_1"]
+    parsed = effectarray_from_nexus("RAW_DATA", data)
+    assert isinstance(parsed.signal, LazyValueArray)
+    assert not parsed.signal.is_loaded()
+    assert parsed.signal.__dict__["values"].shape == (3, 4)
+
+    assert parsed.endpoint == effect.endpoint
+    assert parsed.conditions == effect.conditions
+    assert parsed.axis_groups == effect.axis_groups
+    assert parsed.signal.unit == "count"
+    assert parsed.signal.conditions == effect.signal.conditions
+    assert np.array_equal(parsed.signal.values, effect.signal.values)
+    assert np.array_equal(parsed.signal.errorValue, effect.signal.errorValue)
+    for key in effect.axes:
+        assert parsed.axes[key].unit == effect.axes[key].unit
+        assert np.array_equal(parsed.axes[key].values, effect.axes[key].values)
+    assert np.array_equal(parsed.axes["x"].errorValue, np.full(4, 0.5))
+    auxiliary = parsed.signal.auxiliary
+    assert np.array_equal(auxiliary["upValue"], effect.signal.auxiliary["upValue"])
+    assert auxiliary["textValue"].tolist() == [["x"] * 4] * 3
+    assert auxiliary["area"].unit == "a.u."
+    assert auxiliary["area"].conditions == {"fit": "lorentz"}
+    assert np.array_equal(auxiliary["area"].values, np.ones((3, 4)))
+    assert parsed.signal.is_loaded()
+
+
+def test_lazy_model_dump(tmp_path):
+    effect = EffectArray(
+        endpoint="spectrum",
+        endpointtype="RAW_DATA",
+        signal=ValueArray(
+            values=np.random.random((3, 4)),
+            unit="count",
+            auxiliary={
+                "upValue": np.random.random((3, 4)),
+                "area": MetaValueArray(values=np.ones((3, 4)), unit="a.u."),
+            },
+        ),
+        axes={"x": ValueArray(values=np.arange(4.0), unit="cm-1")},
+    )
+    nxroot = nx.NXroot()
+    nxroot["entry"] = nx.NXentry()
+    nxroot["entry/RAW_DATA"] = nx.NXgroup()
+    nxroot["entry/RAW_DATA/spectrum_1"] = nexus_writer.effectarray2data(effect)
+    nxroot.save(str(tmp_path / "effect.nxs"), mode="w")
+
+    def parse():
+        data = nx.nxload(str(tmp_path / "effect.nxs"))["entry/RAW_DATA/spectrum_1"]
+        return effectarray_from_nexus("RAW_DATA", data)
+
+    parsed = parse()
+    assert parsed.conditions is None
+    assert parsed == effect and effect == parsed
+
+    # nested dumps don't call the model_dump overrides
+    parsed = parse()
+    data = ProtocolApplication(uuid="P1", effects=[parsed]).model_dump()
+    signal = data["effects"][0]["signal"]
+    assert isinstance(signal["values"], np.ndarray)
+    assert isinstance(signal["auxiliary"]["upValue"], np.ndarray)
+    assert isinstance(signal["auxiliary"]["area"]["values"], np.ndarray)
+    assert isinstance(data["effects"][0]["axes"]["x"]["values"], np.ndarray)
+    assert parsed.signal.is_loaded()
+
+    parsed = parse()
+    assert "errorValue" not in parsed.signal.model_dump(exclude_none=True)
+    assert isinstance(parsed.signal.model_dump(mode="python")["values"], np.ndarray)
+    data = json.loads(parse().model_dump_json())
+    assert EffectArray.model_construct(**data) == effect
+
+
+def test_parse_effectarrays(tmp_path):
+    with open(os.path.join(TEST_DIR, "substance.json"), "r", encoding="utf-8") as file:
+        substances = Substances(**json.load(file))
+    with open(os.path.join(TEST_DIR, "study.json"), "r", encoding="utf-8") as file:
+        study = Study(**json.load(file))
+    substances.substance[0].study = study.study[:3]
+    substances.to_nexus(nx.NXroot()).save(str(tmp_path / "study.nxs"), mode="w")
+
+    with Nexus2Ambit("https://example.org", index_only=False) as parser:
+        parser.parse(nx.nxload(str(tmp_path / "study.nxs")), "study.nxs")
+        parsed = {
+            papp.uuid: papp for papp in parser.get_substances().substance[0].study
+        }
+    for papp in study.study[:3]:
+        expected, _ = papp.convert_effectrecords2array()
+        effects = parsed[papp.uuid].effects
+        assert len(effects) == len(expected)
+        assert all(isinstance(effect, EffectArray) for effect in effects)
+        assert sorted(e.signal.values.size for e in effects) == sorted(
+            e.signal.values.size for e in expected
+        )
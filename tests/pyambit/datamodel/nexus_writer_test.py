@@ -1,14 +1,24 @@
+import functools
 import json
 import os.path
 import tempfile
 from pathlib import Path
 
+import h5py
 import nexusformat.nexus.tree as nx
+import numpy as np
 import pytest
 
 # to_nexus is not added without this import
 from pyambit import nexus_writer  # noqa: F401
-from pyambit.datamodel import Study, Substances
+from pyambit.datamodel import (
+    EffectArray,
+    Protocol,
+    ProtocolApplication,
+    Study,
+    Substances,
+    ValueArray,
+)
 
 TEST_DIR = Path(__file__).parent.parent / "resources"
 
@@ -79,3 +89,179 @@ def test_study(substances):
                             print(element, end=".")
                 # print(nxroot.tree)
                 raise err
+
+
+def test_export_nexus(substances, tmp_path):
+    (tmp_path / "serial").mkdir()
+    (tmp_path / "parallel").mkdir()
+    serial = nexus_writer.export_nexus(substances, str(tmp_path / "serial"))
+    parallel = nexus_writer.export_nexus(
+        substances, str(tmp_path / "parallel"), workers=2
+    )
+    assert len(serial) == len(substances.substance[0].study)
+    assert [os.path.basename(f) for f in serial] == [
+        os.path.basename(f) for f in parallel
+    ]
+    assert [e is None for e in serial.values()] == [
+        e is None for e in parallel.values()
+    ]
+    for file, error in parallel.items():
+        assert os.path.exists(file) == (error is None)
+    written = [f for f, e in parallel.items() if e is None]
+    assert written
+    assert "entry" in str(nx.nxload(written[0]).tree)
+
+
+def h5_layout(file):
+    layout = {}
+
+    def visit(name, obj):
+        link = file.get(name, getlink=True)
+        attrs = {k: str(v) for k, v in obj.attrs.items()}
+        if isinstance(link, h5py.SoftLink):
+            layout[name] = ("softlink", link.path)
+        elif isinstance(obj, h5py.Dataset):
+            value = str(obj[()])
+            if obj.parent.attrs.get("NX_class") == "NXprocess" and name.endswith(
+                "/date"
+            ):
+                value = None  # creation time of the NXprocess
+            filters = (obj.compression, obj.shuffle, obj.chunks)
+            layout[name] = (str(obj.dtype), obj.shape, value, attrs, filters)
+        else:
+            layout[name] = ("group", attrs)
+
+    with h5py.File(file, "r") as file:
+        file.visititems_links(lambda name, link: visit(name, file[name]))
+    return layout
+
+
+@pytest.mark.parametrize(
+    "dataset_options", [None, {"signal": {"compression": "gzip", "min_size": 1}}]
+)
+def test_to_nexus_h5(substances, tmp_path, dataset_options):
+    nxroot = nx.NXroot()
+    substances.to_nexus(nxroot, hierarchy=True, dataset_options=dataset_options)
+    nxroot.save(str(tmp_path / "tree.nxs"), mode="w")
+    with h5py.File(tmp_path / "stream.nxs", "w") as h5file:
+        substances.to_nexus_h5(h5file, hierarchy=True, dataset_options=dataset_options)
+    expected = h5_layout(tmp_path / "tree.nxs")
+    assert len(expected) > 100
+    assert h5_layout(tmp_path / "stream.nxs") == expected
+
+
+def test_dataset_options(tmp_path):
+    effect = EffectArray(
+        endpoint="spectrum",
+        endpointtype="RAW_DATA",
+        signal=ValueArray(
+            values=np.random.random((100, 1024)),
+            errorValue=np.full(5, 0.1),
+            unit="count",
+        ),
+        axes={
+            "sample": ValueArray(values=np.arange(100)),
+            "x": ValueArray(values=np.linspace(100, 3200, 1024), unit="cm-1"),
+        },
+    )
+    nxroot = nx.NXroot()
+    nxroot["entry"] = nx.NXentry()
+    nxroot["entry/data"] = nexus_writer.effectarray2data(
+        effect, dataset_options={"signal": {"compression": "lzf", "shuffle": True}}
+    )
+    nxroot.save(str(tmp_path / "lzf.nxs"), mode="w")
+    with h5py.File(tmp_path / "lzf.nxs", "r") as h5file:
+        signal = h5file["entry/data/spectrum"]
+        assert signal.compression == "lzf"
+        assert signal.shuffle
+        assert signal.chunks == (32, 1024)
+        assert h5file["entry/data/x"].chunks is None
+
+    with pytest.raises(ValueError):
+        nexus_writer.effectarray2data(effect, dataset_options="zstd")
+    assert nexus_writer.chunk_shape((50, 8, 30, 4), 8, 1 << 14) == (2, 8, 30, 4)
+    assert nexus_writer.chunk_shape((10,), 8) == (10,)
+
+
+def test_effectarray2data_out_of_core(tmp_path):
+    values = np.random.random((100, 1024))
+    with h5py.File(tmp_path / "signal.h5", "w") as h5file:
+        h5file["signal"] = values
+    with h5py.File(tmp_path / "signal.h5", "r") as h5file:
+        effect = EffectArray(
+            endpoint="spectrum",
+            signal=ValueArray(values=h5file["signal"], unit="count"),
+            axes={"x": ValueArray(values=np.arange(1024.0), unit="cm-1")},
+        )
+        nxdata = nexus_writer.effectarray2data(effect)
+        assert np.array_equal(nxdata["spectrum"].nxdata, values)
+
+        effect.spill(str(tmp_path), min_bytes=1)
+        mapped = effect.signal.values
+        assert isinstance(mapped, np.memmap)
+        assert isinstance(effect.axes["x"].values, np.memmap)
+    nxroot = nx.NXroot()
+    nxroot["entry"] = nx.NXentry()
+    nxroot["entry/data"] = nexus_writer.effectarray2data(effect)
+    assert np.shares_memory(nxroot["entry/data/spectrum"].nxdata, mapped)
+    nxroot.save(str(tmp_path / "mapped.nxs"), mode="w")
+    with h5py.File(tmp_path / "mapped.nxs", "r") as h5file:
+        assert np.array_equal(h5file["entry/data/spectrum"][()], values)
+
+
+def test_to_nexus_dataset_not_read(tmp_path, monkeypatch):
+    values = np.random.random((64, 256))
+    with h5py.File(tmp_path / "signal.h5", "w") as h5file:
+        h5file["signal"] = values
+    reads = []
+    getitem = h5py.Dataset.__getitem__
+
+    def read(self, args, *rest, **kwargs):
+        reads.append(args)
+        return getitem(self, args, *rest, **kwargs)
+
+    def asarray(self, *args, **kwargs):
+        raise AssertionError("h5py.Dataset read as a whole")
+
+    monkeypatch.setattr(h5py.Dataset, "__getitem__", read)
+    monkeypatch.setattr(h5py.Dataset, "__array__", asarray)
+    # spilled by blocks of 16 rows, as datasets larger than SPILL_MIN_BYTES
+    monkeypatch.setattr(
+        nexus_writer,
+        "spill_array",
+        functools.partial(
+            nexus_writer.spill_array,
+            directory=str(tmp_path),
+            min_bytes=1,
+            block_bytes=16 * 256 * 8,
+        ),
+    )
+    with h5py.File(tmp_path / "signal.h5", "r") as h5file:
+        effect = EffectArray(
+            endpoint="spectrum",
+            endpointtype="RAW_DATA",
+            signal=ValueArray(values=h5file["signal"], unit="count"),
+            axes={"x": ValueArray(values=np.arange(256.0), unit="cm-1")},
+        )
+        papp = ProtocolApplication(
+            uuid="P1",
+            protocol=Protocol(topcategory="P-CHEM", category={"code": "XYZ"}),
+            effects=[effect],
+        )
+        nxroot = papp.to_nexus(nx.NXroot(), dataset_options="gzip")
+    assert reads and all(isinstance(args, slice) for args in reads)
+    assert all(args.stop - args.start <= 16 for args in reads)
+    monkeypatch.undo()
+    nxroot.save(str(tmp_path / "gzip.nxs"), mode="w")
+    with h5py.File(tmp_path / "gzip.nxs", "r") as h5file:
+        signals = []
+        h5file.visititems(
+            lambda name, obj: (
+                signals.append(obj)
+                if isinstance(obj, h5py.Dataset) and obj.shape == values.shape
+                else None
+            )
+        )
+        (signal,) = signals
+        assert signal.compression == "gzip"
+        assert np.array_equal(signal[()], values)
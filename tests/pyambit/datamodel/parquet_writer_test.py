@@ -0,0 +1,108 @@
+import json
+import os.path
+from pathlib import Path
+
+import pytest
+
+from pyambit.datamodel import (
+    EffectArray,
+    EffectRecord,
+    EffectResult,
+    ProtocolApplication,
+    Study,
+    Value,
+    ValueArray,
+)
+
+pa = pytest.importorskip("pyarrow")
+ds = pytest.importorskip("pyarrow.dataset")
+
+from pyambit import parquet_writer  # noqa: E402,F401
+from pyambit.parquet_parser import open_dataset, read_parquet  # noqa: E402
+
+TEST_DIR = Path(__file__).parent.parent / "resources"
+
+
+@pytest.fixture(scope="module")
+def study():
+    with open(os.path.join(TEST_DIR, "study.json"), "r", encoding="utf-8") as file:
+        return Study(**json.load(file))
+
+
+def records(papp):
+    return [effect for effect in papp.effects if not isinstance(effect, EffectArray)]
+
+
+def test_parquet_roundtrip(study, tmp_path):
+    files = study.to_parquet(str(tmp_path), batch_rows=500)
+    assert len(files) > 1
+    assert all("topcategory=" in file and "category=" in file for file in files)
+
+    effects = read_parquet(str(tmp_path))
+    for papp in study.study:
+        key = (papp.owner.substance.uuid, papp.uuid)
+        assert effects.get(key, []) == records(papp)
+
+    dataset = open_dataset(str(tmp_path))
+    tox = dataset.to_table(filter=ds.field("topcategory") == "TOX")
+    assert tox.num_rows == sum(
+        len(records(papp)) for papp in study.study if papp.protocol.topcategory == "TOX"
+    )
+    tables = read_parquet(
+        str(tmp_path), filter=ds.field("topcategory") == "TOX", as_table=True
+    )
+    assert sum(table.rows for table in tables.values()) == tox.num_rows
+
+
+def test_to_arrow_conditions(tmp_path):
+    effects = [
+        EffectRecord(
+            endpoint="E",
+            conditions=conditions,
+            result=EffectResult(loValue=1.5, unit="%"),
+        )
+        for conditions in [
+            {"CONCENTRATION": Value(loValue=10, unit="ug/ml"), "MATERIAL": "A"},
+            {"REPLICATE": "Replicate 2", "TIME": 2.5},
+            {},
+        ]
+    ]
+    effects.insert(1, EffectArray(endpoint="S", conditions={}, signal=ValueArray()))
+    papp = ProtocolApplication(uuid="P1", effects=effects)
+
+    table = papp.to_arrow("S1")
+    assert table.num_rows == 3
+    assert table.column("effect_index").to_pylist() == [0, 2, 3]
+    assert table.column("MATERIAL").to_pylist()[0]["text"] == "A"
+    assert table.column("REPLICATE").to_pylist()[1]["integer"] == 2
+    assert table.column("CONCENTRATION").to_pylist()[1] is None
+
+    papp_table = papp.model_copy(deep=True)
+    papp_table.tabulate_effects()
+    assert papp_table.to_arrow("S1").column("effect_index").to_pylist() == [0, 1, 2]
+    papp_table.to_parquet(str(tmp_path))
+    assert read_parquet(str(tmp_path)) == {(None, "P1"): records(papp)}
+
+    with pytest.raises(ValueError):
+        ProtocolApplication(
+            uuid="P2", effects=[EffectRecord(endpoint="E", conditions={"unit": "x"})]
+        ).to_arrow()
+
+
+def test_parquet_empty_result_bool_condition(tmp_path):
+    effects = [
+        EffectRecord.model_construct(
+            endpoint="E", conditions={"TREATED": True}, result=EffectResult()
+        ),
+        EffectRecord.model_construct(
+            endpoint="E", conditions={"TREATED": False}, result=None
+        ),
+    ]
+    papp = ProtocolApplication(uuid="P1", effects=effects)
+    assert papp.to_arrow().column("has_result").to_pylist() == [True, False]
+    papp.to_parquet(str(tmp_path))
+
+    (read,) = read_parquet(str(tmp_path)).values()
+    assert [effect.result for effect in read] == [EffectResult(), None]
+    assert [effect.conditions["TREATED"] for effect in read] == [True, False]
+    assert all(type(effect.conditions["TREATED"]) is bool for effect in read)
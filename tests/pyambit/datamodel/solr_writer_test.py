@@ -1,12 +1,21 @@
+import http.server
 import json
 import os.path
 import tempfile
+import threading
 from pathlib import Path
 
+import numpy as np
 import pytest
-from pyambit.datamodel import Study, Substances
+from pyambit.datamodel import (
+    EffectArray,
+    EffectRecordTable,
+    Study,
+    Substances,
+    ValueArray,
+)
 
-from pyambit.solr_writer import Ambit2Solr
+from pyambit.solr_writer import Ambit2Solr, SolrError, SolrIndexState
 
 TEST_DIR = Path(__file__).parent.parent / "resources"
 
@@ -37,3 +46,249 @@ def test_substances(substances):
     print(_file)
     with open(_file, "w") as file:
         json.dump(_json, file)
+
+
+def test_write_stream(substances, tmp_path):
+    writer = Ambit2Solr(prefix="TEST")
+    expected = json.loads(json.dumps(writer.to_json(substances)))
+
+    files = writer.write_stream(substances, str(tmp_path / "solr.ndjson"))
+    assert files == [str(tmp_path / "solr.ndjson")]
+    with open(files[0], "r", encoding="utf-8") as file:
+        assert [json.loads(line) for line in file] == expected
+
+    writer.write(substances, str(tmp_path / "solr.json"))
+    with open(tmp_path / "solr.json", "r") as file:
+        assert file.read() == json.dumps(writer.to_json(substances))
+
+
+def test_write_stream_rotate(substances, tmp_path):
+    writer = Ambit2Solr(prefix="TEST")
+    records = [substances.substance[0]] * 5
+    size = len(json.dumps(writer.substancerecord2solr(records[0])))
+    files = writer.write_stream(
+        (record for record in records),
+        str(tmp_path / "solr.json"),
+        format="json",
+        max_file_size=2 * size + 10,
+    )
+    assert [os.path.basename(f) for f in files] == [
+        "solr_00000.json",
+        "solr_00001.json",
+        "solr_00002.json",
+    ]
+    docs = []
+    for file in files:
+        assert os.path.getsize(file) <= 2 * size + 10
+        with open(file, "r", encoding="utf-8") as f:
+            docs.extend(json.load(f))
+    assert len(docs) == 5
+
+
+class SolrStandIn(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.requests.append((self.path, json.loads(body)))
+            fail = self.server.failures > 0
+            self.server.failures -= 1
+        status, content = (503, b"busy") if fail else (200, b'{"responseHeader":{}}')
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def solr_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SolrStandIn)
+    server.requests = []
+    server.failures = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_index(substances, solr_server):
+    solr_server.failures = 2
+    url = "http://127.0.0.1:{}/solr/test/update".format(solr_server.server_port)
+    writer = Ambit2Solr(prefix="TEST")
+    stats = writer.index(
+        [substances.substance[0]] * 5,
+        url,
+        batch_size=2,
+        concurrency=2,
+        commit_within=1000,
+        backoff=0.01,
+    )
+    assert stats == {"documents": 5, "batches": 3}
+    batches = [docs for path, docs in solr_server.requests if "commitWithin" in path]
+    assert sorted(len(docs) for docs in batches) == [1, 2, 2, 2, 2]  # 2 retried
+    path, body = solr_server.requests[-1]
+    assert path == "/solr/test/update?commit=true" and body == {}
+    assert batches[-1][0] == writer.substancerecord2solr(substances.substance[0])
+
+
+def test_index_error(substances, solr_server):
+    solr_server.failures = 10
+    url = "http://127.0.0.1:{}/update".format(solr_server.server_port)
+    with pytest.raises(SolrError) as err:
+        Ambit2Solr(prefix="TEST").index(
+            substances, url, commit=False, retries=2, backoff=0.01
+        )
+    assert err.value.status == 503
+    assert len(solr_server.requests) == 3
+
+
+def test_substances2solr_workers(substances):
+    writer = Ambit2Solr(prefix="TEST")
+    _substances = Substances(
+        substance=[
+            substance.model_copy(update={"i5uuid": "S-{}".format(i)})
+            for i, substance in enumerate(substances.substance * 6)
+        ]
+    )
+    expected = writer.substances2solr(_substances)
+    assert [doc["id"] for doc in expected] == ["S-{}".format(i) for i in range(6)]
+    assert writer.substances2solr(_substances, workers=2, shard_size=2) == expected
+    unordered = writer.substances2solr(_substances, workers=2, ordered=False)
+    assert sorted(unordered, key=lambda doc: doc["id"]) == expected
+
+
+def test_iter_delta(substances, tmp_path):
+    writer = Ambit2Solr(prefix="TEST")
+    records = [
+        substance.model_copy(update={"i5uuid": "S-{}".format(i)})
+        for i, substance in enumerate(substances.substance * 3)
+    ]
+    state_file = str(tmp_path / "state.sqlite")
+
+    def delta(records):
+        with SolrIndexState(state_file) as state:
+            docs = list(writer.iter_delta(records, state))
+            return [doc["id"] for doc in docs], state.removed()
+
+    assert delta(records) == (["S-0", "S-1", "S-2"], [])
+    assert delta(records) == ([], [])
+
+    study = records[1].study
+    changed = study[0].model_copy(update={"updated": "2024-01-01 00:00:00"})
+    records[1] = records[1].model_copy(update={"study": [changed] + study[1:]})
+    assert delta(records) == (["S-1"], [])
+    assert delta(records) == ([], [])
+    assert delta(records[1:]) == ([], ["S-0"])
+
+    files = writer.write_stream(
+        records, str(tmp_path / "delta.json"), format="json", state_file=state_file
+    )
+    assert files == [str(tmp_path / "delta.json")]
+    with open(files[0], "r", encoding="utf-8") as file:
+        assert [doc["id"] for doc in json.load(file)] == ["S-0"]
+
+
+def test_index_delta(substances, solr_server, tmp_path):
+    url = "http://127.0.0.1:{}/update".format(solr_server.server_port)
+    writer = Ambit2Solr(prefix="TEST")
+    records = [
+        substance.model_copy(update={"i5uuid": "S-{}".format(i)})
+        for i, substance in enumerate(substances.substance * 2)
+    ]
+    state_file = str(tmp_path / "state.sqlite")
+    stats = writer.index(records, url, state_file=state_file)
+    assert stats == {"documents": 2, "batches": 1, "deleted": 0}
+    stats = writer.index(records[1:], url, state_file=state_file)
+    assert stats == {"documents": 0, "batches": 0, "deleted": 1}
+    assert solr_server.requests[-2][1] == {"delete": ["S-0"]}
+
+
+def test_embeddings2solr(substances, tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((3, 8))
+    papp = substances.substance[0].study[0]
+    study = [
+        papp.model_copy(
+            update={
+                "uuid": "E-{}".format(i),
+                "effects": [
+                    EffectArray(
+                        endpoint="text_embedding",
+                        endpointtype="embeddings",
+                        conditions={},
+                        signal=ValueArray(values=vectors[i : i + 1]),
+                    )
+                ],
+            }
+        )
+        for i in range(3)
+    ]
+    record = substances.substance[0].model_copy(update={"study": study})
+    writer = Ambit2Solr(prefix="TEST", normalize_embeddings=True)
+    doc = writer.substancerecord2solr(record)
+    embedded = np.array([child["text_embedding"] for child in doc["_childDocuments_"]])
+    expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    assert np.array_equal(embedded.astype(np.float32), expected.astype(np.float32))
+    assert writer.embedding_schema()["add-field"] == [
+        {
+            "name": "text_embedding",
+            "type": "knn_vector_8",
+            "indexed": True,
+            "stored": True,
+        }
+    ]
+
+    files = writer.write_stream([record], str(tmp_path / "docs.json"))
+    assert files == [str(tmp_path / "docs.json")]
+    assert not (tmp_path / "docs_schema.json").exists()
+    files = writer.write_stream(
+        [record], str(tmp_path / "docs.json"), write_schema=True
+    )
+    assert files[-1] == str(tmp_path / "docs_schema.json")
+    with open(files[-1], "r", encoding="utf-8") as file:
+        assert json.load(file) == writer.embedding_schema()
+
+    with pytest.raises(ValueError, match="dimension 4"):
+        Ambit2Solr(
+            prefix="TEST", embeddings={"text_embedding": 4}
+        ).substancerecord2solr(record)
+
+    # the dimensions inferred in the worker processes
+    pooled = Ambit2Solr(prefix="TEST", normalize_embeddings=True)
+    docs = pooled.substances2solr(Substances(substance=[record, record]), workers=2)
+    assert docs == [doc, doc]
+    assert pooled.embedding_schema() == writer.embedding_schema()
+
+    doc = Ambit2Solr(prefix="TEST", embedding_dtype=None).substancerecord2solr(record)
+    assert [child["text_embedding"] for child in doc["_childDocuments_"]] == (
+        vectors.tolist()
+    )
+
+
+def test_entry2solr_table(substances):
+    papp = substances.substance[0].study[0]
+    writer = Ambit2Solr(prefix="TEST")
+    table = EffectRecordTable.from_records(papp.effects)
+    for effect, (endpoint, endpointtype, result, conditions) in zip(
+        papp.effects, writer.effecttable2solr(table)
+    ):
+        expected = {}
+        writer.effectrecord2solr(effect, expected)
+        assert (endpoint, endpointtype, result) == (
+            effect.endpoint,
+            effect.endpointtype,
+            expected,
+        )
+        assert dict(conditions) == {
+            key: value for key, value in effect.conditions.items() if value is not None
+        }
+    papp_table = papp.model_copy(deep=True)
+    papp_table.tabulate_effects()
+    assert writer.entry2solr(papp_table) == writer.entry2solr(papp)
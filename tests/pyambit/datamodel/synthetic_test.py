@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+
+from pyambit import synthetic
+from pyambit.datamodel import EffectArray, Study, Substances
+
+
+def test_study_json():
+    data = synthetic.study_json(n_studies=3, n_conc=5, n_time=2, n_replicate=4)
+    assert data == synthetic.study_json(n_studies=3, n_conc=5, n_time=2, n_replicate=4)
+    assert data != synthetic.study_json(
+        n_studies=3, n_conc=5, n_time=2, n_replicate=4, seed=1
+    )
+    study = Study(**data)
+    assert [len(papp.effects) for papp in study.study] == [40] * 3
+
+    arrays, _ = study.study[0].convert_effectrecords2array()
+    assert len(arrays) == 1
+    assert arrays[0].signal.values.shape == (5, 2, 4)
+    assert arrays[0].axis_groups == {"CONCENTRATION": ["CONCENTRATION_MASS"]}
+
+
+def test_synthetic_spectra(tmp_path):
+    study = synthetic.synthetic_study(
+        n_studies=2,
+        n_materials=2,
+        spectra_per_study=3,
+        spectrum_length=100,
+        array_encoding="base64",
+    )
+    effects = study.study[0].effects
+    assert len(effects) == 8 * 3 * 3 * 2 + 1
+    assert isinstance(effects[-1], EffectArray)
+    assert effects[-1].signal.values.shape == (3, 100)
+    arrays, _ = study.study[0].convert_effectrecords2array()
+    assert sorted(array.conditions.get("MATERIAL", "") for array in arrays) == [
+        "",
+        "material_0",
+        "material_1",
+    ]
+
+    data = synthetic.substances_json(n_substances=2, studies_per_substance=2)
+    synthetic.write_json(data, str(tmp_path / "substances.json"))
+    with open(tmp_path / "substances.json", "r", encoding="utf-8") as file:
+        substances = Substances(**json.load(file))
+    record = substances.substance[1]
+    assert [papp.owner.substance.uuid for papp in record.study] == [record.i5uuid] * 2
+    assert np.isfinite([e.result.loValue for e in record.study[0].effects]).all()